@@ -6,6 +6,7 @@ from credmark.cmf.model import Model
 from credmark.cmf.model.errors import ModelRunError
 from credmark.cmf.types import Address, Contract, Token
 from credmark.dto import DTO
+from models.credmark.protocols.dexes.curve.stableswap import CurvePoolState
 
 
 # Function to catch naming error while fetching mandatory data
@@ -26,7 +27,7 @@ class CurvePoolPeggingInfo(Contract):
 
 
 @Model.describe(slug="contrib.curve-get-pegging-ratio",
-                version="1.1",
+                version="1.2",
                 display_name="Get pegging ratio for all of Curve's pools",
                 description="Get pegging ratio for all of Curve's pools",
                 category='protocol',
@@ -35,6 +36,34 @@ class CurvePoolPeggingInfo(Contract):
                 output=CurvePoolPeggingInfo)
 class CurveGetPeggingRatio(Model):
     def run(self, input: Contract) -> CurvePoolPeggingInfo:
+        # Balances from the pool state read in one batch
+        pool = Contract(address=input.address)
+        pool_state = CurvePoolState.load(self.context, pool)
+        if pool_state is None:
+            return self.pegging_from_token_balances(input)
+        # Amplification Coeffecient A
+        a = pool.functions.A().call()
+
+        tokens = [Token(address=coin) for coin in pool_state.coins]
+        balances = [token.scaled(balance)
+                    for token, balance in zip(tokens, pool_state.balances)]
+        coin_balances = {token.symbol: balance for token, balance in zip(tokens, balances)}
+        pool_name = 'Curve.fi : ' + '/ '.join(f'{token.name} -{token.symbol}'
+                                              for token in tokens)
+
+        # Calculating ratio, this gives information about peg
+        n = len(balances)
+        ratio = math.prod(balances) / pow((sum(balances)/n), n)
+
+        return CurvePoolPeggingInfo(
+            address=Address(input.address),
+            name=pool_name,
+            coin_balances=coin_balances,
+            A=a,
+            chi=a * ratio,
+            ratio=ratio)
+
+    def pegging_from_token_balances(self, input: Contract) -> CurvePoolPeggingInfo:
         # Converting to CheckSum Address
         pool = Address(input.address)
         # Pool name
@@ -1,4 +1,5 @@
 import math
+from typing import List
 
 import numpy as np
 import pandas as pd
@@ -7,9 +8,65 @@ from credmark.cmf.types import (Account, Accounts, Address, Contract,
                                 NativePosition, NativeToken, Portfolio,
                                 Position, Token, TokenPosition, Tokens)
 from credmark.cmf.types.ledger import TokenTransferTable
+from models.tmp_abi_lookup import ERC_20_TOKEN_CONTRACT_ABI
+from models.utils.multicall import multicall
 
 np.seterr(all='raise')
 
+# Tokens whose balances change without transfers, so a zero net of transfers is verified
+REBASING_TOKENS = {
+    1: {
+        Address('0xae7ab96520de3a18e5e111b5eaab095312d7fe84'),  # stETH
+        Address('0xd46ba6d942050d489dbd938a2c909a5d5039a161'),  # AMPL
+    }
+}
+
+
+def ledger_token_positions(context, addresses: List[Address]) -> List[TokenPosition]:
+    """
+    Token positions of the addresses together, from the net of their transfers up to
+    the context block per token, summed in one ledger query.
+
+    The tokens with a non-zero net, or that rebase, are verified with balanceOf and decimals
+    in one batch of calls. The others are known to be zero. Tokens that do not answer
+    the calls, e.g. NFTs, are skipped.
+    """
+    cols = TokenTransferTable.Columns
+    in_addresses = ', '.join(f"'{address.lower()}'" for address in addresses)
+    value_in = f'CASE WHEN {cols.TO_ADDRESS} IN ({in_addresses}) THEN {cols.VALUE} ELSE 0 END'
+    value_out = f'CASE WHEN {cols.FROM_ADDRESS} IN ({in_addresses}) THEN {cols.VALUE} ELSE 0 END'
+    rows = context.ledger.get_erc20_transfers(
+        columns=[cols.TOKEN_ADDRESS],
+        aggregates=[context.ledger.Aggregate(f'SUM({value_in}) - SUM({value_out})',
+                                             'net_value')],
+        where=(f'({cols.TO_ADDRESS} IN ({in_addresses}) OR '
+               f'{cols.FROM_ADDRESS} IN ({in_addresses})) AND '
+               f'{cols.BLOCK_NUMBER} <= {int(context.block_number)}'),
+        group_by=cols.TOKEN_ADDRESS).data
+
+    rebasing_tokens = REBASING_TOKENS.get(context.chain_id, set())
+    tokens = [Address(row[cols.TOKEN_ADDRESS]) for row in rows
+              if float(row['net_value']) != 0 or
+              Address(row[cols.TOKEN_ADDRESS]) in rebasing_tokens]
+
+    erc20s = [Contract(address=token, abi=ERC_20_TOKEN_CONTRACT_ABI) for token in tokens]
+    n_calls = len(addresses) + 1
+    results = multicall(context,
+                        [f for erc20 in erc20s
+                         for f in ([erc20.functions.balanceOf(address.checksum)
+                                    for address in addresses] +
+                                   [erc20.functions.decimals()])])
+
+    positions = []
+    for n, token in enumerate(tokens):
+        *balances, decimals = results[n * n_calls: (n + 1) * n_calls]
+        if decimals is None or any(balance is None for balance in balances):
+            continue
+        balance = sum(balances) / 10 ** decimals
+        if balance > 0.0:
+            positions.append(TokenPosition(asset=Token(address=token), amount=balance))
+    return positions
+
 
 @Model.describe(slug='account.token-erc20',
                 version='1.0',
@@ -51,7 +108,7 @@ class AccountERC20Token(Model):
 
 @Model.describe(
     slug="account.portfolio",
-    version="0.2",
+    version="0.3",
     display_name="Account Portfolio",
     description="All of the token holdings for an account",
     developer="Credmark",
@@ -72,25 +129,7 @@ class WalletInfoModel(Model):
                 )
             )
 
-        token_addresses = self.context.ledger.get_erc20_transfers(
-            columns=[TokenTransferTable.Columns.TOKEN_ADDRESS],
-            where=' '.join(
-                [f"{TokenTransferTable.Columns.FROM_ADDRESS}='{input.address}'",
-                 'or',
-                 f"{TokenTransferTable.Columns.TO_ADDRESS}='{input.address}'"]),
-            group_by=TokenTransferTable.Columns.TOKEN_ADDRESS
-        )
-
-        for t in list(dict.fromkeys([t['token_address'] for t in token_addresses])):
-            try:
-                token = Token(address=t)
-                balance = token.scaled(token.functions.balanceOf(input.address).call())
-                if balance > 0.0:
-                    positions.append(
-                        TokenPosition(asset=token, amount=balance))
-            except Exception as _err:
-                # TODO: currently skip NFTs
-                pass
+        positions.extend(ledger_token_positions(self.context, [input.address]))
 
         curve_lp_position = self.context.run_model(
             'account.position-in-curve',
@@ -104,7 +143,7 @@ class WalletInfoModel(Model):
 
 @ Model.describe(
     slug="account.portfolio-aggregate",
-    version="0.1",
+    version="0.2",
     display_name="Account Portfolios for a list of Accounts",
     description="All of the token holdings for an account",
     developer="Credmark",
@@ -115,37 +154,11 @@ class WalletInfoModel(Model):
     output=Portfolio)
 class AccountsPortfolio(Model):
     def run(self, input: Accounts) -> Portfolio:
-        token_addresses = []
         native_balance = 0.0
         for a in input:
-            token_addresses += self.context.ledger.get_erc20_transfers(
-                columns=[TokenTransferTable.Columns.TOKEN_ADDRESS],
-                where=' '.join(
-                    [f"{TokenTransferTable.Columns.FROM_ADDRESS}='{a.address}'",
-                     "or",
-                     f"{TokenTransferTable.Columns.TO_ADDRESS}='{a.address}'"]),
-                group_by=TokenTransferTable.Columns.TOKEN_ADDRESS)
             native_balance += self.context.web3.eth.get_balance(a.address)
-        positions = []
 
-        for t in set(dict.fromkeys([t['token_address'] for t in token_addresses])):
-            try:
-                token = Token(address=t)
-                balance = sum([token.scaled(token.functions.balanceOf(a.address).call())
-                               for a in input])
-                if balance > 0.0:
-                    found = False
-                    for p in positions:
-                        if p.asset.address == token.address:
-                            p.amount += balance
-                            found = True
-                            break
-                    if not found:
-                        positions.append(
-                            TokenPosition(asset=token, amount=balance))
-            except Exception as _err:
-                # TODO: currently skip NFTs
-                pass
+        positions = ledger_token_positions(self.context, [a.address for a in input])
 
         positions.append(
             NativePosition(
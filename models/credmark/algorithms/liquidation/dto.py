@@ -0,0 +1,33 @@
+from typing import List
+
+from credmark.cmf.types import Portfolio, Token
+from credmark.dto import DTO, DTOField
+
+
+class LiquidationStressInput(DTO):
+    shocks: List[float] = DTOField(
+        [-0.5, -0.4, -0.3, -0.2, -0.1, 0.0],
+        description='Relative changes of the prices of the shocked assets, one scenario each')
+    shockedAssets: List[Token] = DTOField(
+        [], description='Assets whose prices are shocked, all assets if empty')
+
+    class Config:
+        schema_extra = {
+            'examples': [{'shocks': [-0.5, -0.3, -0.1]},
+                         {'shocks': [-0.3], 'shockedAssets': [{'symbol': 'WETH'}]}]
+        }
+
+
+class LiquidationStressScenario(DTO):
+    shock: float
+    liquidatableAccounts: int
+    collateralValue: float
+    debtValue: float
+    liquidatableCollateralValue: float
+    liquidatableDebtValue: float
+    liquidatableCollateral: Portfolio
+
+
+class LiquidationStressOutput(DTO):
+    accounts: int
+    scenarios: List[LiquidationStressScenario]
@@ -0,0 +1,149 @@
+from typing import List
+
+import numpy as np
+import pandas as pd
+from credmark.cmf.model import Model
+from credmark.cmf.types import Address, Contract, Portfolio, Position, Token
+from credmark.dto import EmptyInput
+from models.credmark.algorithms.liquidation.dto import (
+    LiquidationStressInput, LiquidationStressOutput, LiquidationStressScenario)
+from models.credmark.algorithms.liquidation.stress import (HealthFactorStress,
+                                                           shock_grid)
+from models.credmark.protocols.lending.aave.aave_v2_history import \
+    AaveReserveHistory
+from models.credmark.protocols.lending.aave.aave_v2_market import \
+    AaveV2MarketSnapshot
+from models.credmark.protocols.lending.compound.compound_v2 import get_markets
+from models.credmark.protocols.lending.compound.compound_v2_accounts import \
+    CompoundAccountHistory
+from models.dtos.price import Prices
+
+
+class LiquidationStress(Model):
+    """
+    Accounts of a lending market that become liquidatable under a grid of price shocks,
+    from the positions of the accounts in the ledger, evaluated with HealthFactorStress.
+    """
+
+    def token_prices(self, tokens: List[Address]) -> np.ndarray:
+        unique_tokens = list(dict.fromkeys(tokens))
+        prices = self.context.run_model(slug='price.quote-multiple',
+                                        input={'inputs': [{'base': Token(address=token)}
+                                                          for token in unique_tokens]},
+                                        return_type=Prices)
+        price_by_token = {token: price.price for token, price in zip(unique_tokens, prices)}
+        return np.array([price_by_token[token] for token in tokens], dtype=float)
+
+    def stress(self, input: LiquidationStressInput, positions: pd.DataFrame,
+               assets: List[str], tokens: List[Address],
+               thresholds: np.ndarray) -> LiquidationStressOutput:
+        """
+        Positions in quantities of the assets, e.g. cTokens, each of which holds the token
+        that is priced and shocked.
+        """
+        shocked_tokens = {token.address for token in input.shockedAssets}
+        shocked = np.array([len(shocked_tokens) == 0 or token in shocked_tokens
+                            for token in tokens])
+        multipliers = shock_grid(shocked, input.shocks)
+        prices = self.token_prices(tokens)
+
+        engine = HealthFactorStress.from_positions(positions, assets)
+        result = engine.run(prices, thresholds, multipliers)
+
+        collateral_value = result.collateral_value.sum(axis=0, dtype=float)
+        debt_value = result.debt_value.sum(axis=0, dtype=float)
+        liquidatable_collateral_value = (result.collateral_value *
+                                         result.liquidatable).sum(axis=0, dtype=float)
+        liquidatable_debt_value = (result.debt_value *
+                                   result.liquidatable).sum(axis=0, dtype=float)
+        liquidatable_accounts = result.liquidatable.sum(axis=0)
+
+        scenarios = []
+        for n, shock in enumerate(input.shocks):
+            # Assets of the same token, e.g. two cTokens of WBTC, are one position
+            amounts = (pd.Series(result.liquidatable_collateral[n], index=tokens, dtype=float)
+                       .groupby(level=0, sort=False).sum())
+            portfolio = Portfolio(positions=[Position(asset=Token(address=token), amount=amount)
+                                             for token, amount in amounts.items() if amount > 0])
+            scenarios.append(LiquidationStressScenario(
+                shock=shock,
+                liquidatableAccounts=int(liquidatable_accounts[n]),
+                collateralValue=collateral_value[n],
+                debtValue=debt_value[n],
+                liquidatableCollateralValue=liquidatable_collateral_value[n],
+                liquidatableDebtValue=liquidatable_debt_value[n],
+                liquidatableCollateral=portfolio))
+
+        return LiquidationStressOutput(accounts=len(engine.accounts), scenarios=scenarios)
+
+
+@Model.describe(slug="finance.liquidation-stress-aave",
+                version="1.0",
+                display_name="Aave V2 liquidation stress",
+                description="Collateral of Aave V2 accounts that becomes liquidatable "
+                "under price shocks",
+                category='protocol',
+                subcategory='aave-v2',
+                tags=['liquidation'],
+                input=LiquidationStressInput,
+                output=LiquidationStressOutput)
+class AaveV2LiquidationStress(LiquidationStress):
+    """
+    Health factors of the accounts of the Aave V2 main lending pool, with the collateral
+    weighted by the liquidation threshold of its reserve. The positions come from
+    AaveReserveHistory, i.e. the lending pool's events scaled by the reserve indices.
+    """
+
+    def run(self, input: LiquidationStressInput) -> LiquidationStressOutput:
+        aave_lending_pool = self.context.run_model('aave-v2.get-lending-pool',
+                                                   input=EmptyInput(),
+                                                   return_type=Contract)
+        reserves = AaveV2MarketSnapshot.load(self.context, self.logger, aave_lending_pool).reserves
+        history = AaveReserveHistory.open(self.context, aave_lending_pool)
+        positions = (history.account_positions(int(self.context.block_number))
+                     .rename(columns={'reserve': 'asset'}))
+
+        assets = [str(asset) for asset in reserves.asset]
+        scale = 10.0 ** positions.asset.map(dict(zip(assets, reserves.decimals))).astype(float)
+        positions['collateral'] = positions.collateral / scale
+        positions['debt'] = positions.debt / scale
+
+        return self.stress(input, positions, assets, list(reserves.asset),
+                           reserves.liquidationThreshold.to_numpy())
+
+
+@Model.describe(slug="finance.liquidation-stress-compound",
+                version="1.0",
+                display_name="Compound V2 liquidation stress",
+                description="Collateral of Compound V2 accounts that becomes liquidatable "
+                "under price shocks",
+                category='protocol',
+                subcategory='compound',
+                tags=['liquidation'],
+                input=LiquidationStressInput,
+                output=LiquidationStressOutput)
+class CompoundV2LiquidationStress(LiquidationStress):
+    """
+    Health factors of the accounts of Compound V2, with the collateral weighted by the
+    collateral factor of its market. The positions come from CompoundAccountHistory,
+    with the cTokens converted to the underlying at the exchange rate of the market.
+    """
+
+    def run(self, input: LiquidationStressInput) -> LiquidationStressOutput:
+        pools = self.context.run_model(slug='compound-v2.get-pools')
+        c_tokens = [Address(c_token) for c_token in pools['cTokens']]
+        markets = get_markets(self, c_tokens)
+        history = CompoundAccountHistory.open(self.context)
+        positions = (history.account_positions(c_tokens, int(self.context.block_number))
+                     .rename(columns={'cToken': 'asset'}))
+
+        assets = [str(c_token) for c_token in markets.cToken]
+        by_c_token = markets.set_index(pd.Index(assets))
+        c_token_scale = 10.0 ** positions.asset.map(by_c_token.cTokenDecimal).astype(float)
+        token_scale = 10.0 ** positions.asset.map(by_c_token.tokenDecimal).astype(float)
+        positions['collateral'] = (positions.collateral / c_token_scale /
+                                   positions.asset.map(by_c_token.invExchangeRate))
+        positions['debt'] = positions.debt / token_scale
+
+        return self.stress(input, positions, assets, list(markets.token),
+                           markets.collateralFactor.to_numpy())
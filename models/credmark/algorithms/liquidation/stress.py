@@ -0,0 +1,99 @@
+from typing import List, NamedTuple
+
+import numpy as np
+import pandas as pd
+from credmark.cmf.model.errors import ModelDataError
+from scipy import sparse
+
+
+class StressResult(NamedTuple):
+    """
+    Values in the quote currency of the prices, for S scenarios and n assets:
+    liquidatable of shape (accounts, S), collateral_value and debt_value of the accounts
+    of shape (accounts, S), liquidatable_collateral in quantities of shape (S, n).
+    """
+    liquidatable: np.ndarray
+    collateral_value: np.ndarray
+    debt_value: np.ndarray
+    liquidatable_collateral: np.ndarray
+
+
+def shock_grid(shocked: np.ndarray, shocks: List[float]) -> np.ndarray:
+    """
+    Price multipliers of shape (assets, scenarios): 1 + shock for the shocked assets, 1 otherwise.
+    """
+    shocks = np.asarray(shocks, dtype=np.float32)
+    return np.where(np.asarray(shocked, dtype=bool)[:, None],
+                    1 + shocks[None, :], np.float32(1)).astype(np.float32)
+
+
+class HealthFactorStress:
+    """
+    Health factors of the accounts of a lending market under a grid of price shocks.
+
+    Collateral and debt quantities are sparse (accounts, assets) matrices in float32.
+    A scenario is a column of price multipliers of the assets, so the values of all accounts
+    under all scenarios are two sparse-dense products:
+
+        weighted collateral = C @ (multipliers * price * threshold)
+        debt = D @ (multipliers * price)
+
+    The threshold is the liquidation threshold (Aave) or collateral factor (Compound) of
+    the asset. An account with debt is liquidatable when its health factor,
+    weighted collateral / debt, is below 1.
+    """
+
+    def __init__(self, accounts: np.ndarray, assets: np.ndarray,
+                 collateral: sparse.csr_matrix, debt: sparse.csr_matrix):
+        self.accounts = accounts
+        self.assets = assets
+        self.collateral = collateral
+        self.debt = debt
+
+    @classmethod
+    def from_positions(cls, positions: pd.DataFrame, assets: List) -> 'HealthFactorStress':
+        """
+        Positions with columns account, asset, collateral and debt, in quantities of the asset.
+        Assets are the columns of the matrices, in their order.
+        """
+        accounts, account_n = np.unique(positions.account.to_numpy(dtype=str),
+                                        return_inverse=True)
+        asset_n = pd.Index(assets).get_indexer(positions.asset)
+        if (asset_n < 0).any():
+            raise ModelDataError(f'Positions in {positions.asset[asset_n < 0].iloc[0]} '
+                                 'that is not one of the assets')
+
+        shape = (len(accounts), len(assets))
+        return cls(accounts, np.asarray(assets),
+                   cls.sparse_matrix(positions.collateral, account_n, asset_n, shape),
+                   cls.sparse_matrix(positions.debt, account_n, asset_n, shape))
+
+    @staticmethod
+    def sparse_matrix(values: pd.Series, rows: np.ndarray, cols: np.ndarray, shape) \
+            -> sparse.csr_matrix:
+        values = values.to_numpy(dtype=np.float32)
+        non_zero = values != 0
+        return sparse.csr_matrix((values[non_zero], (rows[non_zero], cols[non_zero])),
+                                 shape=shape, dtype=np.float32)
+
+    def run(self, prices: np.ndarray, thresholds: np.ndarray,
+            multipliers: np.ndarray) -> StressResult:
+        """
+        Evaluate the accounts in all scenarios, with the prices and thresholds of the assets
+        and the multipliers of shape (assets, scenarios) from shock_grid.
+        """
+        prices = np.asarray(prices, dtype=np.float32)[:, None]
+        thresholds = np.asarray(thresholds, dtype=np.float32)[:, None]
+        multipliers = np.asarray(multipliers, dtype=np.float32)
+
+        weighted_collateral = self.collateral @ (multipliers * prices * thresholds)
+        debt_value = self.debt @ (multipliers * prices)
+
+        health_factor = np.full(debt_value.shape, np.inf, dtype=np.float32)
+        np.divide(weighted_collateral, debt_value, out=health_factor, where=debt_value > 0)
+        liquidatable = health_factor < 1
+
+        collateral_value = self.collateral @ (multipliers * prices)
+        liquidatable_collateral = (self.collateral.T @ liquidatable.astype(np.float32)).T
+        return StressResult(liquidatable, collateral_value, debt_value,
+                            np.asarray(liquidatable_collateral))
@@ -0,0 +1,62 @@
+from typing import Dict, List, Optional, Tuple
+
+from credmark.cmf.types import Address
+from models.utils.store import SQLiteStore
+
+PRICE_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    chain_id INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    sample_timestamp INTEGER NOT NULL,
+    block_number INTEGER NOT NULL,
+    block_timestamp INTEGER NOT NULL,
+    price REAL NOT NULL,
+    src TEXT,
+    PRIMARY KEY (chain_id, token, sample_timestamp)
+);
+"""
+
+
+class PriceSeriesStore:
+    """
+    On-disk USD prices of tokens sampled on a fixed time grid, i.e. timestamps that are
+    multiples of the interval, so that samples of an earlier window are reused by a later one.
+    """
+
+    def __init__(self, chain_id: int):
+        self.chain_id = chain_id
+        self.store = SQLiteStore.open('price_series')
+        self.store.execute_script(PRICE_STORE_SCHEMA)
+
+    @staticmethod
+    def sample_timestamps(end_timestamp: int, interval: int, count: int) -> List[int]:
+        """
+        Timestamps of count samples on the grid of interval ending at or before end_timestamp,
+        in descending order, i.e. the window of finance.var-portfolio-historical.
+        """
+        aligned_end = end_timestamp - end_timestamp % interval
+        return [aligned_end - n * interval for n in range(count)]
+
+    def load(self, token: Address, sample_timestamps: List[int]) \
+            -> Dict[int, Tuple[int, float, Optional[str]]]:
+        """
+        Return sample timestamp -> (block number, price, src) for the stored samples.
+        """
+        rows = self.store.query(
+            'SELECT sample_timestamp, block_number, price, src FROM prices '
+            'WHERE chain_id = ? AND token = ? AND sample_timestamp BETWEEN ? AND ?',
+            (self.chain_id, str(token), min(sample_timestamps), max(sample_timestamps)))
+        wanted = set(sample_timestamps)
+        return {r[0]: (r[1], r[2], r[3]) for r in rows if r[0] in wanted}
+
+    def missing(self, token: Address, sample_timestamps: List[int]) -> List[int]:
+        stored = self.load(token, sample_timestamps)
+        return [ts for ts in sample_timestamps if ts not in stored]
+
+    def save(self, token: Address, samples: List[Tuple[int, int, int, float, Optional[str]]]):
+        """
+        samples of (sample timestamp, block number, block timestamp, price, src)
+        """
+        self.store.execute_many([
+            ('INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)',
+             [(self.chain_id, str(token), *sample) for sample in samples])])
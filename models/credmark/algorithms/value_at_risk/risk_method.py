@@ -30,58 +30,42 @@ class ESOutput(DTO):
     var_result: VaROutput
 
 
-def calc_var(ppl, lvl) -> VaROutput:
+def check_level(lvl):
     if lvl < 0 or lvl > 1:
         raise ModelRunError(f'Invalid confidence level {lvl=}')
 
-    ppl_sorted = ppl.copy()
-    ppl_sorted.sort()
-    len_ppl_d = ppl_sorted.shape[0]
-    if len_ppl_d <= 1:
-        raise ModelRunError(f'PPL is too short to calculate VaR {ppl_sorted=}')
-    var = np.percentile(ppl_sorted, lvl*100, method='interpolated_inverted_cdf')
+
+def var_from_sorted(ppl, ppl_sorted, len_ppl_d, lvl, var) -> VaROutput:
+    """
+    ppl_sorted needs to be the sorted ppl, or at least its head up to the VaR's scenarios.
+    """
     where_var = ppl_sorted[np.isclose(ppl_sorted, var)]
     index_var = np.where(ppl_sorted >= var)[0][0]
     if where_var.shape[0] == 0:
         weight_var = [index_var+1-len_ppl_d*lvl, len_ppl_d*lvl - index_var]
         sorted_index = [index_var-1, index_var]
-        unsorted_index = np.where(np.isin(ppl, ppl_sorted[sorted_index]))[0].tolist()
-        return VaROutput(var=float(var),
-                         ppls=ppl_sorted[sorted_index].tolist(),
-                         weights=weight_var,
-                         sorted_index=sorted_index,
-                         unsorted_index=unsorted_index)
     else:
         weight_var = [len_ppl_d*lvl - index_var]
         sorted_index = [index_var]
-        unsorted_index = np.where(np.isin(ppl, ppl_sorted[sorted_index]))[0].tolist()
-        return VaROutput(var=float(var),
-                         ppls=ppl_sorted[sorted_index].tolist(),
-                         weights=weight_var,
-                         sorted_index=sorted_index,
-                         unsorted_index=unsorted_index)
-
+    unsorted_index = np.where(np.isin(ppl, ppl_sorted[sorted_index]))[0].tolist()
+    return VaROutput(var=float(var),
+                     ppls=ppl_sorted[sorted_index].tolist(),
+                     weights=weight_var,
+                     sorted_index=sorted_index,
+                     unsorted_index=unsorted_index)
 
-def calc_es(ppl, lvl) -> ESOutput:
-    """
-    Get the VaR from calc_var.
 
-    ppl = 0 1 2 3 4
-    var =    ^ midpoint of 1 and 2
-    es  = (0 + 1 + 1.5 * 0.5) / 2.5
-    """
-    ppl_dup = ppl.copy()
-    var_result = calc_var(ppl_dup, lvl)
+def es_from_var(ppl, lvl, var_result) -> ESOutput:
     var = var_result.var
     var_weight = var_result.weights
-    multiplier = len(ppl_dup)*lvl
-    sum_of_less_than_var = ppl_dup[ppl_dup < var].sum()
+    multiplier = len(ppl)*lvl
+    sum_of_less_than_var = ppl[ppl < var].sum()
     sum_of_tails = var * var_weight[-1] + sum_of_less_than_var
     unsorted_index = np.where(ppl < var)[0].tolist()
     sorted_index = np.arange(var_result.sorted_index[-1]).tolist()
     es = 1/multiplier * sum_of_tails
     return ESOutput(es=es,
-                    ppls=ppl_dup[ppl_dup < var].tolist() + [var],
+                    ppls=ppl[ppl < var].tolist() + [var],
                     weights=[1.0] * var_result.sorted_index[-1] + [var_result.weights[-1]],
                     multiplier=multiplier,
                     sorted_index=sorted_index,
@@ -89,6 +73,69 @@ def calc_es(ppl, lvl) -> ESOutput:
                     var_result=var_result)
 
 
+def calc_var(ppl, lvl) -> VaROutput:
+    check_level(lvl)
+
+    ppl_sorted = ppl.copy()
+    ppl_sorted.sort()
+    len_ppl_d = ppl_sorted.shape[0]
+    if len_ppl_d <= 1:
+        raise ModelRunError(f'PPL is too short to calculate VaR {ppl_sorted=}')
+    var = np.percentile(ppl_sorted, lvl*100, method='interpolated_inverted_cdf')
+    return var_from_sorted(ppl, ppl_sorted, len_ppl_d, lvl, var)
+
+
+def calc_es(ppl, lvl) -> ESOutput:
+    """
+    Get the VaR from calc_var.
+
+    ppl = 0 1 2 3 4
+    var =    ^ midpoint of 1 and 2
+    es  = (0 + 1 + 1.5 * 0.5) / 2.5
+    """
+    ppl_dup = ppl.copy()
+    var_result = calc_var(ppl_dup, lvl)
+    return es_from_var(ppl_dup, lvl, var_result)
+
+
+def calc_var_es(ppl_matrix, lvls) -> List[List[ESOutput]]:
+    """
+    VaR and ES for each row of the ppl matrix, e.g. (horizons x scenarios),
+    and each of the confidence levels.
+
+    Result[i][j] is the same as calc_es(ppl_matrix[i], lvls[j]).
+    Each row is only partitioned once for the tail up to the highest level, and the tail sorted.
+    """
+    for lvl in lvls:
+        check_level(lvl)
+
+    ppl_matrix = np.atleast_2d(np.asarray(ppl_matrix))
+    len_ppl_d = ppl_matrix.shape[1]
+    if len_ppl_d <= 1:
+        raise ModelRunError(f'PPL is too short to calculate VaR {ppl_matrix=}')
+
+    # (levels x rows)
+    vars_lvl = np.percentile(ppl_matrix, np.array(lvls) * 100,
+                             axis=1, method='interpolated_inverted_cdf').reshape(len(lvls), -1)
+
+    # The VaR interpolates between the scenarios at floor(n * lvl - 1) and the next one.
+    tail_len = min(len_ppl_d, max(int(np.floor(len_ppl_d * lvl - 1)) + 2 for lvl in lvls))
+    if tail_len < len_ppl_d:
+        ppl_tails = np.partition(ppl_matrix, tail_len - 1, axis=1)[:, :tail_len]
+    else:
+        ppl_tails = ppl_matrix.copy()
+    ppl_tails.sort(axis=1)
+
+    result = []
+    for row_n, (ppl, ppl_tail) in enumerate(zip(ppl_matrix, ppl_tails)):
+        row_result = []
+        for lvl_n, lvl in enumerate(lvls):
+            var_result = var_from_sorted(ppl, ppl_tail, len_ppl_d, lvl, vars_lvl[lvl_n, row_n])
+            row_result.append(es_from_var(ppl, lvl, var_result))
+        result.append(row_result)
+    return result
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     test_ppl = np.arange(260)
@@ -118,3 +165,17 @@ if __name__ == '__main__':
 
     assert np.isclose(calc_es(test_ppl_100, 0.05).es, (0 + 1 + 2 + 3 + 4) / 5)
     logging.info(f'ES for [0...100] at 0.05 confidence level is {calc_es(test_ppl_100, 0.05)}')
+
+    test_ppl_matrix = np.vstack([test_ppl_100, test_ppl[::-1][:100] * 0.5, np.sin(np.arange(100))])
+    test_lvls = [0.01, 0.035, 0.05, 0.5]
+    test_var_es = calc_var_es(test_ppl_matrix, test_lvls)
+    for test_row_n, test_row in enumerate(test_ppl_matrix):
+        for test_lvl_n, test_lvl in enumerate(test_lvls):
+            es_single = calc_es(test_row, test_lvl)
+            es_batch = test_var_es[test_row_n][test_lvl_n]
+            assert np.isclose(es_batch.es, es_single.es)
+            assert np.isclose(es_batch.var_result.var, es_single.var_result.var)
+            assert es_batch.var_result.sorted_index == es_single.var_result.sorted_index
+            assert es_batch.var_result.unsorted_index == es_single.var_result.unsorted_index
+            assert np.allclose(es_batch.var_result.weights, es_single.var_result.weights)
+    logging.info(f'VaR/ES for 3 rows at {test_lvls} confidence levels matches calc_es')
@@ -1,16 +1,19 @@
 import numpy as np
-import scipy.stats as sps
 from credmark.cmf.model import Model
-from credmark.cmf.model.errors import ModelRunError
+from credmark.cmf.model.errors import (ModelRunError,
+                                       create_instance_from_error_dict)
 from credmark.cmf.types import Account, Price, PriceList, TokenPosition
 from credmark.cmf.types.compose import MapBlockTimeSeriesOutput
 from models.credmark.accounts.account import CurveLPPosition
 from models.credmark.algorithms.value_at_risk.dto import (AccountVaRInput,
                                                           PortfolioVaRInput,
                                                           VaRHistoricalInput)
+from models.credmark.algorithms.value_at_risk.price_store import \
+    PriceSeriesStore
 from models.credmark.algorithms.value_at_risk.risk_method import (VaROutput,
                                                                   calc_var)
 from models.dtos.price import Prices
+from models.utils.series import PriceSeriesColumns
 
 np.seterr(all='raise')
 
@@ -40,7 +43,7 @@ class AccountVaR(Model):
 
 
 @Model.describe(slug='finance.var-portfolio-historical',
-                version='1.5',
+                version='1.6',
                 display_name='Value at Risk - for a portfolio',
                 description='Calculate VaR based on input portfolio',
                 input=PortfolioVaRInput,
@@ -74,16 +77,13 @@ class VaRPortfolio(Model):
                        "exclusive": False},
                 return_type=MapBlockTimeSeriesOutput[Prices])
 
+            tok_hp_cols = PriceSeriesColumns.from_series(tok_hp, len(assets_to_quote_list))
+
             price_lists = []
             for tok_n, asset_addr in enumerate(assets_to_quote_list):
-                ps = (tok_hp.to_dataframe(fields=[('price', lambda p, n=tok_n:p[n].price),
-                                                  ('src', lambda p, n=tok_n:p.prices[n].src), ])
-                      .sort_values('blockNumber', ascending=False)
-                      .reset_index(drop=True))
-
-                price_list = PriceList(prices=ps['price'].to_list(),
+                price_list = PriceList(prices=tok_hp_cols.prices[tok_n].tolist(),
                                        tokenAddress=asset_addr,
-                                       src=ps['src'].to_list()[0])
+                                       src=tok_hp_cols.src[tok_n, 0])
 
                 price_lists.append(price_list)
             return price_lists
@@ -125,8 +125,123 @@ class VaRPortfolio(Model):
                                       return_type=dict)
 
 
+@Model.describe(slug='finance.var-portfolio-rolling',
+                version='1.1',
+                display_name='Value at Risk - for a portfolio - rolling window',
+                description=('Calculate VaR based on input portfolio with prices sampled on '
+                             'a fixed time grid and kept in a local store across runs'),
+                input=PortfolioVaRInput,
+                output=dict)
+class VaRPortfolioRolling(Model):
+    """
+    Same as finance.var-portfolio-historical, with the window's samples aligned to multiples
+    of the interval. A later run only prices the samples it has not stored yet,
+    e.g. the latest day for a daily window.
+    """
+
+    @staticmethod
+    def missing_runs(missing, interval):
+        """
+        Split the missing sample timestamps into runs of consecutive samples,
+        as (latest sample timestamp, number of samples) in descending order.
+        """
+        runs = []
+        for ts in sorted(missing, reverse=True):
+            if len(runs) > 0 and runs[-1][0] - runs[-1][1] * interval == ts:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((ts, 1))
+        return runs
+
+    def fetch_prices(self, price_store, assets, sample_timestamps, interval):
+        """
+        Price only the missing samples of the assets, one run of consecutive samples at a time.
+        Assets missing the same run are priced together.
+        """
+        assets_by_run = {}
+        for asset_addr, missing in assets.items():
+            for run in self.missing_runs(missing, interval):
+                assets_by_run.setdefault(run, []).append(asset_addr)
+
+        for (end_timestamp, count), asset_addrs in assets_by_run.items():
+            tok_hp = self.context.run_model(
+                slug='compose.map-block-time-series',
+                input={"modelSlug": 'price.quote-multiple',
+                       "modelInput": {'inputs': [{'base': {'address': tok_addr}}
+                                                 for tok_addr in asset_addrs]},
+                       "endTimestamp": end_timestamp,
+                       "interval": interval,
+                       "count": count,
+                       "exclusive": False},
+                return_type=MapBlockTimeSeriesOutput[Prices])
+
+            samples = [[] for _ in asset_addrs]
+            for result in tok_hp:
+                if result.error is not None:
+                    self.logger.error(result.error)
+                    raise create_instance_from_error_dict(result.error.dict())
+                if result.output is None or result.sampleTimestamp not in sample_timestamps:
+                    continue
+                for tok_n, price in enumerate(result.output):
+                    samples[tok_n].append((result.sampleTimestamp,
+                                           result.blockNumber,
+                                           result.blockTimestamp,
+                                           price.price,
+                                           price.src))
+
+            for asset_addr, asset_samples in zip(asset_addrs, samples):
+                price_store.save(asset_addr, asset_samples)
+
+    def run(self, input: PortfolioVaRInput) -> dict:
+        portfolio = input.portfolio
+
+        assets_to_quote = set()
+        for position in portfolio:
+            if isinstance(position, CurveLPPosition):
+                for lp_pos in position.lp_position:
+                    assets_to_quote.add(lp_pos.asset.address)
+            assets_to_quote.add(position.asset.address)
+
+        t_unit, count = self.context.historical.parse_timerangestr(input.window)
+        interval = self.context.historical.range_timestamp(t_unit, 1)
+
+        price_store = PriceSeriesStore(self.context.chain_id)
+        sample_timestamps = price_store.sample_timestamps(
+            self.context.block_number.timestamp, interval, count)
+
+        assets_missing = {}
+        for asset_addr in assets_to_quote:
+            missing = price_store.missing(asset_addr, sample_timestamps)
+            if len(missing) > 0:
+                assets_missing[asset_addr] = missing
+
+        if len(assets_missing) > 0:
+            self.fetch_prices(price_store, assets_missing, sample_timestamps, interval)
+
+        price_lists = []
+        for asset_addr in assets_to_quote:
+            stored = price_store.load(asset_addr, sample_timestamps)
+            if len(stored) != len(sample_timestamps):
+                raise ModelRunError(
+                    f'Missing {len(sample_timestamps) - len(stored)} '
+                    f'price samples for {asset_addr}')
+            price_lists.append(PriceList(prices=[stored[ts][1] for ts in sample_timestamps],
+                                         tokenAddress=asset_addr,
+                                         src=stored[sample_timestamps[0]][2]))
+
+        var_input = {
+            'portfolio': portfolio,
+            'priceLists': price_lists,
+            'interval': input.interval,
+            'confidence': input.confidence}
+
+        return self.context.run_model(slug='finance.var-engine-historical',
+                                      input=var_input,
+                                      return_type=dict)
+
+
 @Model.describe(slug='finance.var-engine-historical',
-                version='1.5',
+                version='1.6',
                 display_name='Value at Risk',
                 description='Value at Risk',
                 category='financial',
@@ -137,89 +252,95 @@ class VaREngineHistorical(Model):
     This is the final step that consumes portfolio and the prices
     to calculate VaR(s) according to the VaR parameters.
     The prices in priceLists is asssumed be sorted in descending order in time.
-    """
 
-    value_list = []
-    total_value = 0
-    all_ppl_arr = np.array([])
-
-    def calculate_ppl(self, token, amount, input):
-        priceLists = [pl for pl in input.priceLists if pl.tokenAddress == token.address]
-
-        if len(priceLists) != 1:
-            raise ModelRunError(f'There is no or more than 1 pricelist for {token.address=}')
-
-        np_priceList = np.array(priceLists[0].prices)
+    The returns of all assets are put in one (scenarios x assets) matrix. The potential profit&loss
+    of the positions is the product with the (assets x positions) matrix of position values.
+    """
 
-        if input.interval > np_priceList.shape[0]-2:
-            raise ModelRunError(
-                f'Interval {input.interval} is shall be of at most input list '
-                f'({np_priceList.shape[0]}-2) long.')
+    def get_price_matrix(self, input, token_addresses):
+        """
+        Return the (prices x assets) matrix for the token addresses in the column order.
+        """
+        price_list_index = {}
+        for n, pl in enumerate(input.priceLists):
+            price_list_index.setdefault(pl.tokenAddress, []).append(n)
+
+        price_matrix = None
+        for col, token_address in enumerate(token_addresses):
+            price_list_n = price_list_index.get(token_address, [])
+            if len(price_list_n) != 1:
+                raise ModelRunError(
+                    f'There is no or more than 1 pricelist for token.address={token_address}')
 
-        value = amount * np_priceList[0]
-        self.total_value += value
-        self.value_list.append((token.address, amount, np_priceList[0], value))
-        ret_series = np_priceList[:-input.interval] / np_priceList[input.interval:] - 1
-        # ppl: potential profit&loss
-        ppl_vector = value * ret_series
-        return ppl_vector
+            prices = input.priceLists[price_list_n[0]].prices
+            if input.interval > len(prices)-2:
+                raise ModelRunError(
+                    f'Interval {input.interval} is shall be of at most input list '
+                    f'({len(prices)}-2) long.')
 
-    def fill_ppl(self, ppl_vector, token):
-        if self.all_ppl_arr.shape[0] == 0:
-            self.all_ppl_arr = ppl_vector[:, np.newaxis]
-        else:
-            ppl_vec_len = ppl_vector.shape[0]
-            all_ppl_vec_len = self.all_ppl_arr.shape[0]
-            if all_ppl_vec_len != ppl_vec_len:
+            if price_matrix is None:
+                price_matrix = np.empty((len(prices), len(token_addresses)))
+            elif price_matrix.shape[0] != len(prices):
                 raise ModelRunError(
-                    f'Input priceList for {token.address} has '
-                    f'difference lengths has {ppl_vec_len} != {all_ppl_vec_len}')
+                    f'Input priceList for {token_address} has '
+                    f'difference lengths has {len(prices)} != {price_matrix.shape[0]}')
 
-            self.all_ppl_arr = np.column_stack([self.all_ppl_arr, ppl_vector])
+            price_matrix[:, col] = prices
 
-    def run(self, input: VaRHistoricalInput) -> dict:
-        self.value_list = []
-        self.total_value = 0
-        self.all_ppl_arr = np.array([])
-
-        for _pos_n, pos in enumerate(input.portfolio):
-            if isinstance(pos, CurveLPPosition):
-                lp_vec_ppl = None
-                for _lp_pos_n, lp_pos in enumerate(pos.lp_position):
-                    token = lp_pos.asset
-                    amount = lp_pos.amount
-                    ppl_vector = self.calculate_ppl(token, amount, input)
-                    if lp_vec_ppl is None:
-                        lp_vec_ppl = ppl_vector
-                    else:
-                        lp_vec_ppl += ppl_vector
-                self.fill_ppl(lp_vec_ppl, pos.asset)
-            else:
-                token = pos.asset
-                amount = pos.amount
-                ppl_vector = self.calculate_ppl(token, amount, input)
-                self.fill_ppl(ppl_vector, token)
+        return price_matrix
 
-        output = {}
+    def run(self, input: VaRHistoricalInput) -> dict:
+        positions = list(input.portfolio)
 
-        if self.all_ppl_arr.shape[0] == 0:
+        if len(positions) == 0:
             return {'cvar': [], 'var': VaROutput.default(), 'total_vlaue': 0, 'value_list': []}
 
-        all_ppl_vec = self.all_ppl_arr.sum(axis=1)
-        weights = np.ones(len(input.portfolio.positions))
-        for i in range(len(input.portfolio.positions)):
-            try:
-                linreg_result = sps.linregress(all_ppl_vec, self.all_ppl_arr[:, i])
-                weights[i] = linreg_result.slope
-            except ValueError as err:
-                if 'Cannot calcualte a linear regression if all x values are identical' in str(err):
-                    weights[i] = 0
-        weights /= weights.sum()
+        # address -> column of the price/return matrix
+        token_columns = {}
+        position_legs = []
+        for pos in positions:
+            legs = pos.lp_position if isinstance(pos, CurveLPPosition) else [pos]
+            position_legs.append(legs)
+            for leg in legs:
+                token_columns.setdefault(leg.asset.address, len(token_columns))
+
+        price_matrix = self.get_price_matrix(input, list(token_columns.keys()))
+        current_prices = price_matrix[0, :]
+
+        # (assets x positions) matrix of position values
+        value_matrix = np.zeros((len(token_columns), len(positions)))
+        value_list = []
+        for pos_n, legs in enumerate(position_legs):
+            for leg in legs:
+                col = token_columns[leg.asset.address]
+                value = leg.amount * current_prices[col]
+                value_matrix[col, pos_n] += value
+                value_list.append((leg.asset.address, leg.amount, current_prices[col], value))
+
+        total_value = sum(v[3] for v in value_list)
+
+        returns = price_matrix[:-input.interval, :] / price_matrix[input.interval:, :] - 1
+        # ppl: potential profit&loss
+        all_ppl_arr = returns @ value_matrix
+        all_ppl_vec = all_ppl_arr.sum(axis=1)
+
+        # Component betas from one pass over the centered PnL, i.e. the slopes of
+        # the regressions of each position's PnL on the portfolio's PnL.
+        all_ppl_vec_centered = all_ppl_vec - all_ppl_vec.mean()
+        ppl_var = all_ppl_vec_centered @ all_ppl_vec_centered
+        if ppl_var == 0:
+            weights = np.zeros(len(positions))
+        else:
+            weights = (all_ppl_vec_centered @ (all_ppl_arr - all_ppl_arr.mean(axis=0))) / ppl_var
+            weights_sum = weights.sum()
+            if weights_sum != 0:
+                weights /= weights_sum
 
+        output = {}
         output['cvar'] = weights
         var_result = calc_var(all_ppl_vec, input.confidence)
         output['var'] = var_result.var
 
-        output['total_value'] = self.total_value
-        output['value_list'] = self.value_list
+        output['total_value'] = total_value
+        output['value_list'] = value_list
         return output
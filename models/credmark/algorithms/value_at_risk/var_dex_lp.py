@@ -5,17 +5,18 @@ from credmark.cmf.model.errors import ModelDataError, ModelRunError
 from credmark.cmf.types import Contract, Token
 from credmark.cmf.types.compose import MapBlockTimeSeriesOutput
 from models.credmark.algorithms.value_at_risk.dto import UniswapPoolVaRInput
-from models.credmark.algorithms.value_at_risk.risk_method import calc_var
+from models.credmark.algorithms.value_at_risk.risk_method import calc_var_es
 from models.credmark.protocols.dexes.uniswap.uniswap_v3 import \
     UniswapV3PoolInfo
 from models.dtos.price import Prices
 from models.tmp_abi_lookup import UNISWAP_V3_POOL_ABI
+from models.utils.series import PriceSeriesColumns
 
 np.seterr(all='raise')
 
 
 @Model.describe(slug="finance.var-dex-lp",
-                version="1.4",
+                version="1.6",
                 display_name="VaR for liquidity provider to Pool with IL adjustment to portfolio",
                 description="Working for UniV2, V3 and Sushiswap pools",
                 category='protocol',
@@ -74,15 +75,12 @@ class UniswapPoolVaR(Model):
                    "exclusive": False},
             return_type=MapBlockTimeSeriesOutput[Prices])
 
-        token_historical_prices = [
-            (token_hp.to_dataframe(fields=[('price', lambda p, n=tok_n:p.prices[n].price)])
-             .sort_values('blockNumber', ascending=False)
-             .reset_index(drop=True))
-            for tok_n in range(2)]
+        token_hp_cols = PriceSeriesColumns.from_series(token_hp, 2)
+        block_times = token_hp_cols.block_times()
 
         df = pd.DataFrame({
-            'TOKEN0/USD': token_historical_prices[0].price.to_numpy(),
-            'TOKEN1/USD': token_historical_prices[1].price.to_numpy(),
+            'TOKEN0/USD': token_hp_cols.prices[0],
+            'TOKEN1/USD': token_hp_cols.prices[1],
         })
 
         df.loc[:, 'ratio_0_over_1'] = df['TOKEN0/USD'] / df['TOKEN1/USD']
@@ -170,33 +168,31 @@ class UniswapPoolVaR(Model):
         total_pnl_without_il_vector = portfolio_pnl_vector
         total_pnl_il_vector = impermenant_loss_vector
 
-        var = {}
-        var_without_il = {}
-        var_il = {}
         conf = input.confidence
-        var_result = calc_var(total_pnl_vector, conf)
+        var_result, var_result_without_il, var_result_il = [
+            es_result[0].var_result
+            for es_result in calc_var_es(np.vstack([total_pnl_vector,
+                                                    total_pnl_without_il_vector,
+                                                    total_pnl_il_vector]),
+                                         [conf])]
+
         var = {
             'var': var_result.var,
-            'scenarios': (token_historical_prices[0].blockTime
-                          .iloc[var_result.unsorted_index, ].to_list()),
+            'scenarios': block_times[var_result.unsorted_index].to_list(),
             'ppl': total_pnl_vector[var_result.unsorted_index].tolist(),
             'weights': var_result.weights
         }
 
-        var_result_without_il = calc_var(total_pnl_without_il_vector, conf)
         var_without_il = {
             'var': var_result_without_il.var,
-            'scenarios': (token_historical_prices[0].blockTime
-                          .iloc[var_result_without_il.unsorted_index, ].to_list()),
+            'scenarios': block_times[var_result_without_il.unsorted_index].to_list(),
             'ppl': total_pnl_vector[var_result_without_il.unsorted_index].tolist(),
             'weights': var_result_without_il.weights
         }
 
-        var_result_il = calc_var(total_pnl_il_vector, conf)
         var_il = {
             'var': var_result_il.var,
-            'scenarios': (token_historical_prices[0].blockTime
-                          .iloc[var_result_il.unsorted_index, ].to_list()),
+            'scenarios': block_times[var_result_il.unsorted_index].to_list(),
             'ppl': total_pnl_vector[var_result_il.unsorted_index].tolist(),
             'weights': var_result_il.weights
         }
@@ -4,6 +4,7 @@ from credmark.cmf.model.errors import ModelDataError, ModelRunError
 from credmark.cmf.types import Address, Contract, Price, Token
 from models.credmark.protocols.dexes.curve.curve_finance import \
     CurveFiPoolInfoToken
+from models.credmark.protocols.dexes.curve.stableswap import CurvePoolState
 from models.dtos.price import Maybe
 
 np.seterr(all='raise')
@@ -38,7 +39,7 @@ class CurveFinanceMaybePrice(Model):
 
 
 @Model.describe(slug="price.dex-curve-fi",
-                version="1.4",
+                version="1.5",
                 display_name="Curve Finance Pool - Price for stablecoins and LP",
                 description="For those tokens primarily traded in curve",
                 category='protocol',
@@ -143,17 +144,26 @@ class CurveFinancePrice(Model):
                     f'{self.slug} does not find {input=} in pool {pool.address=}')
             n_token_input = n_token_input[0]
 
+            # Swaps are computed from the pool state read in one batch,
+            # or with get_dy of the pool for those that can not be simulated.
+            pool_state = CurvePoolState.load(self.context, pool)
+
             price_to_others = []
             ratio_to_others = []
             price_others = []
             for n_token_other, other_token in enumerate(pool_info.tokens):
                 if (n_token_other != n_token_input and
                         other_token.address not in self.supported_coins(self.context.chain_id)):
-                    ratio_to_other = other_token.scaled(
-                        pool.functions.get_dy(n_token_input,  # token to send
-                                              n_token_other,  # token to receive
-                                              10**input.decimals  # amount of the token to send
-                                              ).call())
+                    if pool_state is not None:
+                        amount_to_other = float(
+                            pool_state.get_dy(n_token_input, n_token_other, 10**input.decimals))
+                    else:
+                        amount_to_other = pool.functions.get_dy(
+                            n_token_input,  # token to send
+                            n_token_other,  # token to receive
+                            10**input.decimals  # amount of the token to send
+                        ).call()
+                    ratio_to_other = other_token.scaled(amount_to_other)
                     price_other = self.context.run_model('price.quote',
                                                          input={'base': other_token},
                                                          return_type=Price).price
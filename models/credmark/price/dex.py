@@ -1,13 +1,26 @@
 # pylint: disable=locally-disabled, unused-import
+import sqlite3
 from abc import abstractmethod
 from typing import List
 
+import numpy as np
 import pandas as pd
 from credmark.cmf.model import Model, ModelDataErrorDesc
-from credmark.cmf.model.errors import ModelDataError, ModelRunError
-from credmark.cmf.types import Price, Token
-from credmark.cmf.types.compose import MapInputsOutput
-from models.dtos.price import PoolPriceAggregatorInput, PoolPriceInfos
+from credmark.cmf.model.errors import (ModelBaseError, ModelDataError,
+                                       ModelRunError,
+                                       create_instance_from_error_dict)
+from credmark.cmf.types import Address, Contract, Contracts, Price, Token
+from credmark.cmf.types.compose import (MapBlockTimeSeriesOutput,
+                                        MapInputsOutput)
+from models.credmark.protocols.dexes.uniswap.reserve_history import PairReserveHistory
+from models.credmark.tokens.token import fix_erc20_token
+from models.dtos.price import (PoolPriceAggregatorInput, PoolPriceInfos,
+                               PriceHistoricalInput, PriceHistoricalTWAPInput)
+from models.tmp_abi_lookup import UNISWAP_V2_POOL_ABI, UNISWAP_V3_POOL_ABI
+from models.utils.multicall import multicall
+from models.utils.parallel import run_models_parallel
+from models.utils.series import sample_blocks
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError
 
 PRICE_DATA_ERROR_DESC = ModelDataErrorDesc(
     code=ModelDataError.Codes.NO_DATA,
@@ -107,8 +120,311 @@ class SushiV2GetAveragePrice(DexWeightedPrice):
         return self.aggregate_pool('sushiswap.get-pool-info-token-price', input)
 
 
+class DexWeightedPriceHistorical(Model, PriceWeight):
+    """
+    Historical price of a token weighted by liquidity over Uniswap V2 / SushiSwap pairs,
+    from the pairs' reserves as of each sample block, reconstructed from Sync events.
+    It is the weighted price model run at each sample, with the pools of the last block.
+    """
+
+    def price_by_sampling(self, price_slug, input: PriceHistoricalInput,
+                          end_timestamp=None, count=None, exclusive=None):
+        """
+        Run the weighted price model at each sample, by default for all samples of the input.
+        """
+        price_historical_result = self.context.run_model(
+            slug='compose.map-block-time-series',
+            input={"modelSlug": price_slug,
+                   "modelInput": Token(address=input.base.address),
+                   "endTimestamp": (self.context.block_number.timestamp
+                                    if end_timestamp is None else end_timestamp),
+                   "interval": input.interval,
+                   "count": input.count if count is None else count,
+                   "exclusive": input.exclusive if exclusive is None else exclusive},
+            return_type=MapBlockTimeSeriesOutput[Price])
+
+        for result in price_historical_result:
+            if result.error is not None:
+                self.logger.error(result.error)
+                raise create_instance_from_error_dict(result.error.dict())
+        return price_historical_result
+
+    def aggregate_pool_historical(self, pools_slug, price_slug, input: PriceHistoricalInput):
+        try:
+            samples = sample_blocks(self.context, input.interval, input.count, input.exclusive)
+            if samples is not None:
+                return self.weighted_price_from_reserves(pools_slug, input, samples)
+        except (ModelBaseError, sqlite3.Error, OSError) as err:
+            self.logger.info(f'Reserve history is not available for {input.base}: {err}')
+
+        return self.price_by_sampling(price_slug, input)
+
+    def weighted_price_from_reserves(self, pools_slug, input: PriceHistoricalInput, samples):
+        sample_timestamps, block_numbers, block_timestamps = samples
+        token = fix_erc20_token(Token(address=input.base.address))
+        weth = Token(symbol='WETH')
+
+        pools = self.context.run_model(pools_slug, input=token, return_type=Contracts)
+        pool_contracts = [Contract(address=pool.address, abi=UNISWAP_V2_POOL_ABI)
+                          for pool in pools]
+        pool_tokens = multicall(self.context,
+                                [f for pool in pool_contracts
+                                 for f in [pool.functions.token0(), pool.functions.token1()]])
+
+        weth_prices = None
+        reserve_history = PairReserveHistory.open(self.context.chain_id)
+        sum_of_price_liquidity = np.zeros(block_numbers.shape)
+        sum_of_liquidity = np.zeros(block_numbers.shape)
+        for pool_n, pool in enumerate(pool_contracts):
+            token0_address, token1_address = pool_tokens[2 * pool_n: 2 * pool_n + 2]
+            if token0_address is None or token1_address is None:
+                raise ModelRunError(f'Can not read the tokens of pool {pool.address}')
+
+            reserve0, reserve1 = reserve_history.reserves_as_of(pool.address, block_numbers)
+            if Address(token0_address) == token.address:
+                other = fix_erc20_token(Token(address=Address(token1_address)))
+                input_reserve, other_reserve = reserve0, reserve1
+            else:
+                other = fix_erc20_token(Token(address=Address(token0_address)))
+                input_reserve, other_reserve = reserve1, reserve0
+
+            liquidity = input_reserve / (10 ** token.decimals)
+            has_liquidity = (input_reserve > 0) & (other_reserve > 0)
+            price = np.zeros(block_numbers.shape)
+            price[has_liquidity] = (other_reserve[has_liquidity] / (10 ** other.decimals) /
+                                    liquidity[has_liquidity])
+
+            if token.address != weth.address and other.address == weth.address:
+                if weth_prices is None:
+                    weth_prices = self.weth_price_series(input, sample_timestamps)
+                price *= weth_prices
+
+            weight = np.where(has_liquidity, liquidity, 0) ** self.WEIGHT_POWER
+            sum_of_price_liquidity += price * weight
+            sum_of_liquidity += weight
+
+        if (sum_of_liquidity == 0).any():
+            block_number = block_numbers[sum_of_liquidity == 0][0]
+            raise ModelRunError(f'No pool to aggregate for {token} at block {block_number}')
+
+        prices = sum_of_price_liquidity / sum_of_liquidity
+        return MapBlockTimeSeriesOutput[Price](
+            results=self.series_results(sample_timestamps, block_numbers, block_timestamps,
+                                        prices))
+
+    def series_results(self, sample_timestamps, block_numbers, block_timestamps, prices):
+        return [{'blockNumber': int(block_number),
+                 'blockTimestamp': int(block_timestamp),
+                 'sampleTimestamp': int(sample_timestamp),
+                 'output': Price(price=price, src=self.slug),
+                 'error': None}
+                for sample_timestamp, block_number, block_timestamp, price
+                in zip(sample_timestamps, block_numbers, block_timestamps, prices)]
+
+    def weth_price_series(self, input: PriceHistoricalInput, sample_timestamps):
+        weth_historical = self.context.run_model(
+            'price.quote-historical',
+            input={'base': Token(symbol='WETH'),
+                   'interval': input.interval,
+                   'count': input.count,
+                   'exclusive': input.exclusive},
+            return_type=MapBlockTimeSeriesOutput[Price])
+
+        weth_by_sample = {int(result.sampleTimestamp): result.output.price
+                          for result in weth_historical}
+        if any(int(ts) not in weth_by_sample for ts in sample_timestamps):
+            raise ModelRunError('Can not retrieve the historical price for WETH')
+        return np.array([weth_by_sample[int(ts)] for ts in sample_timestamps])
+
+
+@Model.describe(slug='uniswap-v2.get-weighted-price-historical',
+                version='1.0',
+                display_name='Uniswap v2 - get historical price weighted by liquidity',
+                description='The Uniswap v2 pools that support a token contract, '
+                'priced from the reserves in Sync events',
+                category='protocol',
+                subcategory='uniswap-v2',
+                tags=['price', 'historical'],
+                input=PriceHistoricalInput,
+                output=MapBlockTimeSeriesOutput[Price],
+                errors=PRICE_DATA_ERROR_DESC)
+class UniswapV2WeightedPriceHistorical(DexWeightedPriceHistorical):
+    def run(self, input: PriceHistoricalInput) -> MapBlockTimeSeriesOutput[Price]:
+        return self.aggregate_pool_historical('uniswap-v2.get-pools',
+                                              'uniswap-v2.get-weighted-price',
+                                              input)
+
+
+@Model.describe(slug='sushiswap.get-weighted-price-historical',
+                version='1.0',
+                display_name='Sushi v2 (Uniswap V2) - get historical price weighted by liquidity',
+                description='The Sushi v2 pools that support a token contract, '
+                'priced from the reserves in Sync events',
+                category='protocol',
+                subcategory='sushi-v2',
+                tags=['price', 'historical'],
+                input=PriceHistoricalInput,
+                output=MapBlockTimeSeriesOutput[Price],
+                errors=PRICE_DATA_ERROR_DESC)
+class SushiV2WeightedPriceHistorical(DexWeightedPriceHistorical):
+    def run(self, input: PriceHistoricalInput) -> MapBlockTimeSeriesOutput[Price]:
+        return self.aggregate_pool_historical('sushiswap.get-pools',
+                                              'sushiswap.get-weighted-price',
+                                              input)
+
+
+@Model.describe(slug='uniswap-v3.get-weighted-price-historical',
+                version='1.0',
+                display_name='Uniswap v3 - get historical TWAP weighted by liquidity',
+                description='The Uniswap v3 pools that support a token contract, '
+                'priced by the time-weighted average tick from the pool\'s observations',
+                category='protocol',
+                subcategory='uniswap-v3',
+                tags=['price', 'historical'],
+                input=PriceHistoricalTWAPInput,
+                output=MapBlockTimeSeriesOutput[Price],
+                errors=PRICE_DATA_ERROR_DESC)
+class UniswapV3WeightedPriceHistorical(DexWeightedPriceHistorical):
+    """
+    Each pool is read with one observe() call for all samples within its observation buffer.
+    The price of a sample is the TWAP over twapWindow seconds before it,
+    weighted by the pool's virtual liquidity from the harmonic mean liquidity of the window.
+    Samples older than the buffer of any pool are priced by running
+    uniswap-v3.get-weighted-price at each of them.
+    """
+
+    UNISWAP_BASE = 1.0001
+
+    def run(self, input: PriceHistoricalTWAPInput) -> MapBlockTimeSeriesOutput[Price]:
+        try:
+            samples = sample_blocks(self.context, input.interval, input.count, input.exclusive)
+            if samples is not None:
+                return self.weighted_price_from_observations(input, samples)
+        except (ModelBaseError, ContractLogicError, BadFunctionCallOutput) as err:
+            self.logger.info(f'Pool observations are not available for {input.base}: {err}')
+
+        return self.price_by_sampling('uniswap-v3.get-weighted-price', input)
+
+    def read_pools(self, pool_contracts):
+        """
+        Return (slot0, token0, token1, oldest observation timestamp) of each pool.
+        """
+        pool_states = multicall(self.context,
+                                [f for pool in pool_contracts
+                                 for f in [pool.functions.slot0(),
+                                           pool.functions.token0(),
+                                           pool.functions.token1()]])
+        if any(state is None for state in pool_states):
+            raise ModelRunError('Can not read the state of the pools')
+        slot0s = pool_states[0::3]
+
+        # The slot after the latest observation is the oldest, unless it is not yet written.
+        oldest_observations = multicall(
+            self.context,
+            [pool.functions.observations((slot0[2] + 1) % slot0[3])
+             for pool, slot0 in zip(pool_contracts, slot0s)])
+        first_observations = multicall(
+            self.context, [pool.functions.observations(0) for pool in pool_contracts])
+
+        pools = []
+        for pool_n, slot0 in enumerate(slot0s):
+            oldest = oldest_observations[pool_n]
+            if oldest is None or not oldest[3]:
+                oldest = first_observations[pool_n]
+            if oldest is None:
+                raise ModelRunError(f'Can not read the observations of '
+                                    f'{pool_contracts[pool_n].address}')
+            pools.append((slot0, pool_states[3 * pool_n + 1], pool_states[3 * pool_n + 2],
+                          oldest[0]))
+        return pools
+
+    def weighted_price_from_observations(self, input: PriceHistoricalTWAPInput, samples):
+        sample_timestamps, block_numbers, block_timestamps = samples
+        end_timestamp = int(self.context.block_number.timestamp)
+        token = fix_erc20_token(Token(address=input.base.address))
+        weth = Token(symbol='WETH')
+
+        pools = self.context.run_model('uniswap-v3.get-pools', input=token, return_type=Contracts)
+        pool_contracts = [Contract(address=pool.address, abi=UNISWAP_V3_POOL_ABI)
+                          for pool in pools]
+        pool_states = self.read_pools(pool_contracts)
+
+        # Samples whose window starts within the buffers of all pools
+        window_start = sample_timestamps - input.twapWindow
+        oldest_timestamp = max((state[3] for state in pool_states), default=0)
+        in_buffer = window_start >= oldest_timestamp
+        if not in_buffer.any():
+            return self.price_by_sampling('uniswap-v3.get-weighted-price', input)
+
+        seconds_agos = ([int(end_timestamp - ts) for ts in sample_timestamps[in_buffer]] +
+                        [int(end_timestamp - ts) for ts in window_start[in_buffer]])
+        observations = multicall(self.context,
+                                 [pool.functions.observe(seconds_agos) for pool in pool_contracts])
+
+        n_samples = int(in_buffer.sum())
+        weth_prices = None
+        sum_of_price_liquidity = np.zeros(n_samples)
+        sum_of_liquidity = np.zeros(n_samples)
+        for pool, (_slot0, token0_address, token1_address, _), observed in \
+                zip(pool_contracts, pool_states, observations):
+            if observed is None:
+                raise ModelRunError(f'Can not observe {pool.address}')
+
+            # Differences of the cumulatives are taken in integers before scaling to float
+            tick_cumulatives, seconds_per_liquidity = observed
+            avg_tick = np.array([tick_cumulatives[n] - tick_cumulatives[n_samples + n]
+                                 for n in range(n_samples)], dtype=float) / input.twapWindow
+            seconds_per_liquidity_delta = np.array(
+                [seconds_per_liquidity[n] - seconds_per_liquidity[n_samples + n]
+                 for n in range(n_samples)], dtype=float)
+            liquidity = np.zeros(n_samples)
+            has_liquidity = seconds_per_liquidity_delta > 0
+            liquidity[has_liquidity] = (input.twapWindow * 2 ** 128 /
+                                        seconds_per_liquidity_delta[has_liquidity])
+
+            token0 = fix_erc20_token(Token(address=Address(token0_address)))
+            token1 = fix_erc20_token(Token(address=Address(token1_address)))
+            sqrt_price = self.UNISWAP_BASE ** (avg_tick / 2)
+            price = self.UNISWAP_BASE ** avg_tick * 10 ** (token0.decimals - token1.decimals)
+            if token.address == token1.address:
+                price = 1 / price
+                other = token0
+                virtual_liquidity = liquidity / sqrt_price / (10 ** token0.decimals)
+            else:
+                other = token1
+                virtual_liquidity = liquidity * sqrt_price / (10 ** token1.decimals)
+
+            if token.address != weth.address and other.address == weth.address:
+                if weth_prices is None:
+                    weth_prices = self.weth_price_series(input, sample_timestamps)[in_buffer]
+                price = price * weth_prices
+
+            weight = virtual_liquidity ** self.WEIGHT_POWER
+            sum_of_price_liquidity += price * weight
+            sum_of_liquidity += weight
+
+        if (sum_of_liquidity == 0).any():
+            raise ModelRunError(f'No pool to aggregate for {token}')
+
+        results = self.series_results(sample_timestamps[in_buffer],
+                                      block_numbers[in_buffer],
+                                      block_timestamps[in_buffer],
+                                      sum_of_price_liquidity / sum_of_liquidity)
+
+        if not in_buffer.all():
+            # The samples past the buffer are the oldest ones.
+            past_buffer = sample_timestamps[~in_buffer]
+            sampled = self.price_by_sampling('uniswap-v3.get-weighted-price', input,
+                                             end_timestamp=int(past_buffer[-1]),
+                                             count=len(past_buffer),
+                                             exclusive=False)
+            results = [result.dict() for result in sampled] + results
+
+        return MapBlockTimeSeriesOutput[Price](results=results)
+
+
 @ Model.describe(slug='price.dex-blended',
-                 version='1.7',
+                 version='1.8',
                  display_name='Token price - Credmark',
                  description='The Current Credmark Supported Price Algorithms',
                  developer='Credmark',
@@ -127,47 +443,14 @@ class PriceFromDexModel(Model, PriceWeight):
                                              'uniswap-v3.get-pool-info-token-price']
 
     def run(self, input: Token) -> Price:
-        model_inputs = [{"modelSlug": slug, "modelInputs": [input]}
-                        for slug in self.DEX_POOL_PRICE_INFO_MODELS]
-
-        def _use_compose():
-            all_pool_infos_results = self.context.run_model(
-                slug='compose.map-inputs',
-                input={'modelSlug': 'compose.map-inputs',
-                       'modelInputs': model_inputs},
-                return_type=MapInputsOutput[dict, MapInputsOutput[dict, PoolPriceInfos]])
-
-            all_pool_infos = []
-            for dex_n, dex_result in enumerate(all_pool_infos_results):
-                if dex_result.output is not None:
-                    for pool_result in dex_result.output:
-                        if pool_result.output is not None:
-                            all_pool_infos.extend(pool_result.output)
-                        elif pool_result.error is not None:
-                            self.logger.error(pool_result.error)
-                            raise ModelRunError(
-                                f'Error with {model_inputs[dex_n]}'
-                                f'({pool_result.input}). ' +
-                                pool_result.error.message)
-                elif dex_result.error is not None:
-                    self.logger.error(dex_result.error)
-                    raise ModelRunError(
-                        f'Error with {model_inputs[dex_n]}. ' +
-                        dex_result.error.message)
-                else:
-                    raise ModelRunError('compose.map-inputs: output/error cannot be both None')
-            return all_pool_infos
-
-        def _use_for():
-            all_pool_infos = []
-            for mrun in model_inputs:
-                infos = self.context.run_model(mrun['modelSlug'],
-                                               mrun['modelInputs'][0],
-                                               PoolPriceInfos)
-                all_pool_infos.extend(infos.infos)
-            return all_pool_infos
-
-        all_pool_infos = _use_for()
+        dex_results = run_models_parallel(self.context, self.DEX_POOL_PRICE_INFO_MODELS, input,
+                                          return_type=PoolPriceInfos)
+
+        all_pool_infos = []
+        for dex_result in dex_results:
+            if dex_result.error is not None:
+                self.logger.error(f'Error with {dex_result.input}({input})')
+            all_pool_infos.extend(dex_result.get().infos)
 
         non_zero_pools = {ii.src for ii in all_pool_infos if ii.liquidity > 0}
         zero_pools = {ii.src for ii in all_pool_infos if ii.liquidity == 0}
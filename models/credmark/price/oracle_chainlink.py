@@ -1,8 +1,16 @@
+import sqlite3
+
 from credmark.cmf.model import Model, ModelDataErrorDesc
-from credmark.cmf.model.errors import (ModelDataError, ModelInputError,
-                                       ModelRunError)
-from credmark.cmf.types import Address, Currency, Price
+from credmark.cmf.model.errors import (ModelBaseError, ModelDataError,
+                                       ModelInputError, ModelRunError)
+from credmark.cmf.types import Address, Contract, Currency, Price
+from credmark.cmf.types.ledger import ContractTable
+from credmark.dto import EmptyInput
+from ens import ENS
+from models.credmark.protocols.oracle.chainlink_routing import ChainlinkFeedRoutes
 from models.dtos.price import Maybe, PriceInput
+from models.utils.cache import LRUCache
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError
 
 PRICE_DATA_ERROR_DESC = ModelDataErrorDesc(
     code=ModelDataError.Codes.NO_DATA,
@@ -30,7 +38,7 @@ class PriceOracleChainlinkMaybe(Model):
 
 
 @Model.describe(slug='price.oracle-chainlink',
-                version='1.7',
+                version='1.8',
                 display_name='Token Price - from Oracle',
                 description='Get token\'s price from Oracle',
                 category='protocol',
@@ -107,7 +115,13 @@ class PriceOracleChainlink(Model):
         new_input.quote = self.check_wrap(new_input.quote)
         return new_input
 
-    def run(self, input: PriceInput) -> Price:  # pylint: disable=too-many-return-statements)
+    # Decimals of a feed only change with its aggregator: (chain_id, feed key) -> decimals
+    FEED_DECIMALS = LRUCache(maxsize=10000)
+    ENS_FEEDS = LRUCache(maxsize=1000)
+    # (chain_id, ENS domain) -> block where the domain's feed was created
+    ENS_FEED_BLOCKS = LRUCache(maxsize=1000)
+
+    def run(self, input: PriceInput) -> Price:
         new_input = self.replace_input(input)
         base = new_input.base
         quote = new_input.quote
@@ -118,6 +132,126 @@ class PriceOracleChainlink(Model):
         if base == quote:
             return Price(price=1, src=f'{self.slug}|Equal')
 
+        registry = self.context.run_model('chainlink.get-feed-registry',
+                                          input=EmptyInput(),
+                                          return_type=Contract)
+        try:
+            routes = ChainlinkFeedRoutes.open(self.context, registry)
+        except (ModelBaseError, sqlite3.Error, OSError) as err:
+            self.logger.info(f'Chainlink feed routes are not available: {err}')
+            return self.price_by_trial(input, new_input)
+
+        route = routes.route(base.address, quote.address,
+                             int(self.context.block_number),
+                             override_feeds=self.override_feeds(),
+                             preferred=self.ROUTING_ADDRESSES)
+        if route is None:
+            # A feed confirmed after the ledger's head is not in the graph yet
+            if routes.loaded_block < int(self.context.block_number):
+                return self.price_by_trial(input, new_input)
+            raise self.no_route_error(input, new_input)
+
+        try:
+            return self.price_by_route(registry, route)
+        except (ContractLogicError, BadFunctionCallOutput) as err:
+            self.logger.info(f'Chainlink feed route failed for {base}/{quote}: {err}')
+            return self.price_by_trial(input, new_input)
+
+    def override_feeds(self):
+        """
+        Override feeds of (token, quote, ENS domain, first block) for the routes.
+        A feed is used from the block where it was created, and not at all if its domain
+        does not resolve or its creation is not in the ledger.
+        """
+        feeds = []
+        for token_address, override in self.OVERRIDE_FEED[self.context.chain_id].items():
+            feed_block = self.ens_feed_block(override['ens']['domain'])
+            if feed_block is not None:
+                feeds.append((token_address,
+                              Currency(**override['quote']).address,
+                              override['ens']['domain'],
+                              feed_block))
+        return feeds
+
+    def ens_feed(self, ens_domain):
+        feed_address = self.ENS_FEEDS.get((self.context.chain_id, ens_domain))
+        if feed_address is None:
+            feed_address = ENS.fromWeb3(self.context.web3).address(ens_domain)
+            if feed_address is not None:
+                self.ENS_FEEDS.put((self.context.chain_id, ens_domain), feed_address)
+        return feed_address
+
+    def ens_feed_block(self, ens_domain):
+        feed_block = self.ENS_FEED_BLOCKS.get((self.context.chain_id, ens_domain))
+        if feed_block is None:
+            feed_address = self.ens_feed(ens_domain)
+            if feed_address is None:
+                return None
+            contracts = self.context.ledger.get_contracts(
+                columns=[ContractTable.Columns.BLOCK_NUMBER],
+                where=f'{ContractTable.Columns.ADDRESS} = \'{Address(feed_address)}\'',
+                limit='1')
+            if len(contracts.data) == 0:
+                return None
+            feed_block = int(contracts.data[0][ContractTable.Columns.BLOCK_NUMBER])
+            self.ENS_FEED_BLOCKS.put((self.context.chain_id, ens_domain), feed_block)
+        return feed_block
+
+    def feed_round(self, registry, hop):
+        """
+        Return (answer, decimals, feed) of the hop's feed from one latestRoundData call.
+        """
+        chain_id = self.context.chain_id
+        if hop.ens_domain is not None:
+            feed_address = self.ens_feed(hop.ens_domain)
+            if feed_address is None:
+                raise ModelRunError(f'Unable to resolve ENS domain name {hop.ens_domain}')
+            feed = Contract(address=feed_address)
+            (_roundId, answer, _startedAt, _updatedAt, _answeredInRound) = \
+                feed.functions.latestRoundData().call()
+            decimals = self.FEED_DECIMALS.get((chain_id, feed.address))
+            if decimals is None:
+                decimals = feed.functions.decimals().call()
+                self.FEED_DECIMALS.put((chain_id, feed.address), decimals)
+            return answer, decimals, feed.address
+
+        (_roundId, answer, _startedAt, _updatedAt, _answeredInRound) = \
+            registry.functions.latestRoundData(hop.asset, hop.denomination).call()
+        decimals_key = (chain_id, hop.asset, hop.denomination)
+        decimals = self.FEED_DECIMALS.get(decimals_key)
+        if decimals is None:
+            decimals = registry.functions.decimals(hop.asset, hop.denomination).call()
+            self.FEED_DECIMALS.put(decimals_key, decimals)
+        return answer, decimals, f'{hop.asset}/{hop.denomination}'
+
+    def price_by_route(self, registry, route) -> Price:
+        price = 1.0
+        feeds = []
+        for hop in route:
+            answer, decimals, feed = self.feed_round(registry, hop)
+            if answer <= 0:
+                raise ModelRunError(f'Chainlink feed {feed} answered {answer}')
+            hop_price = answer / (10 ** decimals)
+            price *= 1 / hop_price if hop.inverse else hop_price
+            feeds.append(f'{feed}{"|inverse" if hop.inverse else ""}')
+        return Price(price=price, src=f'{self.slug}|{"|".join(feeds)}')
+
+    def no_route_error(self, input, new_input) -> ModelRunError:
+        if new_input == input:
+            return ModelRunError(f'No possible feed/routing for token pair '
+                                 f'{input.base}/{input.quote}')
+
+        return ModelRunError(f'No possible feed/routing for token pair '
+                             f'{input.base}/{input.quote}, '
+                             f'replaced by {new_input.base}/{new_input.quote}')
+
+    def price_by_trial(self, input, new_input) -> Price:  # pylint: disable=too-many-return-statements
+        """
+        Find a route by calling the registry for the pair and the routing tokens.
+        """
+        base = new_input.base
+        quote = new_input.quote
+
         price_maybe = self.context.run_model('chainlink.price-from-registry-maybe',
                                              input=new_input, return_type=Maybe[Price])
         if price_maybe.just is not None:
@@ -195,10 +329,4 @@ class PriceOracleChainlink(Model):
                         return_type=Price)
                     return p1.cross(bridge_price).cross(p2)
 
-        if new_input == input:
-            raise ModelRunError(f'No possible feed/routing for token pair '
-                                f'{input.base}/{input.quote}')
-
-        raise ModelRunError(f'No possible feed/routing for token pair '
-                            f'{input.base}/{input.quote}, '
-                            f'replaced by {new_input.base}/{new_input.quote}')
+        raise self.no_route_error(input, new_input)
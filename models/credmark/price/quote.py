@@ -1,17 +1,34 @@
+import sqlite3
+
+import numpy as np
 from credmark.cmf.model import Model, ModelDataErrorDesc
-from credmark.cmf.model.errors import (ModelDataError, ModelRunError,
+from credmark.cmf.model.errors import (ModelBaseError, ModelDataError,
+                                       ModelRunError,
                                        create_instance_from_error_dict)
-from credmark.cmf.types import Currency, NativeToken, Price, Token
+from credmark.cmf.types import Contract, Currency, NativeToken, Price, Token
 from credmark.cmf.types.compose import (MapBlockTimeSeriesOutput,
                                         MapInputsOutput)
+from credmark.dto import EmptyInput
+from models.credmark.price.oracle_chainlink import PriceOracleChainlink
+from models.credmark.protocols.oracle.chainlink_history import ChainlinkAnswerHistory
+from models.credmark.protocols.oracle.chainlink_routing import ChainlinkFeedRoutes
 from models.dtos.price import (Address, Maybe, PriceHistoricalInput,
                                PriceHistoricalInputs, PriceInput, PriceInputs,
                                Prices)
+from models.utils.cache import LRUCache
+from models.utils.series import sample_blocks
 
 PRICE_DATA_ERROR_DESC = ModelDataErrorDesc(
     code=ModelDataError.Codes.NO_DATA,
     code_desc='No pools to aggregate for token price')
 
+# (chain_id, block_number, base address, quote address) -> Price
+PRICE_CACHE = LRUCache(maxsize=50000)
+
+# (chain_id, block_number, token address, source) -> True when the source failed for the token.
+# Feeds are deprecated and pools removed over time, so a miss only holds for its block.
+PRICE_SOURCE_MISSES = LRUCache(maxsize=50000)
+
 
 @Model.describe(slug='price.quote-historical-multiple',
                 version='1.5',
@@ -44,7 +61,7 @@ class PriceQuoteHistoricalMultiple(Model):
 
 
 @Model.describe(slug='price.quote-historical',
-                version='1.1',
+                version='1.2',
                 display_name='Token Price - Quoted - Historical',
                 description='Credmark Supported Price Algorithms',
                 developer='Credmark',
@@ -54,7 +71,80 @@ class PriceQuoteHistoricalMultiple(Model):
                 output=MapBlockTimeSeriesOutput[Price],
                 errors=PRICE_DATA_ERROR_DESC)
 class PriceQuoteHistorical(Model):
+    """
+    A pair with a Chainlink route is priced from the AnswerUpdated history of its feeds,
+    with one ledger query for the sample blocks. Other pairs run price.quote for each sample.
+    """
+
+    def chainlink_historical(self, input: PriceHistoricalInput):
+        """
+        Price the samples from the Chainlink answer history, or None to price them by block.
+        Only registry feeds have a history; a route over an ENS feed is priced by block.
+        """
+        def _unwrap(token):
+            wrap = PriceOracleChainlink.WRAP_TOKEN.get(self.context.chain_id, {})
+            if token.address in wrap:
+                return Currency(**wrap[token.address])
+            return token
+
+        base = _unwrap(input.base)
+        quote = _unwrap(input.quote)
+        if base.address is None or quote.address is None or base.address == quote.address:
+            return None
+
+        registry = self.context.run_model('chainlink.get-feed-registry',
+                                          input=EmptyInput(),
+                                          return_type=Contract)
+        routes = ChainlinkFeedRoutes.open(self.context, registry)
+        route = routes.route(base.address, quote.address,
+                             int(self.context.block_number),
+                             preferred=PriceOracleChainlink.ROUTING_ADDRESSES)
+        if route is None:
+            return None
+
+        samples = sample_blocks(self.context, input.interval, input.count, input.exclusive)
+        if samples is None:
+            return None
+        sample_timestamps, block_numbers, block_timestamps = samples
+
+        history = ChainlinkAnswerHistory.open(self.context.chain_id)
+        prices = np.ones(block_numbers.shape)
+        feeds = []
+        for hop in route:
+            answers = history.pair_answer_as_of(routes, hop.asset, hop.denomination, block_numbers)
+            if answers is None or np.isnan(answers).any() or (answers <= 0).any():
+                return None
+
+            decimals_key = (self.context.chain_id, hop.asset, hop.denomination)
+            decimals = PriceOracleChainlink.FEED_DECIMALS.get(decimals_key)
+            if decimals is None:
+                decimals = registry.functions.decimals(hop.asset, hop.denomination).call()
+                PriceOracleChainlink.FEED_DECIMALS.put(decimals_key, decimals)
+
+            hop_prices = answers / (10 ** decimals)
+            prices *= 1 / hop_prices if hop.inverse else hop_prices
+            feeds.append(f'{hop.asset}/{hop.denomination}{"|inverse" if hop.inverse else ""}')
+
+        src = f'{self.slug}|chainlink|{"|".join(feeds)}'
+        return MapBlockTimeSeriesOutput[Price](
+            results=[{'blockNumber': int(block_number),
+                      'blockTimestamp': int(block_timestamp),
+                      'sampleTimestamp': int(sample_timestamp),
+                      'output': Price(price=price, src=src),
+                      'error': None}
+                     for sample_timestamp, block_number, block_timestamp, price
+                     in zip(sample_timestamps, block_numbers, block_timestamps, prices)])
+
     def run(self, input: PriceHistoricalInput) -> MapBlockTimeSeriesOutput[Price]:
+        try:
+            price_historical_result = self.chainlink_historical(input)
+        except (ModelBaseError, sqlite3.Error, OSError) as err:
+            self.logger.info(f'Chainlink history is not available for {input.base}: {err}')
+            price_historical_result = None
+
+        if price_historical_result is not None:
+            return price_historical_result
+
         price_historical_result = self.context.run_model(
             slug='compose.map-block-time-series',
             input={"modelSlug": 'price.quote',
@@ -140,7 +230,7 @@ class TokenPriceModelDeprecated(Model):
 
 
 @Model.describe(slug='price.quote',
-                version='1.7',
+                version='1.8',
                 display_name='Token Price - Quoted',
                 description='Credmark Supported Price Algorithms',
                 developer='Credmark',
@@ -152,6 +242,10 @@ class TokenPriceModelDeprecated(Model):
 class PriceQuote(Model):
     """
     Return token's price
+
+    Prices are cached for the (chain, block, base, quote) in the process so that
+    nested models asking for the same token (e.g. WETH for each pool) are served once.
+    Sources that failed for a token are remembered and skipped at the same block.
     """
 
     CONVERT_TO_WRAP = {
@@ -178,20 +272,37 @@ class PriceQuote(Model):
                 return Currency(address=addr_maybe.just)
         return token
 
+    def source_miss_key(self, token, source):
+        return (self.context.chain_id, int(self.context.block_number), token.address, source)
+
+    def source_missed(self, token, source):
+        return self.source_miss_key(token, source) in PRICE_SOURCE_MISSES
+
+    def record_source_miss(self, token, source):
+        PRICE_SOURCE_MISSES.put(self.source_miss_key(token, source), True)
+
     def get_price_usd(self, input):
-        if input.quote == Currency(symbol='USD'):
+        if input.quote == Currency(symbol='USD') or self.source_missed(input.base, 'chainlink'):
             price_usd_maybe = Maybe[Price](just=None)
         else:
             price_usd_maybe = self.context.run_model('price.oracle-chainlink-maybe',
                                                      input=input.quote_usd(),
                                                      return_type=Maybe[Price])
+            if price_usd_maybe.just is None:
+                self.record_source_miss(input.base, 'chainlink')
 
         if price_usd_maybe.just is not None:
             price_usd = price_usd_maybe.just
         else:
-            price_usd_maybe = self.context.run_model('price.dex-curve-fi-maybe',
-                                                     input=input.base,
-                                                     return_type=Maybe[Price])
+            if self.source_missed(input.base, 'curve'):
+                price_usd_maybe = Maybe[Price](just=None)
+            else:
+                price_usd_maybe = self.context.run_model('price.dex-curve-fi-maybe',
+                                                         input=input.base,
+                                                         return_type=Maybe[Price])
+                if price_usd_maybe.just is None:
+                    self.record_source_miss(input.base, 'curve')
+
             if price_usd_maybe.just is not None:
                 price_usd = price_usd_maybe.just
             else:
@@ -203,11 +314,33 @@ class PriceQuote(Model):
         return price_usd
 
     def run(self, input: PriceInput) -> Price:
+        cache_key = (self.context.chain_id, int(self.context.block_number),
+                     input.base.address, input.quote.address)
+        cached_price = PRICE_CACHE.get(cache_key)
+        if cached_price is not None:
+            return Price(**cached_price.dict())
+
+        price = self.get_price(input)
+
+        PRICE_CACHE.put(cache_key, price)
+        PRICE_CACHE.put((self.context.chain_id, int(self.context.block_number),
+                         input.quote.address, input.base.address),
+                        price.inverse())
+        return Price(**price.dict())
+
+    def get_price(self, input: PriceInput) -> Price:
         input.base = self.replace_underlying(input.base)
         input.quote = self.replace_underlying(input.quote)
 
+        # A token without a Chainlink feed to USD can not be routed to other quotes either
+        skip_chainlink = any(self.source_missed(token, 'chainlink')
+                             for token in [input.base, input.quote]
+                             if token != Currency(symbol='USD'))
+
         # Cache for the flip pair by keeping an order
-        if input.base.address >= input.quote.address:
+        if skip_chainlink:
+            pass
+        elif input.base.address >= input.quote.address:
             price_maybe = self.context.run_model('price.oracle-chainlink-maybe',
                                                  input=input,
                                                  return_type=Maybe[Price])
@@ -220,6 +353,12 @@ class PriceQuote(Model):
             if price_maybe.just is not None:
                 return price_maybe.just.inverse()
 
+        if not skip_chainlink:
+            if input.quote == Currency(symbol='USD'):
+                self.record_source_miss(input.base, 'chainlink')
+            elif input.base == Currency(symbol='USD'):
+                self.record_source_miss(input.quote, 'chainlink')
+
         if input.base == Currency(symbol='USD'):
             price_usd = self.get_price_usd(input.inverse()).inverse()
         else:
@@ -1,29 +1,35 @@
 # pylint: disable=locally-disabled, unused-import
 
+import sqlite3
 from queue import Empty
 from typing import List
 
 import numpy as np
 import pandas as pd
 from credmark.cmf.model import Model
-from credmark.cmf.model.errors import ModelDataError, ModelRunError
+from credmark.cmf.model.errors import (ModelBaseError, ModelDataError,
+                                       ModelRunError)
 from credmark.cmf.types import (Account, Accounts, Address, Contract,
                                 Contracts, Portfolio, Position, Price, Token,
                                 Tokens)
 from credmark.cmf.types.compose import MapInputsOutput
 from credmark.cmf.types.ledger import TransactionTable
-from credmark.dto import DTO, EmptyInput
+from credmark.dto import DTO, DTOField, EmptyInput
+from models.credmark.protocols.dexes.curve.gauge_state import GaugeUserStates
+from models.credmark.protocols.dexes.curve.registry_snapshot import (
+    GAUGE_ABI_LP_TOKEN, CurveRegistrySnapshot)
+from models.credmark.protocols.dexes.curve.stableswap import CurvePoolState
 from models.credmark.tokens.token import fix_erc20_token
 from models.dtos.price import Prices
 from models.dtos.tvl import TVLInfo
 from models.tmp_abi_lookup import CURVE_VYPER_POOL
+from models.utils.parallel import run_model_parallel
+from models.utils.result_cache import cache_result
 from web3.exceptions import (ABIFunctionNotFound, BadFunctionCallOutput,
                              ContractLogicError)
 
 np.seterr(all='raise')
 
-GAUGE_ABI_LP_TOKEN = '[{"stateMutability":"view","type":"function","name":"lp_token","inputs":[],"outputs":[{"name":"","type":"address"}],"gas":3168}]'  # pylint:disable=line-too-long
-
 
 class CurveFiPoolInfoToken(Contract):
     tokens: Tokens
@@ -105,7 +111,7 @@ class CurveFinanceGetGauge(Model):
 
 
 @ Model.describe(slug="curve-fi.all-pools",
-                 version="1.2",
+                 version="1.3",
                  display_name="Curve Finance - Get all pools",
                  description="Query the registry for all pools",
                  category='protocol',
@@ -116,7 +122,17 @@ class CurveFinanceAllPools(Model):
         registry = self.context.run_model('curve-fi.get-registry',
                                           input=EmptyInput(),
                                           return_type=Contract)
-
+        try:
+            snapshot = CurveRegistrySnapshot.open(self.context, registry,
+                                                  CurveRegistrySnapshot.POOLS)
+            return Contracts(contracts=[
+                Contract(address=entry.address)
+                for entry in snapshot.entries(int(self.context.block_number))])
+        except (ModelBaseError, sqlite3.Error, OSError) as err:
+            self.logger.info(f'Walk the pools of {registry.address}: {err}')
+            return self.all_pools_by_walk(registry)
+
+    def all_pools_by_walk(self, registry: Contract) -> Contracts:
         total_pools = registry.functions.pool_count().call()
         pool_contracts = [None] * total_pools
         for i in range(0, total_pools):
@@ -281,6 +297,7 @@ class CurveFinancePoolInfoTokens(Model):
                 input=Contract,
                 output=CurveFiPoolInfo)
 class CurveFinancePoolInfo(Model):
+    @cache_result
     def run(self, input: Contract) -> CurveFiPoolInfo:
         registry = Contract(**self.context.models.curve_fi.get_registry())
         pool_info = self.context.run_model('curve-fi.pool-info-tokens',
@@ -387,8 +404,86 @@ class CurveFinancePoolTVL(Model):
         return tvl_info
 
 
+class CurveFiDepegCurveInput(DTO):
+    pool: Contract
+    token: Token = DTOField(description='Coin to sell into the pool')
+    amounts: List[float] = DTOField(description='Amounts of the coin to sell, scaled')
+
+
+class CurveFiSwapCurve(DTO):
+    """
+    @amounts_out: amounts of token_out received for each amount sold
+    @rates: execution rate, token_out per token sold, for each amount
+    @marginal_rates: rate of the next unit sold after each amount
+    """
+    token_out: Token
+    amounts_out: List[float]
+    rates: List[float]
+    marginal_rates: List[float]
+
+
+class CurveFiDepegCurve(DTO):
+    """
+    @lp_amounts: LP tokens minted for depositing each amount, before fees
+    """
+    address: Address
+    token: Token
+    amounts_in: List[float]
+    virtual_price: float
+    lp_amounts: List[float]
+    curves: List[CurveFiSwapCurve]
+
+
+@Model.describe(slug="curve-fi.pool-depeg-curve",
+                version="1.0",
+                display_name="Curve Finance Pool - Depeg Curve",
+                description="Amounts received and rates for selling a coin of a pool for each of "
+                "the others, computed from the pool state for a range of amounts",
+                category='protocol',
+                subcategory='curve',
+                input=CurveFiDepegCurveInput,
+                output=CurveFiDepegCurve)
+class CurveFinancePoolDepegCurve(Model):
+    def run(self, input: CurveFiDepegCurveInput) -> CurveFiDepegCurve:
+        pool_state = CurvePoolState.load(self.context, input.pool)
+        if pool_state is None:
+            raise ModelRunError(f'Can not simulate the pool {input.pool.address}')
+        if input.token.address not in pool_state.coins:
+            raise ModelRunError(f'{input.token.address} is not a coin of {input.pool.address}')
+
+        n_token_in = pool_state.index(input.token.address)
+        amounts_in = np.array(input.amounts) * 10 ** input.token.decimals
+
+        curves = []
+        for n_token_out, coin in enumerate(pool_state.coins):
+            if n_token_out == n_token_in:
+                continue
+            token_out = Token(address=coin)
+            amounts_out, rates, marginal_rates = pool_state.swap_curve(
+                n_token_in, n_token_out, amounts_in)
+            rate_scale = 10 ** input.token.decimals / 10 ** token_out.decimals
+            curves.append(CurveFiSwapCurve(
+                token_out=token_out,
+                amounts_out=(amounts_out / 10 ** token_out.decimals).tolist(),
+                rates=(rates * rate_scale).tolist(),
+                marginal_rates=(marginal_rates * rate_scale).tolist()))
+
+        deposits = np.zeros((len(amounts_in), pool_state.n_coins))
+        deposits[:, n_token_in] = amounts_in
+        lp_amounts = (pool_state.calc_token_amount(deposits, deposit=True) / 10 ** 18
+                      if pool_state.lp_supply > 0 else np.zeros(len(amounts_in)))
+
+        return CurveFiDepegCurve(address=input.pool.address,
+                                 token=input.token,
+                                 amounts_in=input.amounts,
+                                 virtual_price=(pool_state.virtual_price / 10 ** 18
+                                                if pool_state.lp_supply > 0 else 0),
+                                 lp_amounts=lp_amounts.tolist(),
+                                 curves=curves)
+
+
 @Model.describe(slug="curve-fi.all-pools-info",
-                version="1.8",
+                version="1.9",
                 display_name="Curve Finance Pool Liqudity - All",
                 description="The amount of Liquidity for Each Token in a Curve Pool - All",
                 category='protocol',
@@ -400,43 +495,21 @@ class CurveFinanceTotalTokenLiqudity(Model):
                                                 input=EmptyInput(),
                                                 return_type=Contracts)
 
-        def _use_for():
-            pool_infos = []
-            for pool in pool_contracts:
-                pool_info = self.context.run_model('curve-fi.pool-info',
-                                                   pool,
-                                                   return_type=CurveFiPoolInfo)
-                pool_infos.append(pool_info)
-            return pool_infos
+        model_slug = 'curve-fi.pool-info'
+        all_pools = run_model_parallel(self.context, model_slug, pool_contracts.contracts,
+                                       return_type=CurveFiPoolInfo)
 
-        def _use_compose():
-            model_slug = 'curve-fi.pool-info'
-            all_pools = self.context.run_model(
-                slug='compose.map-inputs',
-                input={'modelSlug': model_slug,
-                       'modelInputs': pool_contracts.contracts},
-                return_type=MapInputsOutput[Contract, CurveFiPoolInfo])
-
-            pool_infos = []
-            errors = []
-            for pool_n, pool_result in enumerate(all_pools):
-                if pool_result.error is not None:
-                    errors.append((pool_n, pool_result.error))
-                else:
-                    pool_infos.append(pool_result.output)
-
-            if len(errors) > 0:
-                for error_n, (pool_n, err) in enumerate(errors):
-                    self.logger.error(
-                        f'{error_n+1}/{len(errors)}: '
-                        f'Error with {model_slug}({pool_contracts.contracts[pool_n]})')
-                    self.logger.error(err)
-                raise ModelRunError(errors[0][1].message)
-
-            return pool_infos
-
-        pool_infos = _use_compose()
-        all_pools_info = CurveFiPoolInfos(pool_infos=pool_infos)
+        errors = [pool_result for pool_result in all_pools if pool_result.error is not None]
+        if len(errors) > 0:
+            for error_n, pool_result in enumerate(errors):
+                self.logger.error(
+                    f'{error_n+1}/{len(errors)}: '
+                    f'Error with {model_slug}({pool_result.input})')
+                self.logger.error(pool_result.error)
+            raise errors[0].error
+
+        all_pools_info = CurveFiPoolInfos(pool_infos=[pool_result.output
+                                                      for pool_result in all_pools])
 
         # (pd.DataFrame((all_pools_info.dict())['pool_infos'])
         # .to_csv(f'tmp/curve-all-info_{self.context.block_number}.csv'))
@@ -448,7 +521,7 @@ class CurveFiAllGaugesOutput(Contracts):
 
 
 @Model.describe(slug="curve-fi.all-gauges",
-                version='1.3',
+                version='1.4',
                 display_name="Curve Finance Gauge List",
                 description="All Gauge Contracts for Curve Finance Pools",
                 category='protocol',
@@ -458,6 +531,19 @@ class CurveFiAllGaugesOutput(Contracts):
 class CurveFinanceAllGauges(Model):
     def run(self, _) -> CurveFiAllGaugesOutput:
         gauge_controller = Contract(**self.context.models.curve_fi.get_gauge_controller())
+        try:
+            snapshot = CurveRegistrySnapshot.open(self.context, gauge_controller,
+                                                  CurveRegistrySnapshot.GAUGES)
+            entries = snapshot.entries(int(self.context.block_number))
+            return CurveFiAllGaugesOutput(
+                contracts=[Contract(address=entry.address) for entry in entries],
+                lp_tokens=Accounts(accounts=[Account(address=entry.lp_token)
+                                             for entry in entries]))
+        except (ModelBaseError, sqlite3.Error, OSError) as err:
+            self.logger.info(f'Walk the gauges of {gauge_controller.address}: {err}')
+            return self.all_gauges_by_walk(gauge_controller)
+
+    def all_gauges_by_walk(self, gauge_controller: Contract) -> CurveFiAllGaugesOutput:
         gauges = []
         lp_tokens = []
         i = 0
@@ -483,27 +569,19 @@ class CurveFinanceAllGauges(Model):
 
 
 @ Model.describe(slug='curve-fi.all-gauge-claim-addresses',
-                 version='1.2',
+                 version='1.3',
                  category='protocol',
                  subcategory='curve',
                  input=Contract,
                  output=Accounts)
 class CurveFinanceAllGaugeAddresses(Model):
     def run(self, input: Contract) -> Accounts:
-        addrs = self.context.ledger.get_transactions(
-            columns=[TransactionTable.Columns.FROM_ADDRESS],
-            where=f'{TransactionTable.Columns.TO_ADDRESS}=\'{input.address.lower()}\'')
-        return Accounts(accounts=[
-            Account(address=address)
-            for address in
-            list(dict.fromkeys([
-                a[TransactionTable.Columns.FROM_ADDRESS]
-                for a
-                in addrs]))])
+        addrs = GaugeUserStates(self.context, input).depositors()
+        return Accounts(accounts=[Account(address=address) for address in addrs])
 
 
 @ Model.describe(slug='curve-fi.get-gauge-stake-and-claimable-rewards',
-                 version='1.2',
+                 version='1.3',
                  category='protocol',
                  subcategory='curve',
                  input=Contract,
@@ -511,27 +589,13 @@ class CurveFinanceAllGaugeAddresses(Model):
 class CurveFinanceGaugeRewardsCRV(Model):
     def run(self, input: Contract) -> dict:
         yields = []
-
-        all_addrs = Accounts(**self.context.models.curve_fi.all_gauge_claim_addresses(input))
-        for addr in all_addrs.accounts:
-            if not addr.address:
-                raise ModelRunError(f'Input is invalid, {input}')
-
-            claimable_tokens = input.functions.claimable_tokens(addr.address.checksum).call()
-            balanceOf = input.functions.balanceOf(addr.address.checksum).call()
-            working_balances = input.functions.working_balances(addr.address.checksum).call()
-
-            yields.append({
-                "claimable_tokens": claimable_tokens,
-                "balanceOf": balanceOf,
-                "working_balances": working_balances,
-                "address": addr.address
-            })
+        for page in GaugeUserStates(self.context, input).stream():
+            yields.extend(page)
         return {"yields": yields}
 
 
 @ Model.describe(slug='curve-fi.gauge-yield',
-                 version='1.2',
+                 version='1.3',
                  category='protocol',
                  subcategory='curve',
                  input=Contract,
@@ -563,39 +627,34 @@ class CurveFinanceAverageGaugeYield(Model):
             interval='7 days',
             model_input=input)
 
-        yields = []
-        for idx in range(0, len(res.series) - 1):
-            for y1 in res.series[idx].output['yields']:
-                if y1['working_balances'] == 0:
-                    continue
-                if y1['balanceOf'] == 0:
-                    continue
-                if y1['claimable_tokens'] == 0:
-                    continue
-                for y2 in res.series[idx + 1].output['yields']:
-                    if y1['address'] == y2['address']:
-                        if y2['working_balances'] == 0:
-                            continue
-                        if y2['balanceOf'] == 0:
-                            continue
-                        if y2['claimable_tokens'] == 0:
-                            continue
-                        if y1['balanceOf'] == y2['balanceOf']:
-                            y2_rewards_value = y2["claimable_tokens"] * self.CRV_PRICE / (10**18)
-                            y1_rewards_value = y1["claimable_tokens"] * self.CRV_PRICE / (10**18)
-                            virtual_price = pool_virtual_price / (10**18) / (10**18)
-                            y2_liquidity_value = y2["balanceOf"] * virtual_price
-                            y1_liquidity_value = y1["balanceOf"] * virtual_price
-                            new_portfolio_value = y2_rewards_value + y2_liquidity_value
-                            old_portfolio_value = y1_rewards_value + y1_liquidity_value
-                            if old_portfolio_value > new_portfolio_value:
-                                break
-                            yields.append(
-                                (new_portfolio_value - old_portfolio_value) / old_portfolio_value)
-                            break
+        # One row per sample and address, keeping those with a stake and rewards.
+        df = pd.DataFrame([dict(y, sample=idx)
+                           for idx, sample in enumerate(res.series)
+                           for y in sample.output['yields']],
+                          columns=['sample', 'address', 'claimable_tokens',
+                                   'balanceOf', 'working_balances'])
+        df = df.loc[(df.working_balances != 0) &
+                    (df.balanceOf != 0) &
+                    (df.claimable_tokens != 0)]
+
+        # Pair each address with itself in the next sample, for an unchanged stake
+        df_next = df.assign(sample=df['sample'] - 1)
+        df_pair = df.merge(df_next, on=['sample', 'address'], suffixes=('_1', '_2'))
+        df_pair = df_pair.loc[df_pair.balanceOf_1 == df_pair.balanceOf_2]
+
+        virtual_price = pool_virtual_price / (10**18) / (10**18)
+        liquidity_value = df_pair.balanceOf_1.astype(float).to_numpy() * virtual_price
+        old_portfolio_value = (df_pair.claimable_tokens_1.astype(float).to_numpy() *
+                               self.CRV_PRICE / (10**18) + liquidity_value)
+        new_portfolio_value = (df_pair.claimable_tokens_2.astype(float).to_numpy() *
+                               self.CRV_PRICE / (10**18) + liquidity_value)
+
+        gained = old_portfolio_value <= new_portfolio_value
+        yields = ((new_portfolio_value[gained] - old_portfolio_value[gained]) /
+                  old_portfolio_value[gained])
         if len(yields) == 0:
             return {}
-        avg_yield = sum(yields) / len(yields) * (365 * 86400) / (10 * 86400)
+        avg_yield = float(yields.mean()) * (365 * 86400) / (10 * 86400)
         return {"crv_yield": avg_yield}
 
 
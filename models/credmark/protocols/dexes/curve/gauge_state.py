@@ -0,0 +1,82 @@
+from typing import Iterator, List
+
+from credmark.cmf.model.errors import ModelRunError
+from credmark.cmf.types import Address, Contract
+from credmark.cmf.types.ledger import TransactionTable
+from models.utils.multicall import MULTICALL_CHUNK_SIZE, multicall
+from models.utils.parallel import map_parallel
+
+GAUGE_USER_VIEWS = ['claimable_tokens', 'balanceOf', 'working_balances']
+
+
+class GaugeUserStates:
+    """
+    Reader of the per-user views of a Curve gauge for all its depositors.
+
+    Depositors are the distinct senders of transactions to the gauge, grouped by the ledger
+    and read in pages. The views of a page are read with multicall in chunks,
+    with the chunks run in a bounded thread pool.
+    """
+
+    LEDGER_PAGE_SIZE = 5000
+    CHUNK_SIZE = MULTICALL_CHUNK_SIZE // len(GAUGE_USER_VIEWS)
+
+    def __init__(self, context, gauge: Contract):
+        self.context = context
+        self.gauge = gauge
+
+    def depositor_pages(self) -> Iterator[List[Address]]:
+        from_col = TransactionTable.Columns.FROM_ADDRESS
+        to_col = TransactionTable.Columns.TO_ADDRESS
+
+        offset = 0
+        while True:
+            rows = self.context.ledger.get_transactions(
+                columns=[from_col],
+                where=f'{to_col}=\'{self.gauge.address.lower()}\'',
+                group_by=from_col,
+                order_by=from_col,
+                limit=str(self.LEDGER_PAGE_SIZE),
+                offset=str(offset)).data
+
+            yield [Address(row[from_col]) for row in rows if row[from_col]]
+
+            if len(rows) < self.LEDGER_PAGE_SIZE:
+                break
+            offset += self.LEDGER_PAGE_SIZE
+
+    def depositors(self) -> List[Address]:
+        return [address for page in self.depositor_pages() for address in page]
+
+    def read_chunk(self, addresses: List[Address]) -> List[dict]:
+        results = multicall(self.context,
+                            [getattr(self.gauge.functions, view)(address.checksum)
+                             for address in addresses
+                             for view in GAUGE_USER_VIEWS],
+                            chunk_size=MULTICALL_CHUNK_SIZE)
+
+        states = []
+        for n, address in enumerate(addresses):
+            values = results[n * len(GAUGE_USER_VIEWS): (n + 1) * len(GAUGE_USER_VIEWS)]
+            if any(v is None for v in values):
+                raise ModelRunError(f'Can not read the gauge {self.gauge.address} '
+                                    f'for {address}')
+            states.append(dict(zip(GAUGE_USER_VIEWS, values), address=address))
+        return states
+
+    def read(self, addresses: List[Address]) -> List[dict]:
+        """
+        Views of the gauge for the addresses, in their order.
+        """
+        chunks = [addresses[start:start + self.CHUNK_SIZE]
+                  for start in range(0, len(addresses), self.CHUNK_SIZE)]
+        return [state
+                for result in map_parallel(self.read_chunk, chunks)
+                for state in result.get()]
+
+    def stream(self) -> Iterator[List[dict]]:
+        """
+        Views of the gauge for all its depositors, one page of depositors at a time.
+        """
+        for page in self.depositor_pages():
+            yield self.read(page)
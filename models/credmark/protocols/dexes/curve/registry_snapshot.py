@@ -0,0 +1,183 @@
+from collections import Counter
+from threading import RLock
+from typing import Dict, List, NamedTuple, Tuple
+
+from credmark.cmf.model.errors import ModelDataError
+from credmark.cmf.types import Address, Contract
+from models.utils.ledger import ledger_event_records, ledger_head
+from models.utils.multicall import multicall
+from models.utils.store import SQLiteStore
+
+GAUGE_ABI_LP_TOKEN = '[{"stateMutability":"view","type":"function","name":"lp_token","inputs":[],"outputs":[{"name":"","type":"address"}],"gas":3168}]'  # pylint:disable=line-too-long
+
+REGISTRY_SNAPSHOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    chain_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    address TEXT NOT NULL,
+    lp_token TEXT NOT NULL,
+    added_block INTEGER NOT NULL,
+    removed_block INTEGER,
+    PRIMARY KEY (chain_id, source, kind, n)
+);
+CREATE TABLE IF NOT EXISTS synced (
+    chain_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    synced_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, source, kind)
+);
+"""
+
+
+class RegistryEntry(NamedTuple):
+    address: Address
+    lp_token: Address
+    added_block: int
+
+
+class CurveRegistrySnapshot:
+    """
+    Pools of a Curve registry, or gauges of the gauge controller, with their LP tokens
+    and the blocks they were added, from the PoolAdded / PoolRemoved and NewGauge events.
+
+    The snapshot is synced from the ledger into an on-disk store and extended as later blocks
+    are requested, so listing the entries as of a block is a query of the store.
+    The number of entries is checked against pool_count / n_gauges of the contract before
+    a sync is written, and a mismatch, or a ledger behind the context block,
+    raises ModelDataError.
+    """
+
+    POOLS = 'pool'
+    GAUGES = 'gauge'
+
+    _snapshots: Dict[Tuple[int, Address, str], 'CurveRegistrySnapshot'] = {}
+    _snapshots_lock = RLock()
+
+    def __init__(self, chain_id: int, source: Contract, kind: str):
+        self.chain_id = chain_id
+        self.source = source
+        self.kind = kind
+        self.store = SQLiteStore.open('curve_registry')
+        self.store.execute_script(REGISTRY_SNAPSHOT_SCHEMA)
+        self._lock = RLock()
+
+    @classmethod
+    def open(cls, context, source: Contract, kind: str) -> 'CurveRegistrySnapshot':
+        """
+        Return the process-wide snapshot of the registry or gauge controller,
+        synced up to the context block.
+        """
+        key = (context.chain_id, source.address, kind)
+        with cls._snapshots_lock:
+            snapshot = cls._snapshots.get(key)
+            if snapshot is None:
+                snapshot = cls(context.chain_id, source, kind)
+                cls._snapshots[key] = snapshot
+        snapshot.sync(context)
+        return snapshot
+
+    def _key(self) -> tuple:
+        return (self.chain_id, str(self.source.address), self.kind)
+
+    def synced_block(self) -> int:
+        row = self.store.query_one(
+            'SELECT synced_block FROM synced WHERE chain_id = ? AND source = ? AND kind = ?',
+            self._key())
+        return -1 if row is None else row[0]
+
+    def ledger_events(self, event_name: str, address_input: str,
+                      from_block: int, to_block: int) -> List[Tuple[int, int, Address]]:
+        """
+        (block number, log index, address) of the events in the block range.
+        """
+        return [(r['block_number'], r['log_index'], Address(r[address_input]))
+                for records in ledger_event_records(self.source, event_name, [address_input],
+                                                    from_block, to_block)
+                for r in records]
+
+    def lp_tokens(self, context, addresses: List[Address]) -> List[Address]:
+        if self.kind == self.POOLS:
+            calls = [self.source.functions.get_lp_token(address.checksum)
+                     for address in addresses]
+        else:
+            calls = [Contract(address=address, abi=GAUGE_ABI_LP_TOKEN).functions.lp_token()
+                     for address in addresses]
+        return [Address.null() if lp_token is None else Address(lp_token)
+                for lp_token in multicall(context, calls)]
+
+    def check_count(self, block_number: int, n_entries: int) -> None:
+        count = (self.source.functions.pool_count().call() if self.kind == self.POOLS
+                 else self.source.functions.n_gauges().call())
+        if count != n_entries:
+            raise ModelDataError(f'Snapshot of {self.source.address} has {n_entries} '
+                                 f'{self.kind}s for {count} at block {block_number}')
+
+    def sync(self, context) -> None:
+        to_block = int(context.block_number)
+        with self._lock:
+            from_block = self.synced_block()
+            if from_block >= to_block:
+                self.check_count(to_block, len(self.entries(to_block)))
+                return
+
+            head = ledger_head(context, to_block)
+            if head < to_block:
+                raise ModelDataError(f'Ledger is at block {head}, before the snapshot of '
+                                     f'{self.source.address} at block {to_block}')
+
+            if self.kind == self.POOLS:
+                added = self.ledger_events('PoolAdded', 'pool', from_block, to_block)
+                removed = self.ledger_events('PoolRemoved', 'pool', from_block, to_block)
+            else:
+                added = self.ledger_events('NewGauge', 'addr', from_block, to_block)
+                removed = []
+
+            row = self.store.query_one(
+                'SELECT MAX(n) FROM entries WHERE chain_id = ? AND source = ? AND kind = ?',
+                self._key())
+            next_n = 0 if row is None or row[0] is None else row[0] + 1
+
+            lp_tokens = dict(zip([address for _, _, address in added],
+                                 self.lp_tokens(context, [address for _, _, address in added])))
+
+            # Entries as of to_block once the statements are written, to check them first
+            active = Counter(entry.address for entry in self.entries(from_block))
+            statements = []
+            events = sorted([(b, i, address, True) for b, i, address in added] +
+                            [(b, i, address, False) for b, i, address in removed])
+            for block_number, _, address, is_added in events:
+                if is_added:
+                    statements.append(
+                        ('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         [self._key() + (next_n, str(address), str(lp_tokens[address]),
+                                         block_number, None)]))
+                    next_n += 1
+                    active[address] += 1
+                else:
+                    statements.append(
+                        ('UPDATE entries SET removed_block = ? '
+                         'WHERE chain_id = ? AND source = ? AND kind = ? AND address = ? '
+                         'AND removed_block IS NULL',
+                         [(block_number,) + self._key() + (str(address),)]))
+                    active.pop(address, None)
+
+            self.check_count(to_block, sum(active.values()))
+            statements.append(('INSERT OR REPLACE INTO synced VALUES (?, ?, ?, ?)',
+                               [self._key() + (to_block,)]))
+            self.store.execute_many(statements)
+
+    def entries(self, block_number: int) -> List[RegistryEntry]:
+        """
+        Entries in the registry as of the block, in the order they were added.
+        """
+        rows = self.store.query(
+            'SELECT address, lp_token, added_block FROM entries '
+            'WHERE chain_id = ? AND source = ? AND kind = ? '
+            'AND added_block <= ? AND (removed_block IS NULL OR removed_block > ?) '
+            'ORDER BY n',
+            self._key() + (block_number, block_number))
+        return [RegistryEntry(Address(address), Address(lp_token), added_block)
+                for address, lp_token, added_block in rows]
@@ -0,0 +1,410 @@
+# pylint:disable=locally-disabled,invalid-name
+# Names of the pool math, e.g. xp, get_D, x, d and y, are those of the pool contracts.
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from credmark.cmf.types import Address, Contract
+from models.tmp_abi_lookup import CURVE_VYPER_POOL, ERC_20_TOKEN_CONTRACT_ABI
+from models.utils.multicall import multicall
+
+ETH_ADDRESS = Address('0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE')
+
+MAX_COINS = 8
+PRECISION = 10 ** 18
+FEE_DENOMINATOR = 10 ** 10
+A_PRECISION = 100
+CRYPTO_A_MULTIPLIER = 10000
+
+NEWTON_ITERATIONS = 255
+NEWTON_TOLERANCE = 1e-14
+BISECT_ITERATIONS = 100
+
+STABLE_STATE_FUNCTIONS = ['A', 'A_precise', 'fee', 'stored_rates', 'base_pool',
+                          'lp_token', 'token', 'get_virtual_price']
+CRYPTO_STATE_FUNCTIONS = ['A', 'gamma', 'D', 'mid_fee', 'out_fee', 'fee_gamma',
+                          'token', 'get_virtual_price']
+
+
+def bisect(func, low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """
+    Vectorized bisection for a root of func between low and high, where func changes sign.
+    """
+    f_low = func(low)
+    for _ in range(BISECT_ITERATIONS):
+        mid = (low + high) / 2
+        f_mid = func(mid)
+        same_side = np.sign(f_mid) == np.sign(f_low)
+        low = np.where(same_side, mid, low)
+        f_low = np.where(same_side, f_mid, f_low)
+        high = np.where(same_side, high, mid)
+    return (low + high) / 2
+
+
+class CurvePoolCoins(NamedTuple):
+    address: Address
+    coins: List[Address]
+    balances: np.ndarray
+    lp_token: Optional[Address]
+    lp_supply: float
+
+
+class CryptoSwapParameters(NamedTuple):
+    amp: float
+    gamma: float
+    d_stored: float
+    mid_fee: float
+    out_fee: float
+    fee_gamma: float
+
+
+class CurvePoolState(ABC):
+    """
+    State of a Curve pool at a block, read once, to compute swaps, deposits and withdrawals
+    locally for vectors of amounts.
+
+    Amounts are in the coins' raw units as for the pool's get_dy and calc_token_amount.
+    The computation is in floating point, so results match the pool's integer math
+    to about 1e-12 relatively.
+    """
+
+    def __init__(self, pool_coins: CurvePoolCoins):
+        self.address = pool_coins.address
+        self.coins = pool_coins.coins
+        self.balances = pool_coins.balances
+        self.lp_token = pool_coins.lp_token
+        self.lp_supply = pool_coins.lp_supply
+
+    @property
+    def n_coins(self) -> int:
+        return len(self.coins)
+
+    def index(self, coin: Address) -> int:
+        return self.coins.index(Address(coin))
+
+    @abstractmethod
+    def xp(self, balances: np.ndarray) -> np.ndarray:
+        """
+        Balances in the units of the invariant.
+        """
+
+    @abstractmethod
+    def get_D(self, xp: np.ndarray) -> np.ndarray:
+        """
+        Invariant D for the balances xp, of shape (n_coins,) or (k, n_coins).
+        """
+
+    @abstractmethod
+    def get_dy(self, i: int, j: int, dx) -> np.ndarray:
+        """
+        Amounts of coin j received for selling the amounts dx of coin i, after the fee.
+        """
+
+    @property
+    @abstractmethod
+    def virtual_price(self) -> float:
+        """
+        Value of an LP token in 1e18 units of the invariant.
+        """
+
+    def calc_token_amount(self, amounts, deposit: bool) -> np.ndarray:
+        """
+        LP tokens minted for depositing, or burnt for withdrawing, the amounts of each coin.
+        amounts is of shape (n_coins,) or (k, n_coins). Fees are not included.
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        new_balances = self.balances + amounts if deposit else self.balances - amounts
+        d_0 = self.get_D(self.xp(self.balances))
+        d_1 = self.get_D(self.xp(new_balances))
+        return np.abs(d_1 - d_0) * self.lp_supply / d_0
+
+    def swap_curve(self, i: int, j: int, amounts) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        For selling each of the amounts of coin i for coin j, return the amounts of j received,
+        the execution rates (j per i, in raw units) and the marginal rates after the trade.
+        """
+        amounts = np.asarray(amounts, dtype=float)
+        step = max(self.balances[i] * 1e-6, 1.0)
+        amounts_out = self.get_dy(i, j, amounts)
+        marginal_rates = (self.get_dy(i, j, amounts + step) - amounts_out) / step
+        safe_amounts = np.where(amounts > 0, amounts, 1)
+        rates = np.where(amounts > 0, amounts_out / safe_amounts, marginal_rates)
+        return amounts_out, rates, marginal_rates
+
+    @classmethod
+    def load(cls, context, pool: Contract) -> Optional['CurvePoolState']:
+        return cls.load_many(context, [pool])[0]
+
+    @classmethod
+    def load_many(cls, context, pools: Sequence[Contract]) -> List[Optional['CurvePoolState']]:
+        """
+        Load the pools with two batches of calls for all pools: the pool state with coins
+        and balances, then the coins' decimals, LP token supply and the rates that depend on
+        other contracts. A pool that can not be simulated, e.g. a lending pool whose rates
+        come from the lending protocol, or a pool with an empty coin, is None.
+        """
+        reads = []
+        for pool_n, pool in enumerate(pools):
+            functions = pool.abi.functions
+            is_crypto = 'gamma' in functions
+            for k in range(MAX_COINS):
+                reads.append((pool_n, ('coins', k), pool.functions.coins(k)))
+                reads.append((pool_n, ('balances', k), pool.functions.balances(k)))
+            for name in (CRYPTO_STATE_FUNCTIONS if is_crypto else STABLE_STATE_FUNCTIONS):
+                if name in functions:
+                    reads.append((pool_n, (name, None), getattr(pool.functions, name)()))
+
+        states: List[Dict] = [{} for _ in pools]
+        results = multicall(context, [call for _, _, call in reads])
+        for (pool_n, key, _), result in zip(reads, results):
+            states[pool_n][key] = result
+
+        second_reads = []
+        for pool_n, (pool, state) in enumerate(zip(pools, states)):
+            coins = []
+            for k in range(MAX_COINS):
+                coin = state[('coins', k)]
+                if coin is None or Address(coin) == Address.null():
+                    break
+                coins.append(Address(coin))
+            state['coins'] = coins
+
+            for coin in coins:
+                if coin != ETH_ADDRESS:
+                    second_reads.append(
+                        (pool_n, ('decimals', coin),
+                         Contract(address=coin, abi=ERC_20_TOKEN_CONTRACT_ABI)
+                         .functions.decimals()))
+
+            lp_token = state.get(('lp_token', None)) or state.get(('token', None))
+            if lp_token is None and 'totalSupply' in pool.abi.functions:
+                lp_token = pool.address
+            state['lp_token'] = None if lp_token is None else Address(lp_token)
+            if state['lp_token'] is not None:
+                second_reads.append(
+                    (pool_n, ('totalSupply', None),
+                     Contract(address=state['lp_token'], abi=ERC_20_TOKEN_CONTRACT_ABI)
+                     .functions.totalSupply()))
+
+            if 'gamma' in pool.abi.functions:
+                if len(coins) == 2:
+                    second_reads.append((pool_n, ('price_scale', 0),
+                                         pool.functions.price_scale()))
+                else:
+                    second_reads.extend((pool_n, ('price_scale', k),
+                                         pool.functions.price_scale(k))
+                                        for k in range(len(coins) - 1))
+            elif state.get(('base_pool', None)) is not None:
+                base_pool = Contract(address=Address(state[('base_pool', None)]),
+                                     abi=CURVE_VYPER_POOL)
+                second_reads.append((pool_n, ('base_virtual_price', None),
+                                     base_pool.functions.get_virtual_price()))
+
+        results = multicall(context, [call for _, _, call in second_reads])
+        for (pool_n, key, _), result in zip(second_reads, results):
+            states[pool_n][key] = result
+
+        return [cls.from_state(pool, state) for pool, state in zip(pools, states)]
+
+    @staticmethod
+    def from_state(pool: Contract, state: Dict) -> Optional['CurvePoolState']:
+        coins = state['coins']
+        n_coins = len(coins)
+        if n_coins < 2:
+            return None
+
+        balances = [state[('balances', k)] for k in range(n_coins)]
+        decimals = [18 if coin == ETH_ADDRESS else state.get(('decimals', coin))
+                    for coin in coins]
+        if any(v is None or v == 0 for v in balances) or any(d is None for d in decimals):
+            return None
+        pool_coins = CurvePoolCoins(pool.address, coins, np.array(balances, dtype=float),
+                                    state['lp_token'],
+                                    float(state.get(('totalSupply', None)) or 0))
+        precisions = np.array([10 ** (18 - d) for d in decimals], dtype=float)
+
+        if 'gamma' in pool.abi.functions:
+            return CryptoSwapState.from_values(pool_coins, precisions, state)
+        return StableSwapState.from_values(pool, pool_coins, precisions, state)
+
+
+class StableSwapState(CurvePoolState):
+    """
+    StableSwap pool: A * n^n * sum(x) + D = A * D * n^n + D^(n+1) / (n^n * prod(x)),
+    with x the balances times the rates in 1e18 units, solved by Newton's method as the pool.
+    """
+
+    def __init__(self, pool_coins: CurvePoolCoins, amp: float, fee: float, rates: np.ndarray):
+        super().__init__(pool_coins)
+        self.amp = amp
+        self.fee = fee
+        self.rates = rates
+
+    @staticmethod
+    def from_values(pool: Contract, pool_coins: CurvePoolCoins, precisions: np.ndarray,
+                   state: Dict) -> Optional['StableSwapState']:
+        n_coins = len(pool_coins.coins)
+        if state.get(('A_precise', None)) is not None:
+            amp = state[('A_precise', None)] / A_PRECISION
+        elif state.get(('A', None)) is not None:
+            amp = float(state[('A', None)])
+        else:
+            return None
+        fee = state.get(('fee', None))
+        if fee is None:
+            return None
+
+        stored_rates = state.get(('stored_rates', None))
+        if stored_rates is not None:
+            rates = np.array(stored_rates[:n_coins], dtype=float)
+        elif state.get(('base_virtual_price', None)) is not None:
+            rates = precisions * PRECISION
+            rates[-1] = float(state[('base_virtual_price', None)])
+        elif 'exchange_underlying' in pool.abi.functions or state.get(('base_pool', None)):
+            # Lending pools' rates are read from the lending protocol at each call
+            return None
+        else:
+            rates = precisions * PRECISION
+
+        return StableSwapState(pool_coins, amp=amp, fee=fee / FEE_DENOMINATOR, rates=rates)
+
+    def xp(self, balances: np.ndarray) -> np.ndarray:
+        return balances * self.rates / PRECISION
+
+    def get_D(self, xp: np.ndarray) -> np.ndarray:
+        n_coins = xp.shape[-1]
+        s = xp.sum(axis=-1)
+        d = s.copy()
+        ann = self.amp * n_coins
+        for _ in range(NEWTON_ITERATIONS):
+            d_p = d.copy()
+            for k in range(n_coins):
+                d_p = d_p * d / (xp[..., k] * n_coins)
+            d_prev = d
+            d = (ann * s + d_p * n_coins) * d / ((ann - 1) * d + (n_coins + 1) * d_p)
+            if np.all(np.abs(d - d_prev) <= d * NEWTON_TOLERANCE):
+                break
+        return d
+
+    def get_y(self, i: int, j: int, x: np.ndarray, xp: np.ndarray, d: float) -> np.ndarray:
+        """
+        Balance of coin j in the pool's units for the balance x of coin i at the invariant d.
+        """
+        n_coins = len(xp)
+        ann = self.amp * n_coins
+        c = np.full(x.shape, d)
+        s = np.zeros(x.shape)
+        for k in range(n_coins):
+            if k == j:
+                continue
+            x_k = x if k == i else xp[k]
+            s = s + x_k
+            c = c * d / (x_k * n_coins)
+        c = c * d / (ann * n_coins)
+        b = s + d / ann
+
+        y = np.full(x.shape, d)
+        for _ in range(NEWTON_ITERATIONS):
+            y_prev = y
+            y = (y * y + c) / (2 * y + b - d)
+            if np.all(np.abs(y - y_prev) <= y * NEWTON_TOLERANCE):
+                break
+        return y
+
+    def get_dy(self, i: int, j: int, dx) -> np.ndarray:
+        dx = np.asarray(dx, dtype=float)
+        xp = self.xp(self.balances)
+        d = float(self.get_D(xp))
+        y = self.get_y(i, j, xp[i] + dx * self.rates[i] / PRECISION, xp, d)
+        dy = (xp[j] - y) * PRECISION / self.rates[j]
+        return dy * (1 - self.fee)
+
+    @property
+    def virtual_price(self) -> float:
+        return float(self.get_D(self.xp(self.balances))) * PRECISION / self.lp_supply
+
+
+class CryptoSwapState(CurvePoolState):
+    """
+    CryptoSwap pool: K * D^(n-1) * sum(x) + prod(x) = K * D^n + (D / n)^n,
+    with K = A * K0 * gamma^2 / (gamma + 1 - K0)^2 and K0 = prod(x) * n^n / D^n,
+    x the balances in 1e18 units times the price scale. The fee moves from mid_fee to
+    out_fee as the balances move away from the price scale.
+    """
+
+    def __init__(self, pool_coins: CurvePoolCoins, parameters: CryptoSwapParameters,
+                 precisions: np.ndarray, price_scale: np.ndarray, virtual_price: float):
+        super().__init__(pool_coins)
+        self.parameters = parameters
+        self.scales = precisions * np.concatenate([[1.0], price_scale])
+        self._virtual_price = virtual_price
+
+    @staticmethod
+    def from_values(pool_coins: CurvePoolCoins, precisions: np.ndarray,
+                   state: Dict) -> Optional['CryptoSwapState']:
+        n_coins = len(pool_coins.coins)
+        crypto_values = [state.get((name, None))
+                         for name in ['A', 'gamma', 'D', 'mid_fee', 'out_fee', 'fee_gamma']]
+        price_scale = [state.get(('price_scale', k)) for k in range(n_coins - 1)]
+        if any(v is None for v in crypto_values + price_scale):
+            return None
+        amp, gamma, d_stored, mid_fee, out_fee, fee_gamma = crypto_values
+        parameters = CryptoSwapParameters(amp=amp / CRYPTO_A_MULTIPLIER / n_coins ** n_coins,
+                                          gamma=gamma / PRECISION,
+                                          d_stored=float(d_stored),
+                                          mid_fee=mid_fee / FEE_DENOMINATOR,
+                                          out_fee=out_fee / FEE_DENOMINATOR,
+                                          fee_gamma=fee_gamma / PRECISION)
+        return CryptoSwapState(pool_coins, parameters, precisions,
+                               price_scale=np.array(price_scale, dtype=float) / PRECISION,
+                               virtual_price=float(state.get(('get_virtual_price', None))
+                                                   or PRECISION))
+
+    @property
+    def amp(self) -> float:
+        return self.parameters.amp
+
+    def xp(self, balances: np.ndarray) -> np.ndarray:
+        return balances * self.scales
+
+    def invariant(self, x: np.ndarray, d: np.ndarray) -> np.ndarray:
+        n_coins = x.shape[-1]
+        prod = np.prod(x, axis=-1)
+        k0 = prod * n_coins ** n_coins / d ** n_coins
+        k = self.amp * k0 * self.parameters.gamma ** 2 / (self.parameters.gamma + 1 - k0) ** 2
+        return (k * d ** (n_coins - 1) * x.sum(axis=-1) + prod
+                - k * d ** n_coins - (d / n_coins) ** n_coins)
+
+    def get_D(self, xp: np.ndarray) -> np.ndarray:
+        n_coins = xp.shape[-1]
+        # D is between n times the geometric mean of the balances and their sum
+        low = n_coins * np.exp(np.log(xp).mean(axis=-1))
+        high = xp.sum(axis=-1)
+        return bisect(lambda d: self.invariant(xp, d), low, high)
+
+    def fee(self, xp: np.ndarray) -> np.ndarray:
+        n_coins = xp.shape[-1]
+        k = np.prod(xp, axis=-1) * n_coins ** n_coins / xp.sum(axis=-1) ** n_coins
+        f = self.parameters.fee_gamma / (self.parameters.fee_gamma + 1 - k)
+        return self.parameters.mid_fee * f + self.parameters.out_fee * (1 - f)
+
+    def get_dy(self, i: int, j: int, dx) -> np.ndarray:
+        dx = np.asarray(dx, dtype=float)
+        xp = self.xp(self.balances)
+        x = np.broadcast_to(xp, dx.shape + xp.shape).copy()
+        x[..., i] = xp[i] + dx * self.scales[i]
+
+        def _invariant_at(y):
+            x[..., j] = y
+            return self.invariant(x, self.parameters.d_stored)
+
+        # The balance of j is between 0, where the invariant is negative, and its current value
+        y = bisect(_invariant_at, np.zeros(dx.shape), np.full(dx.shape, xp[j]))
+        x[..., j] = y
+        dy = (xp[j] - y) / self.scales[j]
+        return dy * (1 - self.fee(x))
+
+    @property
+    def virtual_price(self) -> float:
+        return self._virtual_price
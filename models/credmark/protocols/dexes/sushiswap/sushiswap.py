@@ -1,11 +1,10 @@
 from credmark.cmf.model import Model
-from credmark.cmf.model.errors import ModelRunError
-from credmark.cmf.types import Address, Contract, Contracts, Token
-from credmark.cmf.types.compose import MapInputsOutput
+from credmark.cmf.types import Address, Contract, Contracts, Token, Tokens
 from credmark.dto import DTO, EmptyInput
 from models.credmark.protocols.dexes.uniswap.uniswap_v2 import \
     UniswapV2PoolMeta
-from models.dtos.price import Maybe, PoolPriceInfo, PoolPriceInfos
+from models.dtos.price import Many, Maybe, PoolPriceInfo, PoolPriceInfos
+from models.utils.parallel import run_model_parallel
 
 
 @Model.describe(slug="sushiswap.get-v2-factory",
@@ -31,7 +30,7 @@ class SushiswapV2Factory(Model):
 
 
 @Model.describe(slug='sushiswap.get-pools',
-                version='1.1',
+                version='1.3',
                 display_name='Sushiswap v2 Pools',
                 description='The Sushiswap pools where a token is traded',
                 category='protocol',
@@ -44,6 +43,20 @@ class SushiswapGetPoolsForToken(Model, UniswapV2PoolMeta):
         return self.get_uniswap_pools(input, contract.address)
 
 
+@Model.describe(slug='sushiswap.get-pools-tokens',
+                version='1.0',
+                display_name='Sushiswap v2 Pools for multiple tokens',
+                description='The Sushiswap pools where each of the tokens is traded',
+                category='protocol',
+                subcategory='sushi',
+                input=Tokens,
+                output=Many[Contracts])
+class SushiswapGetPoolsForTokens(Model, UniswapV2PoolMeta):
+    def run(self, input: Tokens) -> Many[Contracts]:
+        contract = Contract(**self.context.models.sushiswap.get_v2_factory())
+        return Many[Contracts](some=self.get_uniswap_pools_multiple(input.tokens, contract.address))
+
+
 @Model.describe(slug="sushiswap.all-pools",
                 version="1.1",
                 display_name="Sushiswap all pairs",
@@ -100,7 +113,7 @@ class SushiswapGetPair(Model):
 
 
 @Model.describe(slug='sushiswap.get-pool-info-token-price',
-                version='1.2',
+                version='1.3',
                 display_name='Sushiswap Token Pools Price ',
                 description='Gather price and liquidity information from pools',
                 category='protocol',
@@ -113,42 +126,16 @@ class SushiswapGetTokenPriceInfo(Model):
                                        input,
                                        return_type=Contracts)
 
-        # TODO: Too depths issue
-        def _use_compose():
-            model_slug = 'uniswap-v2.get-price-pool-info'
-            model_inputs = [{'token': input, 'pool': pool} for pool in pools]
-            pool_infos = self.context.run_model(
-                slug='compose.map-inputs',
-                input={'modelSlug': model_slug,
-                       'modelInputs': model_inputs},
-                return_type=MapInputsOutput[dict, Maybe[PoolPriceInfo]])
-
-            infos = []
-            for pool_n, p in enumerate(pool_infos):
-                if p.output is not None:
-                    if p.output.is_just():
-                        infos.append(p.output.just)
-                elif p.error is not None:
-                    self.logger.error(p.error)
-                    raise ModelRunError(
-                        f'Error with {model_slug}(input={model_inputs[pool_n]}). ' +
-                        p.error.message)
-                else:
-                    raise ModelRunError('compose.map-inputs: output/error cannot be both None')
-            return infos
-
-        def _use_for():
-            model_slug = 'uniswap-v2.get-price-pool-info'
-            model_inputs = [{'token': input, 'pool': pool} for pool in pools]
-            infos = []
-            for minput in model_inputs:
-                pi = self.context.run_model(model_slug,
-                                            minput,
-                                            return_type=Maybe[PoolPriceInfo])
-                if pi.is_just():
-                    infos.append(pi.just)
-            return infos
-
-        infos = _use_compose()
+        model_slug = 'uniswap-v2.get-price-pool-info'
+        model_inputs = [{'token': input, 'pool': pool} for pool in pools]
+        pool_infos = run_model_parallel(self.context, model_slug, model_inputs,
+                                        return_type=Maybe[PoolPriceInfo])
+        infos = []
+        for p in pool_infos:
+            if p.error is not None:
+                self.logger.error(f'Error with {model_slug}(input={p.input})')
+            pi = p.get()
+            if pi.is_just():
+                infos.append(pi.just)
 
         return PoolPriceInfos(infos=infos)
@@ -0,0 +1,121 @@
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from credmark.cmf.model.errors import ModelDataError
+from credmark.cmf.types import Address, Contract, ContractLedger
+from models.utils.ledger import ledger_event_pages, ledger_head
+from models.utils.store import SQLiteStore
+
+POOL_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pools (
+    chain_id INTEGER NOT NULL,
+    factory TEXT NOT NULL,
+    token0 TEXT NOT NULL,
+    token1 TEXT NOT NULL,
+    fee INTEGER NOT NULL,
+    pool TEXT NOT NULL,
+    created_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, factory, token0, token1, fee)
+);
+CREATE TABLE IF NOT EXISTS synced (
+    chain_id INTEGER NOT NULL,
+    factory TEXT NOT NULL,
+    synced_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, factory)
+);
+"""
+
+
+class DexPoolIndex:
+    """
+    On-disk index of (factory, token0, token1, fee) -> (pool, creation block)
+    filled from the factory's pool-creation events in the ledger.
+
+    The index is extended with the events after the last synced block when a model
+    runs at a later block, up to the last block the ledger has indexed. A lookup at a block
+    only sees pools created up to the block, so it returns the same pools as calling
+    the factory at the block.
+    """
+
+    def __init__(self, context, factory_addr: Address,
+                 event_name: str, pool_field: str, fee_field: Optional[str] = None):
+        self.context = context
+        self.factory = Contract(address=factory_addr)
+        self.event_name = event_name
+        self.pool_field = pool_field
+        self.fee_field = fee_field
+        self.store = SQLiteStore.open('dex_pool_index')
+        self.store.execute_script(POOL_INDEX_SCHEMA)
+
+    def synced_block(self) -> int:
+        row = self.store.query_one(
+            'SELECT synced_block FROM synced WHERE chain_id = ? AND factory = ?',
+            (self.context.chain_id, str(self.factory.address)))
+        return -1 if row is None else row[0]
+
+    def sync(self) -> None:
+        from_block = self.synced_block()
+        if from_block >= int(self.context.block_number):
+            return
+        # Pools created after the ledger's head are synced by a later call
+        to_block = ledger_head(self.context, int(self.context.block_number))
+        if from_block >= to_block:
+            return
+
+        block_col = ContractLedger.Events.Columns.EVT_BLOCK_NUMBER
+        pool_col = ContractLedger.Events.InputCol(self.pool_field)
+        columns = [block_col,
+                   ContractLedger.Events.InputCol('token0'),
+                   ContractLedger.Events.InputCol('token1'),
+                   pool_col]
+        if self.fee_field is not None:
+            columns.append(ContractLedger.Events.InputCol(self.fee_field))
+
+        for df in ledger_event_pages(self.factory, self.event_name, columns,
+                                     from_block, to_block):
+            self.store.execute_many([
+                ('INSERT OR IGNORE INTO pools VALUES (?, ?, ?, ?, ?, ?, ?)',
+                 [(self.context.chain_id,
+                   str(self.factory.address),
+                   str(Address(r[columns[1]])),
+                   str(Address(r[columns[2]])),
+                   0 if self.fee_field is None else int(r[columns[4]]),
+                   str(Address(r[pool_col])),
+                   int(r[block_col]))
+                  for r in df.to_dict('records')])])
+
+        # The synced block is only moved after all pages are loaded.
+        self.store.execute('INSERT OR REPLACE INTO synced VALUES (?, ?, ?)',
+                           (self.context.chain_id, str(self.factory.address), to_block))
+
+    def lookup(self, pairs: Sequence[Tuple[Address, Address, int]],
+               fallback: Callable[[List[Tuple[Address, Address, int]]],
+                                  List[Optional[Address]]]) -> List[Optional[Address]]:
+        """
+        Return the pool for each (tokenA, tokenB, fee) existing at the context block, or None.
+
+        When the index is synced to a block before the context block, the pairs not found
+        may have pools created since, so they are looked up with fallback, e.g. the factory.
+        """
+        self.sync()
+
+        factory = str(self.factory.address)
+        if self.store.query_one('SELECT 1 FROM pools WHERE chain_id = ? AND factory = ? LIMIT 1',
+                                (self.context.chain_id, factory)) is None:
+            raise ModelDataError(f'No pools of {factory} in the ledger')
+
+        block_number = int(self.context.block_number)
+        pools = []
+        for token_a, token_b, fee in pairs:
+            token0, token1 = sorted([str(Address(token_a)), str(Address(token_b))])
+            row = self.store.query_one(
+                'SELECT pool FROM pools WHERE chain_id = ? AND factory = ? AND '
+                'token0 = ? AND token1 = ? AND fee = ? AND created_block <= ?',
+                (self.context.chain_id, factory, token0, token1, fee, block_number))
+            pools.append(None if row is None else Address(row[0]))
+
+        if self.synced_block() < block_number:
+            missing = [n for n, pool in enumerate(pools) if pool is None]
+            if len(missing) > 0:
+                for n, pool in zip(missing, fallback([pairs[n] for n in missing])):
+                    pools[n] = None if pool is None else Address(pool)
+        return pools
@@ -0,0 +1,145 @@
+from threading import RLock
+from typing import Dict, List, Tuple
+
+import numpy as np
+from credmark.cmf.model import ModelContext
+from credmark.cmf.model.errors import ModelDataError
+from credmark.cmf.types import Address, Contract, ContractLedger
+from models.tmp_abi_lookup import UNISWAP_V2_POOL_ABI
+from models.utils.ledger import EVT_LOG_INDEX, ledger_head
+from models.utils.store import SQLiteStore
+
+RESERVE_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reserves_as_of (
+    chain_id INTEGER NOT NULL,
+    pair TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    reserve0 TEXT NOT NULL,
+    reserve1 TEXT NOT NULL,
+    PRIMARY KEY (chain_id, pair, block_number)
+);
+"""
+
+
+class PairReserveHistory:
+    """
+    Reserves of Uniswap V2 / SushiSwap pairs as of sampled blocks, from the pairs' Sync
+    events in the ledger, kept in an on-disk store.
+
+    The reserves of a pair as of a block are those of its last Sync at or before the block,
+    which is what getReserves returns at the block, and zero before the first Sync.
+    For a series of blocks, the ledger groups the Syncs by the interval between two
+    blocks of the series and only the last Sync of each interval is read.
+    """
+
+    _histories: Dict[int, 'PairReserveHistory'] = {}
+    _histories_lock = RLock()
+
+    def __init__(self, chain_id: int):
+        self.chain_id = chain_id
+        self.store = SQLiteStore.open('dex_pair_reserves')
+        self.store.execute_script(RESERVE_HISTORY_SCHEMA)
+        self._lock = RLock()
+
+    @classmethod
+    def open(cls, chain_id: int) -> 'PairReserveHistory':
+        with cls._histories_lock:
+            history = cls._histories.get(chain_id)
+            if history is None:
+                history = cls(chain_id)
+                cls._histories[chain_id] = history
+            return history
+
+    def last_syncs(self, contract: Contract, block_numbers: List[int]) \
+            -> Dict[int, Tuple[str, str]]:
+        """
+        Reserves of the last Sync of the pair at or before the first block and in each
+        interval between two blocks, by the block of the Sync.
+        """
+        context = ModelContext.current_context()
+        block_col = ContractLedger.Events.Columns.EVT_BLOCK_NUMBER
+        reserve0_col = ContractLedger.Events.InputCol('reserve0')
+        reserve1_col = ContractLedger.Events.InputCol('reserve1')
+
+        sync_blocks = [int(r[block_col]) for r in contract.ledger.events.Sync(
+            columns=[block_col],
+            where=f'{block_col} <= {block_numbers[0]}',
+            order_by=f'{block_col} desc',
+            limit='1')
+            .to_dataframe().to_dict('records')]
+
+        if len(block_numbers) > 1:
+            # Interval n is (block_numbers[n - 1], block_numbers[n]]
+            interval_n = ('CASE ' +
+                          ' '.join(f'WHEN {block_col} <= {block_number} THEN {n}'
+                                   for n, block_number in enumerate(block_numbers)) +
+                          ' END')
+            sync_blocks.extend(int(r['block_number']) for r in contract.ledger.events.Sync(
+                columns=[],
+                aggregates=[context.ledger.Aggregate(f'MAX({block_col})', 'block_number'),
+                            context.ledger.Aggregate(interval_n, 'interval_n')],
+                where=(f'{block_col} > {block_numbers[0]} AND '
+                       f'{block_col} <= {block_numbers[-1]}'),
+                group_by=interval_n)
+                .to_dataframe().to_dict('records'))
+
+        if len(sync_blocks) == 0:
+            return {}
+
+        # The later Sync of a block replaces the earlier ones.
+        syncs = (contract.ledger.events.Sync(
+            columns=[block_col, reserve0_col, reserve1_col],
+            where=f'{block_col} IN ({", ".join(str(b) for b in sync_blocks)})',
+            order_by=f'{block_col}, {EVT_LOG_INDEX}')
+            .to_dataframe())
+        reserves_by_block = {}
+        for r in syncs.to_dict('records'):
+            reserves_by_block[int(r[block_col])] = (str(r[reserve0_col]), str(r[reserve1_col]))
+        return reserves_by_block
+
+    def sync(self, pair: Address, block_numbers: List[int]) -> None:
+        """
+        Store the reserves of the pair as of each of the blocks, in ascending order.
+        """
+        head = ledger_head(ModelContext.current_context(), block_numbers[-1])
+        if head < block_numbers[-1]:
+            raise ModelDataError(f'Ledger is at block {head}, '
+                                 f'before the reserves of {pair} at block {block_numbers[-1]}')
+
+        contract = Contract(address=pair, abi=UNISWAP_V2_POOL_ABI)
+        reserves_by_block = self.last_syncs(contract, block_numbers)
+        sync_blocks = np.array(sorted(reserves_by_block), dtype=np.int64)
+        n = np.searchsorted(sync_blocks, block_numbers, side='right') - 1
+
+        rows = []
+        for block_number, sync_n in zip(block_numbers, n):
+            reserve0, reserve1 = (reserves_by_block[int(sync_blocks[sync_n])]
+                                  if sync_n >= 0 else ('0', '0'))
+            rows.append((self.chain_id, str(pair), block_number, reserve0, reserve1))
+        self.store.execute_many([
+            ('INSERT OR REPLACE INTO reserves_as_of VALUES (?, ?, ?, ?, ?)', rows)])
+
+    def stored_reserves(self, pair: Address, blocks: List[int]) \
+            -> Dict[int, Tuple[float, float]]:
+        query_blocks = ', '.join('?' * len(blocks))
+        return {r[0]: (float(r[1]), float(r[2])) for r in self.store.query(
+            'SELECT block_number, reserve0, reserve1 FROM reserves_as_of '
+            f'WHERE chain_id = ? AND pair = ? AND block_number IN ({query_blocks})',
+            (self.chain_id, str(pair), *blocks))}
+
+    def reserves_as_of(self, pair: Address, block_numbers: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reserves (reserve0, reserve1) of the pair as of each of the blocks.
+        """
+        blocks = sorted({int(b) for b in block_numbers})
+        with self._lock:
+            stored = self.stored_reserves(pair, blocks)
+            missing = [b for b in blocks if b not in stored]
+            if len(missing) > 0:
+                self.sync(pair, missing)
+                stored = self.stored_reserves(pair, blocks)
+
+        reserve0_as_of = np.array([stored[int(b)][0] for b in block_numbers], dtype=float)
+        reserve1_as_of = np.array([stored[int(b)][1] for b in block_numbers], dtype=float)
+        return reserve0_as_of, reserve1_as_of
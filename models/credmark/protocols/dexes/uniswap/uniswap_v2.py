@@ -1,63 +1,104 @@
+import logging
+import sqlite3
+
+import numpy as np
 import pandas as pd
-from credmark.cmf.model import Model
-from credmark.cmf.model.errors import ModelDataError, ModelRunError
+from credmark.cmf.model import Model, ModelContext
+from credmark.cmf.model.errors import (ModelBaseError, ModelDataError, ModelRunError,
+                                       create_instance_from_error_dict)
 from credmark.cmf.types import (Address, BlockNumber, Contract, ContractLedger,
                                 Contracts, Portfolio, Position, Price, Token,
                                 Tokens)
 from credmark.cmf.types.block_number import BlockNumberOutOfRangeError
-from credmark.cmf.types.compose import MapInputsOutput
+from credmark.cmf.types.ledger import BlockTable
 from credmark.cmf.types.series import BlockSeries, BlockSeriesRow
 from credmark.dto import DTO
+from models.credmark.protocols.dexes.uniswap.pool_index import DexPoolIndex
 from models.credmark.tokens.token import fix_erc20_token
-from models.dtos.price import Maybe, PoolPriceInfo, PoolPriceInfos, Prices
+from models.dtos.price import Many, Maybe, PoolPriceInfo, PoolPriceInfos, Prices
 from models.dtos.tvl import TVLInfo
 from models.dtos.volume import (TokenTradingVolume, TradingVolume, VolumeInput,
                                 VolumeInputHistorical)
 from models.tmp_abi_lookup import CURVE_VYPER_POOL, UNISWAP_V2_POOL_ABI, UNISWAP_V3_POOL_ABI
-from web3.exceptions import ABIFunctionNotFound, BadFunctionCallOutput
+from models.utils.multicall import multicall
+from models.utils.parallel import run_model_parallel
+from web3.exceptions import ABIFunctionNotFound
 
 
 class UniswapV2PoolMeta:
-    @staticmethod
-    def get_uniswap_pools(model_input, factory_addr):
-        factory = Contract(address=factory_addr)
-        tokens = [Token(symbol='USDC'),
-                  Token(symbol='USDT'),
-                  Token(symbol='WETH'),
-                  Token(symbol='DAI')]
+    # Provided by the Model the mixin is used with
+    context: ModelContext
+    logger: logging.Logger
+
+    PRIMARY_TOKENS = ['USDC', 'USDT', 'WETH', 'DAI']
+
+    def get_uniswap_pools(self, model_input, factory_addr):
+        return self.get_uniswap_pools_multiple([model_input], factory_addr)[0]
+
+    def get_uniswap_pools_multiple(self, model_inputs, factory_addr):
+        """
+        Pools are looked up in the local pool index built from the factory's PairCreated events.
+        If the index is not available, or for pools created after the block it is synced to,
+        the getPair lookups for all tokens and primary tokens
+        are batched with multicall: first in (token, primary) order,
+        then in (primary, token) order for those not found.
+        """
+        primary_tokens = [Token(symbol=symbol) for symbol in self.PRIMARY_TOKENS]
+
+        lookups = [(n, token.address, primary_token.address)
+                   for n, token in enumerate(model_inputs)
+                   for primary_token in primary_tokens]
+
+        def _lookup_factory(pairs):
+            pair_addresses = self.get_uniswap_pairs_multicall(
+                [(0, token0, token1) for token0, token1, _ in pairs], factory_addr)
+            return [None] * len(pairs) if pair_addresses is None else pair_addresses
 
-        contracts = []
         try:
-            for token in tokens:
-                pair_address = factory.functions.getPair(
-                    model_input.address, token.address).call()
-                if not pair_address == Address.null():
-                    cc = Contract(address=pair_address)
-                    try:
-                        _ = cc.abi
-                    except ModelDataError:
-                        pass
-                    contracts.append(cc)
-                else:
-                    pair_address = factory.functions.getPair(
-                        token.address, model_input.address).call()
-                    if not pair_address == Address.null():
-                        cc = Contract(address=pair_address)
-                        try:
-                            _ = cc.abi
-                        except ModelDataError:
-                            pass
-                        contracts.append(cc)
-
-            return Contracts(contracts=contracts)
-        except (BadFunctionCallOutput, BlockNumberOutOfRangeError):
+            pair_addresses = (DexPoolIndex(self.context, factory_addr, 'PairCreated', 'pair')
+                              .lookup([(token0, token1, 0) for _, token0, token1 in lookups],
+                                      _lookup_factory))
+        except (ModelBaseError, sqlite3.Error, OSError) as err:
+            self.logger.info(f'Pool index is not available for {factory_addr}: {err}')
+            pair_addresses = self.get_uniswap_pairs_multicall(lookups, factory_addr)
+            if pair_addresses is None:
+                return [Contracts(contracts=[]) for _ in model_inputs]
+
+        contracts = [[] for _ in model_inputs]
+        for (n, _, _), pair_address in zip(lookups, pair_addresses):
+            if pair_address is not None and not Address(pair_address) == Address.null():
+                cc = Contract(address=pair_address)
+                try:
+                    _ = cc.abi
+                except ModelDataError:
+                    pass
+                contracts[n].append(cc)
+
+        return [Contracts(contracts=token_contracts) for token_contracts in contracts]
+
+    def get_uniswap_pairs_multicall(self, lookups, factory_addr):
+        factory = Contract(address=factory_addr)
+        try:
+            pair_addresses = multicall(
+                self.context,
+                [factory.functions.getPair(token0, token1) for _, token0, token1 in lookups])
+
+            reverse_lookups = [n for n, pair_address in enumerate(pair_addresses)
+                               if pair_address is None or Address(pair_address) == Address.null()]
+            reverse_pair_addresses = multicall(
+                self.context,
+                [factory.functions.getPair(lookups[n][2], lookups[n][1]) for n in reverse_lookups])
+            for n, pair_address in zip(reverse_lookups, reverse_pair_addresses):
+                pair_addresses[n] = pair_address
+        except BlockNumberOutOfRangeError:
             # Or use this condition: if self.context.block_number < 10000835 # Uniswap V2
             # Or use this condition: if self.context.block_number < 10794229 # SushiSwap
-            return Contracts(contracts=[])
+            return None
+        return pair_addresses
 
 
 @Model.describe(slug='uniswap-v2.get-pools',
-                version='1.1',
+                version='1.3',
                 display_name='Uniswap v2 Token Pools',
                 description='The Uniswap v2 pools that support a token contract',
                 category='protocol',
@@ -74,6 +115,20 @@ class UniswapV2GetPoolsForToken(Model, UniswapV2PoolMeta):
         return self.get_uniswap_pools(input, Address(addr))
 
 
+@Model.describe(slug='uniswap-v2.get-pools-tokens',
+                version='1.0',
+                display_name='Uniswap v2 Token Pools for multiple tokens',
+                description='The Uniswap v2 pools that support each of the token contracts',
+                category='protocol',
+                subcategory='uniswap-v2',
+                input=Tokens,
+                output=Many[Contracts])
+class UniswapV2GetPoolsForTokens(Model, UniswapV2PoolMeta):
+    def run(self, input: Tokens) -> Many[Contracts]:
+        addr = UniswapV2GetPoolsForToken.UNISWAP_V2_FACTORY_ADDRESS[self.context.chain_id]
+        return Many[Contracts](some=self.get_uniswap_pools_multiple(input.tokens, Address(addr)))
+
+
 class UniswapPoolPriceInput(DTO):
     token: Token
     pool: Contract
@@ -154,7 +209,7 @@ class UniswapPoolPriceInfo(Model):
 
 
 @Model.describe(slug='uniswap-v2.get-pool-info-token-price',
-                version='1.4',
+                version='1.5',
                 display_name='Uniswap v2 Token Pools',
                 description='Gather price and liquidity information from pools for a Token',
                 category='protocol',
@@ -167,44 +222,17 @@ class UniswapV2GetTokenPriceInfo(Model):
                                        input,
                                        return_type=Contracts)
 
-        # TODO: Too depths issue
-        def _use_compose():
-            model_slug = 'uniswap-v2.get-price-pool-info'
-            model_inputs = [{'token': input, 'pool': pool} for pool in pools]
-            pool_infos = self.context.run_model(
-                slug='compose.map-inputs',
-                input={'modelSlug': model_slug,
-                       'modelInputs': model_inputs},
-                return_type=MapInputsOutput[dict, Maybe[PoolPriceInfo]])
-
-            infos = []
-            for pool_n, p in enumerate(pool_infos):
-                if p.output is not None:
-                    if p.output.just is not None:
-                        infos.append(p.output.just)
-                elif p.error is not None:
-                    self.logger.error(p.error)
-                    raise ModelRunError(
-                        f'Error with {model_slug}(input={model_inputs[pool_n]}). ' +
-                        p.error.message)
-                else:
-                    raise ModelRunError('compose.map-inputs: output/error cannot be both None')
-            return infos
-
-        def _use_for():
-            model_slug = 'uniswap-v2.get-price-pool-info'
-            model_inputs = [{'token': input, 'pool': pool} for pool in pools]
-
-            infos = []
-            for minput in model_inputs:
-                pi = self.context.run_model(model_slug,
-                                            minput,
-                                            return_type=Maybe[PoolPriceInfo])
-                if pi.is_just():
-                    infos.append(pi.just)
-            return infos
-
-        infos = _use_compose()
+        model_slug = 'uniswap-v2.get-price-pool-info'
+        model_inputs = [{'token': input, 'pool': pool} for pool in pools]
+        pool_infos = run_model_parallel(self.context, model_slug, model_inputs,
+                                        return_type=Maybe[PoolPriceInfo])
+        infos = []
+        for p in pool_infos:
+            if p.error is not None:
+                self.logger.error(f'Error with {model_slug}(input={p.input})')
+            pi = p.get()
+            if pi.is_just():
+                infos.append(pi.just)
 
         return PoolPriceInfos(infos=infos)
 
@@ -311,7 +339,7 @@ class UniswapV2PoolTVL(Model):
 
 
 @ Model.describe(slug='dex.pool-volume-historical',
-                 version='1.6',
+                 version='1.7',
                  display_name='Uniswap/Sushiswap/Curve Pool Swap Volumes - Historical',
                  description=('The volume of each token swapped in a pool '
                               'during the block interval from the current - Historical'),
@@ -493,44 +521,112 @@ class DexPoolSwapVolumeHistorical(Model):
         df_all_swaps.loc[:, 'end_block_number'] = (
             int(self.context.block_number) - (df_all_swaps.interval_n) * input.interval)
 
-        # TODO: get price for each block when composer model is ready
-        # all_blocks = df_all_swaps.loc[:, ['evt_block_number']]  # type: ignore
-        # for n in range(tokens_n):
-        #     for n_row, row in all_blocks[::-1].iterrows():
-        #         all_blocks.loc[n_row, f'token{n}_price'] = self.context.run_model(
-        #             'price.quote',
-        #             input=tokens[n], block_number=row.evt_block_number, return_type=Price).price
-
-        # df_all_swaps = df_all_swaps.merge(all_blocks, on=['evt_block_number'], how='left')
-
-        # Use current block's price, instead.
-        for cc in range(input.count):
-            df_swap_sel = df_all_swaps.loc[df_all_swaps.interval_n == cc, :]
-
-            if df_swap_sel.empty:  # type: ignore
-                block_number = self.context.block_number + (cc - input.count + 1) * input.interval
-                pool_volume_history.series[cc].blockNumber = int(block_number)
-                pool_volume_history.series[cc].blockTimestamp = int(BlockNumber(block_number).timestamp)
-                pool_volume_history.series[cc].sampleTimestamp = BlockNumber(block_number).timestamp
+        df_volume = (df_all_swaps
+                     .groupby('interval_n')
+                     .agg({'max_block_number': 'max'} |
+                          {f'inp_amount{n}_in': 'sum' for n in range(tokens_n)} |
+                          {f'inp_amount{n}_out': 'sum' for n in range(tokens_n)}))
+
+        # Price the tokens with the pool info at the last swap block of each interval, in one batch
+        price_blocks = [int(b) for b in df_volume.max_block_number.unique()]
+        block_prices = self.get_block_prices(input, price_blocks)
+        df_prices = pd.DataFrame(
+            [block_prices[b] for b in df_volume.max_block_number.astype(int)],
+            index=df_volume.index,
+            columns=[f'token{n}_price' for n in range(tokens_n)])
+
+        scale = np.array([10 ** tok.decimals for tok in tokens], dtype=float)
+        amount_out = (df_volume[[f'inp_amount{n}_out' for n in range(tokens_n)]]
+                      .to_numpy(dtype=float))
+        amount_in = (df_volume[[f'inp_amount{n}_in' for n in range(tokens_n)]]
+                     .to_numpy(dtype=float))
+        token_prices = df_prices.to_numpy(dtype=float)
+        sell_amount = amount_out / scale
+        buy_amount = amount_in / scale
+        sell_value = sell_amount * token_prices
+        buy_value = buy_amount * token_prices
+
+        # Intervals without swaps are reported at their end block
+        interval_blocks = [
+            int(df_volume.max_block_number[cc]) if cc in df_volume.index
+            else int(self.context.block_number + (cc - input.count + 1) * input.interval)
+            for cc in range(input.count)]
+        block_timestamps = self.get_block_timestamps(interval_blocks)
+
+        for cc, block_number in enumerate(interval_blocks):
+            pool_volume_history.series[cc].blockNumber = block_number
+            pool_volume_history.series[cc].blockTimestamp = block_timestamps[block_number]
+            pool_volume_history.series[cc].sampleTimestamp = block_timestamps[block_number]
+
+            if cc not in df_volume.index:
                 continue
 
-            block_number = df_swap_sel.max_block_number.to_list()[0]  # type: ignore
-            pool_info_past = self.context.run_model(input.pool_info_model, input=input, block_number=block_number)
+            row_n = df_volume.index.get_loc(cc)
             for n in range(tokens_n):
-                token_price = pool_info_past['prices'][n]['price']  # type: ignore
-                token_out = df_swap_sel[f'inp_amount{n}_out'].sum()  # type: ignore
-                token_in = df_swap_sel[f'inp_amount{n}_in'].sum()  # type: ignore
+                pool_volume_history.series[cc].output[n].sellAmount = sell_amount[row_n, n]
+                pool_volume_history.series[cc].output[n].buyAmount = buy_amount[row_n, n]
+                pool_volume_history.series[cc].output[n].sellValue = sell_value[row_n, n]
+                pool_volume_history.series[cc].output[n].buyValue = buy_value[row_n, n]
+
+        return pool_volume_history
+
+    def get_block_prices(self, input, block_numbers):
+        """
+        Return block number -> token prices from the pool info model,
+        run over the blocks in one compose.map-blocks request.
+        """
+        def _use_compose():
+            pool_info_run = self.context.run_model(
+                slug='compose.map-blocks',
+                input={'modelSlug': input.pool_info_model,
+                       'modelInput': {'address': input.address},
+                       'blockNumbers': block_numbers},
+                return_type=dict)
+
+            block_prices = {}
+            for result in pool_info_run['results']:
+                if result.get('error') is not None:
+                    self.logger.error(result['error'])
+                    raise create_instance_from_error_dict(result['error'])
+                block_prices[int(result['blockNumber'])] = [
+                    p['price'] for p in result['output']['prices']]
+            return block_prices
 
-                pool_volume_history.series[cc].blockNumber = int(block_number)
-                pool_volume_history.series[cc].blockTimestamp = int(BlockNumber(block_number).timestamp)
-                pool_volume_history.series[cc].sampleTimestamp = BlockNumber(block_number).timestamp
+        def _use_for():
+            block_prices = {}
+            for block_number in block_numbers:
+                pool_info_past = self.context.run_model(input.pool_info_model,
+                                                        input=input,
+                                                        block_number=block_number)
+                block_prices[block_number] = [p['price'] for p in pool_info_past['prices']]
+            return block_prices
 
-                pool_volume_history.series[cc].output[n].sellAmount = tokens[n].scaled(token_out)
-                pool_volume_history.series[cc].output[n].buyAmount = tokens[n].scaled(token_in)
-                pool_volume_history.series[cc].output[n].sellValue = tokens[n].scaled(token_out * token_price)
-                pool_volume_history.series[cc].output[n].buyValue = tokens[n].scaled(token_in * token_price)
+        if len(block_numbers) == 0:
+            return {}
 
-        return pool_volume_history
+        try:
+            return _use_compose()
+        except ModelBaseError as err:
+            self.logger.info(f'Fall back to run {input.pool_info_model} by block: {err}')
+            return _use_for()
+
+    def get_block_timestamps(self, block_numbers):
+        """
+        Return block number -> timestamp with one ledger query.
+        """
+        block_timestamps = {}
+        blocks = self.context.ledger.get_blocks(
+            columns=[BlockTable.Columns.NUMBER, BlockTable.Columns.TIMESTAMP],
+            where=(f'{BlockTable.Columns.NUMBER} in '
+                   f'({",".join(str(b) for b in set(block_numbers))})'))
+        for row in blocks.data:
+            block_timestamps[int(row[BlockTable.Columns.NUMBER])] = int(
+                row[BlockTable.Columns.TIMESTAMP])
+
+        for block_number in block_numbers:
+            if block_number not in block_timestamps:
+                block_timestamps[block_number] = int(BlockNumber(block_number).timestamp)
+        return block_timestamps
 
 
 @ Model.describe(slug='dex.pool-volume',
@@ -1,14 +1,21 @@
+import logging
+import sqlite3
+from typing import List
+
 import numpy as np
-from credmark.cmf.model import Model
-from credmark.cmf.model.errors import ModelDataError, ModelRunError
-from credmark.cmf.types import Address, Contract, Contracts, Price, Token
+from credmark.cmf.model import Model, ModelContext
+from credmark.cmf.model.errors import ModelBaseError, ModelDataError, ModelRunError
+from credmark.cmf.types import Address, Contract, Contracts, Price, Token, Tokens
 from credmark.cmf.types.block_number import BlockNumberOutOfRangeError
-from credmark.cmf.types.compose import MapInputsOutput
-from credmark.dto import DTO
+from credmark.dto import DTO, DTOField
+from models.credmark.protocols.dexes.uniswap.pool_index import DexPoolIndex
+from models.credmark.protocols.dexes.uniswap.uniswap_v3_depth import UniswapV3Depth
 from models.credmark.tokens.token import fix_erc20_token
-from models.dtos.price import PoolPriceInfo, PoolPriceInfos
+from models.dtos.price import Many, PoolPriceInfo, PoolPriceInfos
 from models.tmp_abi_lookup import UNISWAP_V3_POOL_ABI
-from web3.exceptions import BadFunctionCallOutput
+from models.utils.multicall import multicall
+from models.utils.parallel import run_model_parallel
+from models.utils.result_cache import cache_result
 
 np.seterr(all='raise')
 
@@ -36,51 +43,95 @@ class UniswapV3PoolInfo(DTO):
     token1_symbol: str
 
 
+class UniswapV3PoolMeta:
+    # Provided by the Model the mixin is used with
+    context: ModelContext
+    logger: logging.Logger
+
+    UNISWAP_V3_FACTORY_ADDRESS = {
+        1: "0x1F98431c8aD98523631AE4a59f267346ea31F984"
+    }
+
+    FEES = [3000, 10000]
+    PRIMARY_TOKENS = ['DAI', 'USDT', 'WETH', 'USDC']
+
+    def get_uniswap_v3_pools_multiple(self, model_inputs):
+        """
+        Pools are looked up in the local pool index built from the factory's PoolCreated events.
+        If the index is not available, or for pools created after the block it is synced to,
+        the getPool lookups for all tokens, fees and primary tokens are batched with multicall.
+        """
+        if self.context.chain_id != 1:
+            return [Contracts(contracts=[]) for _ in model_inputs]
+
+        primary_tokens = [Token(symbol=symbol) for symbol in self.PRIMARY_TOKENS]
+
+        addr = Address(self.UNISWAP_V3_FACTORY_ADDRESS[self.context.chain_id])
+
+        lookups = [(n, token.address, primary_token.address, fee)
+                   for n, token in enumerate(model_inputs)
+                   for fee in self.FEES
+                   for primary_token in primary_tokens
+                   if token.address and primary_token.address]
+
+        uniswap_factory = Contract(address=addr)
+
+        def _lookup_factory(pairs):
+            return multicall(
+                self.context,
+                [uniswap_factory.functions.getPool(token.checksum, primary_token.checksum, fee)
+                 for token, primary_token, fee in pairs])
+
+        try:
+            pool_addresses = (DexPoolIndex(self.context, addr, 'PoolCreated', 'pool', 'fee')
+                              .lookup([(token, primary_token, fee)
+                                       for _, token, primary_token, fee in lookups],
+                                      _lookup_factory))
+        except (ModelBaseError, sqlite3.Error, OSError) as err:
+            self.logger.info(f'Pool index is not available for {addr}: {err}')
+            try:
+                pool_addresses = _lookup_factory([(token, primary_token, fee)
+                                                  for _, token, primary_token, fee in lookups])
+            except BlockNumberOutOfRangeError:
+                return [Contracts(contracts=[]) for _ in model_inputs]
+
+        pools = [[] for _ in model_inputs]
+        for (n, _, _, _), pool in zip(lookups, pool_addresses):
+            if pool is not None and Address(pool) != Address.null():
+                cc = Contract(address=pool, abi=UNISWAP_V3_POOL_ABI)
+                try:
+                    _ = cc.abi
+                except ModelDataError:
+                    pass
+                pools[n].append(cc)
+
+        return [Contracts(contracts=token_pools) for token_pools in pools]
+
+
 @Model.describe(slug='uniswap-v3.get-pools',
-                version='1.1',
+                version='1.3',
                 display_name='Uniswap v3 Token Pools',
                 description='The Uniswap v3 pools that support a token contract',
                 category='protocol',
                 subcategory='uniswap-v3',
                 input=Token,
                 output=Contracts)
-class UniswapV3GetPoolsForToken(Model):
-    UNISWAP_V3_FACTORY_ADDRESS = {
-        1: "0x1F98431c8aD98523631AE4a59f267346ea31F984"
-    }
-
+class UniswapV3GetPoolsForToken(Model, UniswapV3PoolMeta):
     def run(self, input: Token) -> Contracts:
-        fees = [3000, 10000]
-        primary_tokens = [Token(symbol='DAI'),
-                          Token(symbol='USDT'),
-                          Token(symbol='WETH'),
-                          Token(symbol='USDC')]
+        return self.get_uniswap_v3_pools_multiple([input])[0]
 
-        if self.context.chain_id != 1:
-            return Contracts(contracts=[])
 
-        try:
-            addr = self.UNISWAP_V3_FACTORY_ADDRESS[self.context.chain_id]
-            uniswap_factory = Contract(address=addr)
-            pools = []
-            for fee in fees:
-                for primary_token in primary_tokens:
-                    if input.address and primary_token.address:
-                        pool = uniswap_factory.functions.getPool(
-                            input.address.checksum,
-                            primary_token.address.checksum,
-                            fee).call()
-                        if pool != Address.null():
-                            cc = Contract(address=pool, abi=UNISWAP_V3_POOL_ABI)
-                            try:
-                                _ = cc.abi
-                            except ModelDataError:
-                                pass
-                            pools.append(cc)
-
-            return Contracts(contracts=pools)
-        except (BadFunctionCallOutput, BlockNumberOutOfRangeError):
-            return Contracts(contracts=[])
+@Model.describe(slug='uniswap-v3.get-pools-tokens',
+                version='1.0',
+                display_name='Uniswap v3 Token Pools for multiple tokens',
+                description='The Uniswap v3 pools that support each of the token contracts',
+                category='protocol',
+                subcategory='uniswap-v3',
+                input=Tokens,
+                output=Many[Contracts])
+class UniswapV3GetPoolsForTokens(Model, UniswapV3PoolMeta):
+    def run(self, input: Tokens) -> Many[Contracts]:
+        return Many[Contracts](some=self.get_uniswap_v3_pools_multiple(input.tokens))
 
 
 @Model.describe(slug='uniswap-v3.get-pool-info',
@@ -97,6 +148,7 @@ class UniswapV3GetPoolInfo(Model):
     def tick_to_price(self, tick):
         return pow(self.UNISWAP_BASE, tick)
 
+    @cache_result
     def run(self, input: Contract) -> UniswapV3PoolInfo:
         try:
             _ = input.abi
@@ -188,7 +240,7 @@ class UniswapV3GetPoolInfo(Model):
 
 
 @Model.describe(slug='uniswap-v3.get-pool-info-token-price',
-                version='1.6',
+                version='1.7',
                 display_name='Uniswap v3 Token Pools Price ',
                 description='Gather price and liquidity information from pools',
                 category='protocol',
@@ -204,34 +256,13 @@ class UniswapV3GetTokenPricePoolInfo(Model):
         model_slug = 'uniswap-v3.get-pool-info'
         model_inputs = pools.contracts
 
-        def _use_compose():
-            pool_infos = self.context.run_model(
-                slug='compose.map-inputs',
-                input={'modelSlug': model_slug,
-                       'modelInputs': model_inputs},
-                return_type=MapInputsOutput[dict, UniswapV3PoolInfo])
-
-            infos = []
-            for pool_n, p in enumerate(pool_infos):
-                if p.output is not None:
-                    infos.append(p.output)
-                elif p.error is not None:
-                    self.logger.error(p.error)
-                    raise ModelRunError(
-                        f'Error with {model_slug}(input={model_inputs[pool_n]}). ' +
-                        p.error.message)
-                else:
-                    raise ModelRunError('compose.map-inputs: output/error cannot be both None')
-            return infos
-
-        def _use_for():
-            infos = []
-            for minput in model_inputs:
-                pi = self.context.run_model(model_slug, minput, return_type=UniswapV3PoolInfo)
-                infos.append(pi)
-            return infos
-
-        infos = _use_compose()
+        pool_infos = run_model_parallel(self.context, model_slug, model_inputs,
+                                        return_type=UniswapV3PoolInfo)
+        infos = []
+        for p in pool_infos:
+            if p.error is not None:
+                self.logger.error(f'Error with {model_slug}(input={p.input})')
+            infos.append(p.get())
 
         prices_with_info = []
         weth_price = None
@@ -286,3 +317,92 @@ class UniswapV3GetTokenPricePoolInfo(Model):
                 prices_with_info.append(pool_price_info)
 
         return PoolPriceInfos(infos=prices_with_info)
+
+
+class UniswapV3DepthInput(DTO):
+    pools: List[Contract]
+    token: Token = DTOField(description='Token to sell into the pools')
+    amounts: List[float] = DTOField(description='Amounts of the token to sell, scaled')
+    ranges: List[float] = DTOField([0.01, 0.02, 0.05, 0.1],
+                                   description='Relative price ranges to sum up liquidity. '
+                                   'The swaps are computed within the largest range')
+
+
+class UniswapV3PoolDepth(DTO):
+    """
+    @price: price of token0 in token1
+    @amounts_out: amounts of the other token for the amounts of the token sold
+    @price_impact: 1 - execution price / spot price for each amount
+    @filled: False if the pool's liquidity runs out or the price moves past the largest
+             of the ranges before the amount is sold
+    @liquidity_token0: token0 between the price and price * (1 + range)
+    @liquidity_token1: token1 between price * (1 - range) and the price
+    """
+    address: Address
+    token0: Token
+    token1: Token
+    tick: int
+    price: float
+    amounts_in: List[float]
+    amounts_out: List[float]
+    price_impact: List[float]
+    filled: List[bool]
+    ranges: List[float]
+    liquidity_token0: List[float]
+    liquidity_token1: List[float]
+
+
+class UniswapV3PoolDepths(DTO):
+    depths: List[UniswapV3PoolDepth]
+
+
+@Model.describe(slug='uniswap-v3.get-pools-depth',
+                version='1.0',
+                display_name='Uniswap v3 Pools Liquidity Depth',
+                description='Amounts out, price impact and liquidity within price ranges '
+                'of pools',
+                category='protocol',
+                subcategory='uniswap-v3',
+                input=UniswapV3DepthInput,
+                output=UniswapV3PoolDepths)
+class UniswapV3GetPoolsDepth(Model):
+    """
+    The initialized ticks of all pools within the largest of the ranges are loaded with
+    batched tickBitmap and ticks calls, then the swaps of all amounts and the liquidity
+    of all ranges are computed on arrays.
+    Pools without the token or not initialized are skipped.
+    """
+
+    def run(self, input: UniswapV3DepthInput) -> UniswapV3PoolDepths:
+        token = fix_erc20_token(input.token)
+        depths = UniswapV3Depth.load_many(self.context, input.pools, max(input.ranges, default=1.0))
+
+        pool_depths = []
+        for depth in depths:
+            if depth is None or token.address not in (depth.token0, depth.token1):
+                continue
+
+            token0 = fix_erc20_token(Token(address=depth.token0))
+            token1 = fix_erc20_token(Token(address=depth.token1))
+            zero_for_one = token.address == depth.token0
+            token_out = token1 if zero_for_one else token0
+
+            amounts_in = np.array(input.amounts, dtype=float) * (10 ** token.decimals)
+            amounts_out, price_impact, filled = depth.swap(amounts_in, zero_for_one)
+            liquidity_token0, liquidity_token1 = depth.liquidity_within(np.array(input.ranges))
+
+            pool_depths.append(UniswapV3PoolDepth(
+                address=depth.address,
+                token0=token0,
+                token1=token1,
+                tick=depth.tick,
+                price=depth.price * 10 ** (token0.decimals - token1.decimals),
+                amounts_in=input.amounts,
+                amounts_out=(amounts_out / (10 ** token_out.decimals)).tolist(),
+                price_impact=price_impact.tolist(),
+                filled=filled.tolist(),
+                ranges=input.ranges,
+                liquidity_token0=(liquidity_token0 / (10 ** token0.decimals)).tolist(),
+                liquidity_token1=(liquidity_token1 / (10 ** token1.decimals)).tolist()))
+
+        return UniswapV3PoolDepths(depths=pool_depths)
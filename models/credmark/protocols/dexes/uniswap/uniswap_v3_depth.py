@@ -0,0 +1,271 @@
+import math
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from credmark.cmf.model.errors import ModelRunError
+from credmark.cmf.types import Address, Contract
+from models.tmp_abi_lookup import UNISWAP_V3_POOL_ABI
+from models.utils.multicall import multicall
+
+MIN_TICK = -887272
+MAX_TICK = 887272
+UNISWAP_BASE = 1.0001
+
+
+class LiquiditySegments:
+    """
+    Ranges of constant liquidity met by moving the price from the current one in one direction,
+    up to the sqrt price limit of the loaded ticks.
+
+    Segment k runs from sqrt price start[k] to end[k] with liquidity[k];
+    amount_in[k] and amount_out[k] are the token amounts to swap across the whole segment.
+    """
+
+    def __init__(self, upward: bool, sqrt_start: float, liquidity: float,
+                 sqrt_bounds: np.ndarray, liquidity_net: np.ndarray, sqrt_limit: float):
+        self.upward = upward
+        # Liquidity after crossing each bound: added moving up, removed moving down
+        crossed = np.cumsum(liquidity_net if upward else -liquidity_net)
+        self.liquidity = np.clip(np.concatenate([[liquidity], liquidity + crossed]), 0, None)
+        self.end = np.concatenate([sqrt_bounds, [sqrt_limit]])
+        self.start = np.concatenate([[sqrt_start], self.end[:-1]])
+
+        if upward:
+            # token1 in, token0 out
+            self.amount_in = self.liquidity * (self.end - self.start)
+            self.amount_out = self.liquidity * (1 / self.start - 1 / self.end)
+        else:
+            # token0 in, token1 out
+            self.amount_in = self.liquidity * (1 / self.end - 1 / self.start)
+            self.amount_out = self.liquidity * (self.start - self.end)
+
+        self.cum_in = np.cumsum(self.amount_in)
+
+    @property
+    def cum_in_before(self) -> np.ndarray:
+        return self.cum_in - self.amount_in
+
+    @property
+    def cum_out_before(self) -> np.ndarray:
+        return np.cumsum(self.amount_out) - self.amount_out
+
+    def swap(self, amounts_in: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return amounts out, sqrt prices after the swaps and whether each amount is filled.
+        """
+        k = np.searchsorted(self.cum_in, amounts_in, side='right')
+        filled = k < len(self.cum_in)
+        k = np.minimum(k, len(self.cum_in) - 1)
+
+        remaining = np.where(filled, amounts_in - self.cum_in_before[k], self.amount_in[k])
+        liquidity = self.liquidity[k]
+        start = self.start[k]
+        safe_liquidity = np.where(liquidity > 0, liquidity, 1)
+        if self.upward:
+            sqrt_after = np.where(liquidity > 0, start + remaining / safe_liquidity, start)
+            partial_out = liquidity * (1 / start - 1 / sqrt_after)
+        else:
+            sqrt_after = np.where(liquidity > 0,
+                                  1 / (1 / start + remaining / safe_liquidity), start)
+            partial_out = liquidity * (start - sqrt_after)
+
+        amounts_out = self.cum_out_before[k] + partial_out
+        return amounts_out, sqrt_after, filled
+
+    def amount_out_to(self, sqrt_targets: np.ndarray) -> np.ndarray:
+        """
+        Amounts out of moving the price to each of the sqrt prices, i.e. the liquidity in range.
+        """
+        if self.upward:
+            k = np.searchsorted(self.end, sqrt_targets, side='left')
+        else:
+            k = np.searchsorted(-self.end, -sqrt_targets, side='left')
+        k = np.minimum(k, len(self.end) - 1)
+        start = self.start[k]
+        if self.upward:
+            partial_out = self.liquidity[k] * (1 / start - 1 / sqrt_targets)
+        else:
+            partial_out = self.liquidity[k] * (start - sqrt_targets)
+        return self.cum_out_before[k] + partial_out
+
+
+class UniswapV3PoolState(NamedTuple):
+    address: Address
+    token0: Address
+    token1: Address
+    sqrt_price: float
+    tick: int
+    liquidity: float
+    fee: int
+
+
+class UniswapV3Depth:
+    """
+    Initialized ticks of a Uniswap V3 pool as arrays, to compute vectorized swaps and
+    liquidity within price ranges.
+    The ticks are loaded from the tickBitmap words between tick_lower and tick_upper
+    around the current tick; a swap that moves the price past them is not filled.
+    Amounts and prices are in the tokens' raw units, with price as token1 per token0.
+    """
+
+    def __init__(self, state: UniswapV3PoolState, ticks: np.ndarray, liquidity_net: np.ndarray,
+                 tick_lower: int, tick_upper: int):
+        self.state = state
+        self.ticks = ticks
+        self.liquidity_net = liquidity_net
+
+        sqrt_bounds = UNISWAP_BASE ** (ticks / 2)
+        above = ticks > state.tick
+        self.up = LiquiditySegments(True, state.sqrt_price, state.liquidity,
+                                    sqrt_bounds[above], liquidity_net[above],
+                                    UNISWAP_BASE ** (tick_upper / 2))
+        self.down = LiquiditySegments(False, state.sqrt_price, state.liquidity,
+                                      sqrt_bounds[~above][::-1], liquidity_net[~above][::-1],
+                                      UNISWAP_BASE ** (tick_lower / 2))
+
+    @property
+    def address(self) -> Address:
+        return self.state.address
+
+    @property
+    def token0(self) -> Address:
+        return self.state.token0
+
+    @property
+    def token1(self) -> Address:
+        return self.state.token1
+
+    @property
+    def tick(self) -> int:
+        return self.state.tick
+
+    @property
+    def fee(self) -> int:
+        return self.state.fee
+
+    @property
+    def sqrt_price(self) -> float:
+        return self.state.sqrt_price
+
+    @property
+    def price(self) -> float:
+        return self.sqrt_price ** 2
+
+    @staticmethod
+    def word_positions(tick: int, tick_spacing: int, price_range: float) -> range:
+        """
+        Positions of the tickBitmap words with the ticks from price * (1 - price_range)
+        to price * (1 + price_range), for the price at the tick.
+        """
+        tick_upper = min(MAX_TICK, tick + math.ceil(math.log(1 + price_range, UNISWAP_BASE)))
+        tick_lower = (MIN_TICK if price_range >= 1 else
+                      max(MIN_TICK, tick + math.floor(math.log(1 - price_range, UNISWAP_BASE))))
+        return range((tick_lower // tick_spacing) >> 8, ((tick_upper // tick_spacing) >> 8) + 1)
+
+    @staticmethod
+    def word_ticks(word_positions: range, tick_spacing: int) -> Tuple[int, int]:
+        """
+        The lowest and the highest tick covered by the words.
+        """
+        return (max(MIN_TICK, word_positions[0] * 256 * tick_spacing),
+                min(MAX_TICK, (word_positions[-1] * 256 + 255) * tick_spacing))
+
+    @staticmethod
+    def initialized_ticks(word_position: int, word: int, tick_spacing: int) -> List[int]:
+        bits = np.unpackbits(np.frombuffer(word.to_bytes(32, 'little'), dtype=np.uint8),
+                             bitorder='little')
+        return [(word_position * 256 + int(bit)) * tick_spacing for bit in np.flatnonzero(bits)]
+
+    @classmethod
+    def load_many(cls, context, pools: Sequence[Contract],
+                  price_range: float) -> List[Optional['UniswapV3Depth']]:
+        """
+        Load the pools with three batches of calls for all pools: the pool state,
+        the tickBitmap words with the ticks within the relative price range of the current
+        price, and the initialized ticks.
+        A pool that is not initialized is None.
+        """
+        pools = [Contract(address=pool.address, abi=UNISWAP_V3_POOL_ABI) for pool in pools]
+        states = multicall(context,
+                           [f for pool in pools
+                            for f in [pool.functions.slot0(),
+                                      pool.functions.liquidity(),
+                                      pool.functions.tickSpacing(),
+                                      pool.functions.fee(),
+                                      pool.functions.token0(),
+                                      pool.functions.token1()]])
+        if any(state is None for state in states):
+            raise ModelRunError('Can not read the state of the pools')
+
+        pool_words = [cls.word_positions(states[6 * pool_n][1], states[6 * pool_n + 2],
+                                         price_range)
+                      for pool_n in range(len(pools))]
+        word_calls = [(pool_n, word_position, pool.functions.tickBitmap(word_position))
+                      for pool_n, pool in enumerate(pools)
+                      for word_position in pool_words[pool_n]]
+        words = multicall(context, [call for _, _, call in word_calls])
+
+        pool_ticks: List[List[int]] = [[] for _ in pools]
+        for (pool_n, word_position, _), word in zip(word_calls, words):
+            if word is None:
+                raise ModelRunError(f'Can not read the tick bitmap of {pools[pool_n].address}')
+            if word != 0:
+                pool_ticks[pool_n].extend(
+                    cls.initialized_ticks(word_position, word, states[6 * pool_n + 2]))
+
+        tick_calls = [(pool_n, tick) for pool_n, ticks in enumerate(pool_ticks) for tick in ticks]
+        tick_infos = multicall(context,
+                               [pools[pool_n].functions.ticks(tick) for pool_n, tick in tick_calls])
+
+        liquidity_nets: List[List[float]] = [[] for _ in pools]
+        for (pool_n, tick), tick_info in zip(tick_calls, tick_infos):
+            if tick_info is None:
+                raise ModelRunError(f'Can not read tick {tick} of {pools[pool_n].address}')
+            liquidity_nets[pool_n].append(float(tick_info[1]))
+
+        depths = []
+        for pool_n, pool in enumerate(pools):
+            slot0, liquidity, tick_spacing, fee, token0, token1 = \
+                states[6 * pool_n: 6 * pool_n + 6]
+            if slot0[0] == 0:
+                depths.append(None)
+                continue
+            state = UniswapV3PoolState(pool.address, Address(token0), Address(token1),
+                                       sqrt_price=slot0[0] / 2 ** 96,
+                                       tick=slot0[1],
+                                       liquidity=float(liquidity),
+                                       fee=fee)
+            tick_lower, tick_upper = cls.word_ticks(pool_words[pool_n], tick_spacing)
+            depths.append(cls(state,
+                              ticks=np.array(pool_ticks[pool_n], dtype=float),
+                              liquidity_net=np.array(liquidity_nets[pool_n], dtype=float),
+                              tick_lower=tick_lower,
+                              tick_upper=tick_upper))
+        return depths
+
+    def swap(self, amounts_in: np.ndarray, zero_for_one: bool) \
+            -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Amounts out for the amounts in, after the pool fee, with the price impact of each,
+        i.e. 1 - execution price / spot price, and whether each amount is filled.
+        """
+        amounts_in = np.asarray(amounts_in, dtype=float)
+        amounts_after_fee = amounts_in * (1 - self.fee / 1e6)
+        segments = self.down if zero_for_one else self.up
+        amounts_out, _sqrt_after, filled = segments.swap(amounts_after_fee)
+
+        spot = self.price if zero_for_one else 1 / self.price
+        safe_amounts_in = np.where(amounts_in > 0, amounts_in, 1)
+        impact = np.where(amounts_in > 0, 1 - amounts_out / safe_amounts_in / spot, 0)
+        return amounts_out, impact, filled
+
+    def liquidity_within(self, ranges: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Amounts of token0 between the price and price * (1 + r) and
+        of token1 between price * (1 - r) and the price, for each relative range r.
+        """
+        ranges = np.asarray(ranges, dtype=float)
+        token0_amounts = self.up.amount_out_to(self.sqrt_price * np.sqrt(1 + ranges))
+        token1_amounts = self.down.amount_out_to(self.sqrt_price * np.sqrt(np.clip(1 - ranges,
+                                                                                   0, None)))
+        return token0_amounts, token1_amounts
@@ -1,13 +1,21 @@
+import sqlite3
 from typing import List, Optional
 
 from credmark.cmf.model import Model
-from credmark.cmf.model.errors import ModelDataError, ModelRunError
+from credmark.cmf.model.errors import (ModelBaseError, ModelDataError,
+                                       ModelRunError)
 from credmark.cmf.types import (Address, Contract, Contracts, NativeToken,
                                 Portfolio, Position, Price, Token)
-from credmark.cmf.types.compose import MapInputsOutput
-from credmark.dto import DTO, EmptyInput, IterableListGenericDTO
+from credmark.cmf.types.compose import (MapBlockTimeSeriesInput,
+                                        MapBlockTimeSeriesOutput)
+from credmark.dto import DTO, DTOField, EmptyInput, IterableListGenericDTO
+from models.credmark.protocols.lending.aave.aave_v2_history import \
+    AaveReserveHistory
+from models.credmark.protocols.lending.aave.aave_v2_market import \
+    AaveV2MarketSnapshot
 from models.credmark.tokens.token import get_eip1967_proxy_err
 from models.tmp_abi_lookup import AAVE_STABLEDEBT_ABI
+from models.utils.series import sample_blocks
 from web3.exceptions import ABIFunctionNotFound
 
 
@@ -35,6 +43,12 @@ class AaveDebtInfos(IterableListGenericDTO[AaveDebtInfo]):
     _iterator: str = 'aaveDebtInfos'
 
 
+class AaveDebtInfoHistoricalInput(Token, MapBlockTimeSeriesInput):
+    modelSlug: str = DTOField('aave-v2.token-asset', hidden=True)
+    modelInput: dict = DTOField({}, hidden=True)
+    endTimestamp: int = DTOField(0, hidden=True)
+
+
 # PriceOracle
 # getAssetPrice() Returns the price of the supported _asset in ETH wei units.
 # getAssetsPrices() Returns the price of the supported _asset in ETH wei units.
@@ -156,7 +170,7 @@ class AaveV2GetOraclePrice(Model):
 
 
 @Model.describe(slug="aave-v2.overall-liabilities-portfolio",
-                version="1.1",
+                version="1.2",
                 display_name="Aave V2 Lending Pool overall liabilities",
                 description="Aave V2 liabilities for the main lending pool",
                 category='protocol',
@@ -168,20 +182,10 @@ class AaveV2GetLiability(Model):
         aave_lending_pool = self.context.run_model('aave-v2.get-lending-pool',
                                                    input=EmptyInput(),
                                                    return_type=Contract)
-        aave_lending_pool = get_eip1967_proxy_err(self.context,
-                                                  self.logger,
-                                                  aave_lending_pool.address,
-                                                  True)
+        reserves = AaveV2MarketSnapshot.load(self.context, self.logger, aave_lending_pool).reserves
 
-        aave_assets = aave_lending_pool.functions.getReservesList().call()
-
-        map_results = self.context.models.compose.map_inputs(
-            modelSlug='aave-v2.token-liability',
-            modelInputs=[Token(address=asset) for asset in aave_assets],
-            return_type=MapInputsOutput[Token, Position])
-
-        positions = [res.output for res in map_results.results if res.error is None]  # type: ignore
-        assert len(positions) == len(aave_assets)
+        positions = [Position(asset=Token(address=a_token), amount=a_token_supply)
+                     for a_token, a_token_supply in zip(reserves.aToken, reserves.aToken_supply)]
         return Portfolio(positions=positions)
 
 
@@ -217,7 +221,7 @@ class AaveV2GetTokenLiability(Model):
 
 
 @ Model.describe(slug="aave-v2.lending-pool-assets",
-                 version="1.2",
+                 version="1.3",
                  display_name="Aave V2 Lending Pool Assets",
                  description="Aave V2 assets for the main lending pool",
                  category='protocol',
@@ -228,35 +232,27 @@ class AaveV2GetAssets(Model):
         aave_lending_pool = self.context.run_model('aave-v2.get-lending-pool',
                                                    input=EmptyInput(),
                                                    return_type=Contract)
-        aave_lending_pool = get_eip1967_proxy_err(self.context,
-                                                  self.logger,
-                                                  aave_lending_pool.address,
-                                                  True)
-
-        aave_assets_address = aave_lending_pool.functions.getReservesList().call()
-
-        aave_debts_infos = []
-
-        model_slug = 'aave-v2.token-asset'
-        model_inputs = [Token(address=addr) for addr in aave_assets_address]
-        all_pool_infos_results = self.context.run_model(
-            slug='compose.map-inputs',
-            input={'modelSlug': model_slug,
-                   'modelInputs': model_inputs},
-            return_type=MapInputsOutput[dict, AaveDebtInfo]
-        )
-
-        aave_debts_infos = []
-        for pool_n, pool_result in enumerate(all_pool_infos_results):
-            if pool_result.output is not None:
-                aave_debts_infos.append(pool_result.output)
-            elif pool_result.error is not None:
-                self.logger.error(pool_result.error)
-                raise ModelRunError(
-                    f'Error with {model_slug}(input={model_inputs[pool_n]}). ' +
-                    pool_result.error.message)
-            else:
-                raise ModelRunError('compose.map-inputs: output/error cannot be both None')
+        reserves = AaveV2MarketSnapshot.load(self.context, self.logger, aave_lending_pool).reserves
+
+        aave_debts_infos = [
+            AaveDebtInfo(
+                token=Token(address=r['asset']),
+                tokenName=r['name'],
+                aToken=Token(address=r['aToken']),
+                stableDebtToken=Token(address=r['stableDebtToken']),
+                variableDebtToken=Token(address=r['variableDebtToken']),
+                interestRateStrategyContract=Contract(address=r['interestRateStrategy']),
+                supplyRate=r['supplyRate'],
+                variableBorrowRate=r['variableBorrowRate'],
+                stableBorrowRate=r['stableBorrowRate'],
+                totalSupply_qty=r['totalSupply_qty'],
+                totalStableDebt_qty=r['totalStableDebt_qty'],
+                totalStableDebtPrinciple_qty=r['totalStableDebtPrinciple_qty'],
+                totalVariableDebt_qty=r['totalVariableDebt_qty'],
+                totalDebt_qty=r['totalDebt_qty'],
+                totalInterest_qty=r['totalInterest_qty'],
+                totalLiquidity_qty=r['totalLiquidity_qty'])
+            for r in reserves.to_dict('records')]
 
         return AaveDebtInfos(aaveDebtInfos=aave_debts_infos)
 
@@ -361,3 +357,95 @@ class AaveV2GetTokenAsset(Model):
         else:
             raise ModelRunError(f'Unable to obtain {totalStableDebt=} and {totalVariableDebt=} '
                                 f'for {aToken.address=}')
+
+
+@Model.describe(slug="aave-v2.token-asset-historical",
+                version="1.0",
+                display_name="Aave V2 token liquidity - historical",
+                description="Aave V2 token liquidity at the sampled blocks, "
+                "from the reserve updates and the supply changes in the ledger",
+                category='protocol',
+                subcategory='aave-v2',
+                input=AaveDebtInfoHistoricalInput,
+                output=MapBlockTimeSeriesOutput[AaveDebtInfo])
+class AaveV2GetTokenAssetHistorical(Model):
+    """
+    aave-v2.token-asset at each sample, with the rates and indices of the last
+    ReserveDataUpdated event and the supplies from the Mint / Burn events of the reserve's
+    tokens at or before the sample block. Amounts do not include the interest accrued since
+    the last event, so the stable debt principle is its total.
+    Falls back to running aave-v2.token-asset at each sample.
+    """
+
+    def run(self, input: AaveDebtInfoHistoricalInput) -> MapBlockTimeSeriesOutput[AaveDebtInfo]:
+        try:
+            samples = sample_blocks(self.context, input.interval, input.count, input.exclusive)
+            if samples is not None:
+                return self.token_asset_from_history(input, samples)
+        except (ModelBaseError, sqlite3.Error, OSError) as err:
+            self.logger.info(f'Reserve history is not available for {input.address}: {err}')
+
+        return self.context.run_model(
+            slug='compose.map-block-time-series',
+            input={"modelSlug": 'aave-v2.token-asset',
+                   "modelInput": Token(address=input.address),
+                   "endTimestamp": self.context.block_number.timestamp,
+                   "interval": input.interval,
+                   "count": input.count,
+                   "exclusive": input.exclusive},
+            return_type=MapBlockTimeSeriesOutput[AaveDebtInfo])
+
+    def token_asset_from_history(self, input: Token, samples) \
+            -> MapBlockTimeSeriesOutput[AaveDebtInfo]:
+        sample_timestamps, block_numbers, block_timestamps = samples
+        aave_lending_pool = self.context.run_model('aave-v2.get-lending-pool',
+                                                   input=EmptyInput(),
+                                                   return_type=Contract)
+        reserves = AaveV2MarketSnapshot.load(self.context, self.logger, aave_lending_pool).reserves
+        reserve = reserves.loc[reserves.asset == input.address]
+        if reserve.empty:
+            raise ModelDataError(f'{input.address} is not a reserve of Aave V2')
+        reserve = reserve.iloc[0]
+
+        history = AaveReserveHistory.open(self.context, aave_lending_pool)
+        df = history.reserve_as_of(reserve.asset, reserve.aToken, reserve.stableDebtToken,
+                                   reserve.variableDebtToken, block_numbers)
+        if df.liquidityIndex.isna().any():
+            raise ModelDataError(f'No reserve state of {input.address} in the ledger at block '
+                                 f'{block_numbers[df.liquidityIndex.isna().to_numpy()][0]}')
+
+        scale = 10 ** int(reserve.decimals)
+        total_supply = df.aToken_supply.to_numpy() / scale
+        total_stable_debt = df.stableDebt_supply.to_numpy() / scale
+        total_variable_debt = df.variableDebt_supply.to_numpy() / scale
+        total_debt = total_stable_debt + total_variable_debt
+        total_liquidity = total_supply - total_debt
+
+        interest_rate_strategy = Contract(address=reserve.interestRateStrategy)
+        results = []
+        for n, (sample_timestamp, block_number, block_timestamp) in \
+                enumerate(zip(sample_timestamps, block_numbers, block_timestamps)):
+            output = AaveDebtInfo(
+                token=Token(address=reserve.asset),
+                tokenName=reserve['name'],
+                aToken=Token(address=reserve.aToken),
+                stableDebtToken=Token(address=reserve.stableDebtToken),
+                variableDebtToken=Token(address=reserve.variableDebtToken),
+                interestRateStrategyContract=interest_rate_strategy,
+                supplyRate=df.liquidityRate[n],
+                variableBorrowRate=df.variableBorrowRate[n],
+                stableBorrowRate=df.stableBorrowRate[n],
+                totalSupply_qty=total_supply[n],
+                totalStableDebt_qty=total_stable_debt[n],
+                totalStableDebtPrinciple_qty=total_stable_debt[n],
+                totalVariableDebt_qty=total_variable_debt[n],
+                totalDebt_qty=total_debt[n],
+                totalInterest_qty=0.0,
+                totalLiquidity_qty=total_liquidity[n])
+            results.append({'blockNumber': int(block_number),
+                            'blockTimestamp': int(block_timestamp),
+                            'sampleTimestamp': int(sample_timestamp),
+                            'output': output,
+                            'error': None})
+
+        return MapBlockTimeSeriesOutput[AaveDebtInfo](results=results)
@@ -0,0 +1,384 @@
+from threading import RLock
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from credmark.cmf.model import ModelContext
+from credmark.cmf.model.errors import ModelDataError
+from credmark.cmf.types import Address, Contract
+from models.tmp_abi_lookup import AAVE_STABLEDEBT_ABI
+from models.utils.ledger import ledger_event_records, ledger_head
+from models.utils.store import SQLiteStore
+
+RAY = 1e27
+
+RESERVE_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reserve_updates (
+    chain_id INTEGER NOT NULL,
+    reserve TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    liquidity_rate TEXT NOT NULL,
+    stable_borrow_rate TEXT NOT NULL,
+    variable_borrow_rate TEXT NOT NULL,
+    liquidity_index TEXT NOT NULL,
+    variable_borrow_index TEXT NOT NULL,
+    PRIMARY KEY (chain_id, reserve, block_number, log_index)
+);
+CREATE TABLE IF NOT EXISTS supply_changes (
+    chain_id INTEGER NOT NULL,
+    token TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    ray_index TEXT NOT NULL,
+    PRIMARY KEY (chain_id, token, block_number, log_index)
+);
+CREATE TABLE IF NOT EXISTS account_changes (
+    chain_id INTEGER NOT NULL,
+    lending_pool TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    account TEXT NOT NULL,
+    reserve TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    scaled_amount REAL NOT NULL,
+    PRIMARY KEY (chain_id, lending_pool, block_number, log_index, n)
+);
+CREATE TABLE IF NOT EXISTS synced (
+    chain_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    synced_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, source)
+);
+"""
+
+# Kinds of supply changes: scaled mint and burn of aTokens and variable debt tokens,
+# and the new total supply of stable debt tokens.
+MINT = 'mint'
+BURN = 'burn'
+TOTAL = 'total'
+
+A_TOKEN = 'aToken'
+VARIABLE_DEBT_TOKEN = 'variableDebtToken'
+STABLE_DEBT_TOKEN = 'stableDebtToken'
+
+# (event, kind, input of the amount) of each kind of token
+SUPPLY_EVENTS = {
+    A_TOKEN: [('Mint', MINT, 'value'), ('Burn', BURN, 'value')],
+    VARIABLE_DEBT_TOKEN: [('Mint', MINT, 'value'), ('Burn', BURN, 'amount')],
+    STABLE_DEBT_TOKEN: [('Mint', TOTAL, 'newtotalsupply'), ('Burn', TOTAL, 'newtotalsupply')],
+}
+
+# Kinds of account changes, scaled by the liquidity index and the variable borrow index
+COLLATERAL = 'collateral'
+DEBT = 'debt'
+
+# Inputs of the lending pool's events of account changes
+ACCOUNT_EVENTS = {
+    'Deposit': ['reserve', 'onbehalfof', 'amount'],
+    'Withdraw': ['reserve', 'user', 'amount'],
+    'Borrow': ['reserve', 'onbehalfof', 'amount'],
+    'Repay': ['reserve', 'user', 'amount'],
+    'LiquidationCall': ['collateralasset', 'debtasset', 'user', 'debttocover',
+                        'liquidatedcollateralamount', 'liquidator', 'receiveatoken'],
+}
+
+RESERVE_STATE_COLUMNS = ['liquidityRate', 'stableBorrowRate', 'variableBorrowRate',
+                         'liquidityIndex', 'variableBorrowIndex']
+
+
+class AaveReserveHistory:
+    """
+    States of the reserves of an Aave V2 lending pool after each of their updates,
+    synced from the ledger into an on-disk store and extended as later blocks are requested.
+
+    - Rates and indices of a reserve come from the lending pool's ReserveDataUpdated events.
+    - The scaled supplies of aTokens and variable debt tokens are the sums of their
+      Mint and Burn amounts divided by the index of each event.
+    - The supply of a stable debt token is the newTotalSupply of its last Mint or Burn.
+
+    The state as of a block is the state after the last event at or before the block.
+    Amounts are the scaled supplies times the indices of the last update of the reserve,
+    without the interest accrued since the update.
+
+    Positions of the accounts come the same way from the lending pool's Deposit, Withdraw,
+    Borrow, Repay and LiquidationCall events, each scaled by the index of its block.
+    Transfers of aTokens between accounts are not included, and stable debt is scaled by
+    the variable borrow index as Repay does not tell the rate mode.
+
+    Events are synced up to the ledger's head, which can be behind the requested block.
+    """
+
+    _histories: Dict[Tuple[int, Address], 'AaveReserveHistory'] = {}
+    _histories_lock = RLock()
+
+    def __init__(self, chain_id: int, lending_pool: Contract):
+        self.chain_id = chain_id
+        self.lending_pool = lending_pool
+        self.store = SQLiteStore.open('aave_reserve_history')
+        self.store.execute_script(RESERVE_HISTORY_SCHEMA)
+        self._lock = RLock()
+        self._updates: Tuple[int, Dict[Address, Tuple[np.ndarray, np.ndarray]]] = (-1, {})
+        self._supplies: Dict[Address, Tuple[int, np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def open(cls, context, lending_pool: Contract) -> 'AaveReserveHistory':
+        key = (context.chain_id, lending_pool.address)
+        with cls._histories_lock:
+            history = cls._histories.get(key)
+            if history is None:
+                history = cls(context.chain_id, lending_pool)
+                cls._histories[key] = history
+            return history
+
+    def synced_block(self, source: Address) -> int:
+        row = self.store.query_one(
+            'SELECT synced_block FROM synced WHERE chain_id = ? AND source = ?',
+            (self.chain_id, str(source)))
+        return -1 if row is None else row[0]
+
+    def set_synced_block(self, source: Address, synced_block: int) -> None:
+        self.store.execute('INSERT OR REPLACE INTO synced VALUES (?, ?, ?)',
+                           (self.chain_id, str(source), synced_block))
+
+    def sync_updates(self, to_block: int) -> None:
+        from_block = self.synced_block(self.lending_pool.address)
+        if from_block < to_block:
+            to_block = ledger_head(ModelContext.current_context(), to_block)
+        if from_block >= to_block:
+            return
+
+        for records in ledger_event_records(
+                self.lending_pool, 'ReserveDataUpdated',
+                ['reserve', 'liquidityrate', 'stableborrowrate', 'variableborrowrate',
+                 'liquidityindex', 'variableborrowindex'],
+                from_block, to_block):
+            self.store.execute_many([
+                ('INSERT OR REPLACE INTO reserve_updates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                 [(self.chain_id, str(Address(r['reserve'])), r['block_number'], r['log_index'],
+                   str(r['liquidityrate']), str(r['stableborrowrate']),
+                   str(r['variableborrowrate']), str(r['liquidityindex']),
+                   str(r['variableborrowindex']))
+                  for r in records])])
+        self.set_synced_block(self.lending_pool.address, to_block)
+
+    def sync_supply(self, token: Address, token_kind: str, to_block: int) -> None:
+        from_block = self.synced_block(token)
+        if from_block < to_block:
+            to_block = ledger_head(ModelContext.current_context(), to_block)
+        if from_block >= to_block:
+            return
+
+        contract = (Contract(address=token, abi=AAVE_STABLEDEBT_ABI)
+                    if token_kind == STABLE_DEBT_TOKEN else Contract(address=token))
+        for event_name, kind, amount_input in SUPPLY_EVENTS[token_kind]:
+            inputs = [amount_input] if kind == TOTAL else [amount_input, 'index']
+            for records in ledger_event_records(contract, event_name, inputs,
+                                                from_block, to_block):
+                self.store.execute_many([
+                    ('INSERT OR REPLACE INTO supply_changes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     [(self.chain_id, str(token), r['block_number'], r['log_index'], kind,
+                       str(r[amount_input]), '0' if kind == TOTAL else str(r['index']))
+                      for r in records])])
+        self.set_synced_block(token, to_block)
+
+    def updates(self, reserve: Address, to_block: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Block numbers and states (rates and indices, in units of 1) of the reserve's updates.
+        """
+        with self._lock:
+            loaded_block, updates = self._updates
+            if loaded_block < to_block:
+                self.sync_updates(to_block)
+                synced_block = self.synced_block(self.lending_pool.address)
+                if loaded_block < synced_block:
+                    rows = self.store.query(
+                        'SELECT reserve, block_number, liquidity_rate, stable_borrow_rate, '
+                        'variable_borrow_rate, liquidity_index, variable_borrow_index '
+                        'FROM reserve_updates WHERE chain_id = ? '
+                        'ORDER BY reserve, block_number, log_index',
+                        (self.chain_id,))
+                    df = pd.DataFrame(rows, columns=['reserve', 'block_number'] +
+                                      RESERVE_STATE_COLUMNS)
+                    updates = {Address(reserve): (
+                        df_reserve.block_number.to_numpy(dtype=np.int64),
+                        df_reserve[RESERVE_STATE_COLUMNS].astype(float).to_numpy() / RAY)
+                        for reserve, df_reserve in df.groupby('reserve')}
+                    self._updates = (synced_block, updates)
+        return updates.get(Address(reserve),
+                           (np.zeros(0, dtype=np.int64), np.zeros((0, len(RESERVE_STATE_COLUMNS)))))
+
+    def supply(self, token: Address, token_kind: str, to_block: int) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Block numbers of the token's supply changes and its supply after each, raw for
+        stable debt tokens and scaled by the index for the other tokens.
+        """
+        token = Address(token)
+        with self._lock:
+            loaded = self._supplies.get(token)
+            if loaded is None or loaded[0] < to_block:
+                self.sync_supply(token, token_kind, to_block)
+                synced_block = self.synced_block(token)
+                if loaded is None or loaded[0] < synced_block:
+                    rows = self.store.query(
+                        'SELECT block_number, kind, amount, ray_index FROM supply_changes '
+                        'WHERE chain_id = ? AND token = ? ORDER BY block_number, log_index',
+                        (self.chain_id, str(token)))
+                    blocks = np.array([r[0] for r in rows], dtype=np.int64)
+                    amounts = np.array([float(r[2]) for r in rows])
+                    if token_kind == STABLE_DEBT_TOKEN:
+                        supplies = amounts
+                    else:
+                        signs = np.array([1.0 if r[1] == MINT else -1.0 for r in rows])
+                        ray_indices = np.array([float(r[3]) for r in rows])
+                        supplies = np.cumsum(signs * amounts * RAY / ray_indices)
+                    loaded = (synced_block, blocks, supplies)
+                    self._supplies[token] = loaded
+            return loaded[1], loaded[2]
+
+    @staticmethod
+    def account_changes(event_name: str, records: List[dict]) -> pd.DataFrame:
+        """
+        Changes of collateral and debt of the accounts in a page of the event, in raw amounts.
+        """
+        changes = []
+        for r in records:
+            if event_name == 'Deposit':
+                changes.append((r, 0, r['onbehalfof'], r['reserve'], COLLATERAL, 1, r['amount']))
+            elif event_name == 'Withdraw':
+                changes.append((r, 0, r['user'], r['reserve'], COLLATERAL, -1, r['amount']))
+            elif event_name == 'Borrow':
+                changes.append((r, 0, r['onbehalfof'], r['reserve'], DEBT, 1, r['amount']))
+            elif event_name == 'Repay':
+                changes.append((r, 0, r['user'], r['reserve'], DEBT, -1, r['amount']))
+            else:
+                changes.append((r, 0, r['user'], r['debtasset'], DEBT, -1, r['debttocover']))
+                changes.append((r, 1, r['user'], r['collateralasset'], COLLATERAL, -1,
+                                r['liquidatedcollateralamount']))
+                if str(r['receiveatoken']).lower() in ('true', '1'):
+                    changes.append((r, 2, r['liquidator'], r['collateralasset'], COLLATERAL, 1,
+                                    r['liquidatedcollateralamount']))
+
+        return pd.DataFrame(
+            [(r['block_number'], r['log_index'], n, str(Address(account)), str(Address(reserve)),
+              kind, sign * float(amount))
+             for r, n, account, reserve, kind, sign, amount in changes],
+            columns=['block_number', 'log_index', 'n', 'account', 'reserve', 'kind', 'amount'])
+
+    def sync_accounts(self, to_block: int) -> int:
+        """
+        Sync the account changes up to the block, capped at the ledger's head,
+        and return the synced block.
+        """
+        source = f'{self.lending_pool.address}/accounts'
+        from_block = self.synced_block(source)
+        if from_block < to_block:
+            to_block = ledger_head(ModelContext.current_context(), to_block)
+        if from_block >= to_block:
+            return from_block
+
+        for event_name, inputs in ACCOUNT_EVENTS.items():
+            for records in ledger_event_records(self.lending_pool, event_name, inputs,
+                                                from_block, to_block):
+                df = self.account_changes(event_name, records)
+                df['scaled_amount'] = 0.0
+                for (reserve, kind), df_reserve in df.groupby(['reserve', 'kind']):
+                    update_blocks, states = self.updates(Address(reserve), to_block)
+                    index_col = RESERVE_STATE_COLUMNS.index(
+                        'liquidityIndex' if kind == COLLATERAL else 'variableBorrowIndex')
+                    indices = self.as_of(update_blocks, states[:, index_col],
+                                         df_reserve.block_number.to_numpy(), 1)
+                    df.loc[df_reserve.index, 'scaled_amount'] = (df_reserve.amount.to_numpy() /
+                                                                 indices)
+
+                self.store.execute_many([
+                    ('INSERT OR REPLACE INTO account_changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     [(self.chain_id, str(self.lending_pool.address), int(r.block_number),
+                       int(r.log_index), int(r.n), r.account, r.reserve, r.kind,
+                       float(r.scaled_amount))
+                      for r in df.itertuples()])])
+        self.set_synced_block(source, to_block)
+        return to_block
+
+    def account_positions(self, block_number: int) -> pd.DataFrame:
+        """
+        Raw amounts of collateral and debt of each account in each reserve as of the block,
+        one row per account and reserve. Negative amounts, from the transfers and interest
+        that are not in the events, are taken as 0.
+        """
+        with self._lock:
+            synced_block = self.sync_accounts(block_number)
+            if synced_block < block_number:
+                raise ModelDataError(f'Ledger is at block {synced_block}, before the accounts '
+                                     f'of {self.lending_pool.address} at block {block_number}')
+            rows = self.store.query(
+                'SELECT account, reserve, kind, SUM(scaled_amount) FROM account_changes '
+                'WHERE chain_id = ? AND lending_pool = ? AND block_number <= ? '
+                'GROUP BY account, reserve, kind',
+                (self.chain_id, str(self.lending_pool.address), block_number))
+        if len(rows) == 0:
+            return pd.DataFrame(columns=['account', 'reserve', COLLATERAL, DEBT])
+
+        df = (pd.DataFrame(rows, columns=['account', 'reserve', 'kind', 'scaled_amount'])
+              .pivot_table(index=['account', 'reserve'], columns='kind',
+                           values='scaled_amount', aggfunc='sum', fill_value=0.0)
+              .reindex(columns=[COLLATERAL, DEBT], fill_value=0.0)
+              .rename_axis(columns=None)
+              .reset_index())
+
+        for reserve, df_reserve in df.groupby('reserve'):
+            update_blocks, states = self.updates(Address(reserve), block_number)
+            index = self.as_of(update_blocks, states, np.array([block_number]), 1)[0]
+            liquidity_index = index[RESERVE_STATE_COLUMNS.index('liquidityIndex')]
+            borrow_index = index[RESERVE_STATE_COLUMNS.index('variableBorrowIndex')]
+            df.loc[df_reserve.index, COLLATERAL] = df_reserve[COLLATERAL] * liquidity_index
+            df.loc[df_reserve.index, DEBT] = df_reserve[DEBT] * borrow_index
+
+        df[[COLLATERAL, DEBT]] = df[[COLLATERAL, DEBT]].clip(lower=0)
+        return df[(df[COLLATERAL] > 0) | (df[DEBT] > 0)].reset_index(drop=True)
+
+    @staticmethod
+    def as_of(blocks: np.ndarray, values: np.ndarray, block_numbers: np.ndarray,
+              before_first: float) -> np.ndarray:
+        n = np.searchsorted(blocks, block_numbers, side='right') - 1
+        found = n >= 0
+        result = np.full((len(block_numbers),) + values.shape[1:], before_first, dtype=float)
+        result[found] = values[n[found]]
+        return result
+
+    def reserve_as_of(self, reserve: Address, a_token: Address, stable_debt_token: Address,
+                      variable_debt_token: Address, block_numbers) -> pd.DataFrame:
+        """
+        Rates, indices and raw supplies of the reserve as of each of the blocks.
+        Rates and indices are NaN before the first update of the reserve,
+        and all of the values are NaN after the ledger's head.
+        """
+        block_numbers = np.asarray(block_numbers, dtype=np.int64)
+        to_block = int(block_numbers.max())
+
+        update_blocks, states = self.updates(reserve, to_block)
+        df = pd.DataFrame(self.as_of(update_blocks, states, block_numbers, np.nan),
+                          columns=RESERVE_STATE_COLUMNS)
+        df.insert(0, 'blockNumber', block_numbers)
+
+        a_blocks, a_scaled = self.supply(a_token, A_TOKEN, to_block)
+        variable_blocks, variable_scaled = self.supply(variable_debt_token, VARIABLE_DEBT_TOKEN,
+                                                       to_block)
+        stable_blocks, stable_supply = self.supply(stable_debt_token, STABLE_DEBT_TOKEN, to_block)
+
+        df['aToken_supply'] = (self.as_of(a_blocks, a_scaled, block_numbers, 0) *
+                               df.liquidityIndex.fillna(1).to_numpy())
+        df['variableDebt_supply'] = (self.as_of(variable_blocks, variable_scaled,
+                                                block_numbers, 0) *
+                                     df.variableBorrowIndex.fillna(1).to_numpy())
+        df['stableDebt_supply'] = self.as_of(stable_blocks, stable_supply, block_numbers, 0)
+
+        synced_block = min(self.synced_block(source) for source in
+                           [self.lending_pool.address, a_token, variable_debt_token,
+                            stable_debt_token])
+        df.loc[block_numbers > synced_block, df.columns[1:]] = np.nan
+        return df
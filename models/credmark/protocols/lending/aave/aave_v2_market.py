@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from credmark.cmf.model.errors import ModelRunError
+from credmark.cmf.types import Address, Contract, Token
+from models.credmark.tokens.token import fix_erc20_token, get_eip1967_proxy_err
+from models.tmp_abi_lookup import AAVE_STABLEDEBT_ABI, ERC_20_TOKEN_CONTRACT_ABI
+from models.utils.cache import LRUCache
+from models.utils.multicall import multicall
+
+RAY = 1e27
+
+
+class AaveV2MarketSnapshot:
+    """
+    All reserves of an Aave V2 lending pool at a block as a table with one row per reserve.
+
+    The table is read in three batches of calls for all reserves: the reserves list,
+    the reserve data with the assets' decimals and names, and the supplies of the aToken,
+    stable debt and variable debt tokens. The debt tokens share the decimals of their asset.
+    Quantities (_qty) are scaled; aToken_supply is the raw total supply of the aToken.
+
+    Snapshots are cached per block, so the lending pool proxy is resolved once per block.
+    """
+
+    _snapshots = LRUCache(maxsize=100)
+
+    def __init__(self, reserves: pd.DataFrame):
+        self.reserves = reserves
+
+    @classmethod
+    def load(cls, context, logger, lending_pool: Contract) -> 'AaveV2MarketSnapshot':
+        key = (context.chain_id, int(context.block_number), lending_pool.address)
+        snapshot = cls._snapshots.get(key)
+        if snapshot is None:
+            snapshot = cls(cls.read_reserves(context, logger, lending_pool))
+            cls._snapshots.put(key, snapshot)
+        return snapshot
+
+    @staticmethod
+    def read_reserves(context, logger, lending_pool: Contract) -> pd.DataFrame:
+        lending_pool = get_eip1967_proxy_err(context, logger, lending_pool.address, True)
+        assets = [Address(a) for a in lending_pool.functions.getReservesList().call()]
+        n_assets = len(assets)
+
+        erc20s = [Contract(address=asset, abi=ERC_20_TOKEN_CONTRACT_ABI) for asset in assets]
+        results = multicall(context,
+                            [lending_pool.functions.getReserveData(asset) for asset in assets] +
+                            [erc20.functions.decimals() for erc20 in erc20s] +
+                            [erc20.functions.name() for erc20 in erc20s])
+        reserves_data = results[:n_assets]
+        decimals = results[n_assets:2 * n_assets]
+        names = results[2 * n_assets:]
+
+        for asset, reserve_data, decimal in zip(assets, reserves_data, decimals):
+            if reserve_data is None or decimal is None:
+                raise ModelRunError(f'Unable to read the reserve data of {asset}')
+
+        def _reserve_token(address):
+            return Contract(address=address, abi=AAVE_STABLEDEBT_ABI)
+
+        supplies = multicall(context,
+                             [f for reserve_data in reserves_data
+                              for f in [_reserve_token(reserve_data[7]).functions.totalSupply(),
+                                        _reserve_token(reserve_data[8]).functions.getSupplyData(),
+                                        _reserve_token(reserve_data[8]).functions.totalSupply(),
+                                        _reserve_token(reserve_data[9]).functions.totalSupply()]])
+        supplies = [supplies[4 * n: 4 * n + 4] for n in range(n_assets)]
+
+        for asset, supply in zip(assets, supplies):
+            if any(v is None for v in supply):
+                raise ModelRunError(f'Unable to obtain the supplies of the tokens of {asset}')
+
+        # Names that are not strings, e.g. bytes32, are read with the token's own ABI
+        names = [name if name is not None else fix_erc20_token(Token(address=asset)).name
+                 for asset, name in zip(assets, names)]
+
+        # getReserveData
+        # 0. configuration, a struct of the bitmap of the reserve's parameters,
+        # 1. liquidityIndex, 2. variableBorrowIndex, 3. currentLiquidityRate,
+        # 4. currentVariableBorrowRate, 5. currentStableBorrowRate, 6. lastUpdateTimestamp,
+        # 7. aTokenAddress, 8. stableDebtTokenAddress, 9. variableDebtTokenAddress,
+        # 10. interestRateStrategyAddress
+        scale = np.power(10.0, np.array(decimals, dtype=float))
+        df = pd.DataFrame({
+            'asset': assets,
+            'name': names,
+            'decimals': decimals,
+            'aToken': [Address(r[7]) for r in reserves_data],
+            'stableDebtToken': [Address(r[8]) for r in reserves_data],
+            'variableDebtToken': [Address(r[9]) for r in reserves_data],
+            'interestRateStrategy': [Address(r[10]) for r in reserves_data],
+            'liquidityIndex': [r[1] / RAY for r in reserves_data],
+            'variableBorrowIndex': [r[2] / RAY for r in reserves_data],
+            'supplyRate': [r[3] / RAY for r in reserves_data],
+            'variableBorrowRate': [r[4] / RAY for r in reserves_data],
+            'stableBorrowRate': [r[5] / RAY for r in reserves_data],
+            'lastUpdateTimestamp': [r[6] for r in reserves_data],
+            'liquidationThreshold': [(r[0][0] >> 16 & 0xFFFF) / 1e4 for r in reserves_data],
+            'aToken_supply': [float(s[0]) for s in supplies],
+        })
+        df['totalSupply_qty'] = df.aToken_supply.to_numpy() / scale
+        df['totalStableDebtPrinciple_qty'] = np.array([float(s[1][0]) for s in supplies]) / scale
+        df['totalStableDebt_qty'] = np.array([float(s[2]) for s in supplies]) / scale
+        df['totalVariableDebt_qty'] = np.array([float(s[3]) for s in supplies]) / scale
+        df['totalInterest_qty'] = df.totalStableDebt_qty - df.totalStableDebtPrinciple_qty
+        df['totalDebt_qty'] = df.totalStableDebt_qty + df.totalVariableDebt_qty
+        df['totalLiquidity_qty'] = df.totalSupply_qty - df.totalDebt_qty
+        return df
@@ -1,11 +1,15 @@
 from typing import List
 
 import numpy as np
+import pandas as pd
 from credmark.cmf.model import Model
 from credmark.cmf.model.errors import ModelRunError
 from credmark.cmf.types import Address, Contract, Price, Token
-from credmark.cmf.types.compose import MapInputsOutput
 from credmark.dto import DTO, EmptyInput, IterableListGenericDTO
+from models.credmark.protocols.lending.compound.compound_v2_market import \
+    CompoundV2MarketSnapshot
+from models.dtos.price import Prices
+from models.utils.result_cache import cache_result
 
 np.seterr(all='raise')
 
@@ -96,6 +100,64 @@ def get_comptroller(model):
     return comptroller
 
 
+def get_markets(model, c_tokens: List[Address]) -> pd.DataFrame:
+    """
+    Markets of the cTokens from CompoundV2MarketSnapshot, one row per cToken.
+    """
+    chain_id = model.context.chain_id
+    assets = CompoundV2GetPoolInfo.COMPOUND_ASSETS[chain_id]
+    known_c_tokens = CompoundV2GetPoolInfo.COMPOUND_CTOKEN[chain_id]
+
+    # cETH has no underlying(). cSAI has been renamed to cDAI in the contract,
+    # we will still call up SAI.
+    underlying_overrides = {Address(known_c_tokens[c_token]): Address(assets[asset])
+                            for c_token, asset in [('cETH', 'WETH'), ('cSAI', 'SAI')]
+                            if c_token in known_c_tokens and asset in assets}
+
+    return CompoundV2MarketSnapshot.load(
+        model.context,
+        get_comptroller(model),
+        c_tokens,
+        Address(CompoundV2GetPoolInfo.COMPOUND_TIMELOCK[chain_id]),
+        underlying_overrides).markets
+
+
+def pool_info_from_market(model, market: dict, token_price: Price) -> 'CompoundV2PoolInfo':
+    if token_price.price is None or token_price.src is None:
+        raise ModelRunError(f'Can not get price for token {market["token"]}')
+
+    block_dt = model.context.block_number.timestamp_datetime.replace(tzinfo=None).isoformat()
+    return CompoundV2PoolInfo(
+        tokenSymbol=market['cTokenSymbol'],
+        cTokenSymbol=market['cTokenSymbol'],
+        tokenDecimal=market['tokenDecimal'],
+        cTokenDecimal=market['cTokenDecimal'],
+        token=Token(address=market['token']),
+        tokenPrice=token_price.price,
+        tokenPriceSrc=token_price.src,
+        cToken=Token(address=market['cToken']),
+        cash=market['cash'],
+        totalReserves=market['totalReserves'],
+        totalBorrows=market['totalBorrows'],
+        totalSupply=market['totalSupply'],
+        totalLiability=market['totalLiability'],
+        exchangeRate=market['exchangeRate'],
+        invExchangeRate=market['invExchangeRate'],
+        borrowRate=market['borrowRate'],
+        supplyRate=market['supplyRate'],
+        supplyAPY=market['supplyAPY'],
+        borrowAPY=market['borrowAPY'],
+        utilizationRate=market['utilizationRate'],
+        reserveFactor=market['reserveFactor'],
+        isListed=market['isListed'],
+        collateralFactor=market['collateralFactor'],
+        isComped=market['isComped'],
+        block_number=int(model.context.block_number),
+        block_datetime=block_dt,
+        ir_model=Contract(address=market['interestRateModel']),
+    )
+
+
 @ Model.describe(slug="compound-v2.get-comptroller",
                  version="1.2",
                  display_name="Compound V2 - comptroller",
@@ -136,7 +198,7 @@ class CompoundV2GetAllPools(Model):
 
 
 @Model.describe(slug="compound-v2.all-pools-info",
-                version="1.3",
+                version="1.4",
                 display_name="Compound V2 - get all pool info",
                 description="Get all pools and query for their info (deposit, borrow, rates)",
                 category='protocol',
@@ -144,41 +206,28 @@ class CompoundV2GetAllPools(Model):
                 input=EmptyInput,
                 output=CompoundV2PoolInfos)
 class CompoundV2AllPoolsInfo(Model):
+    """
+    Info of all markets from one batched read of the markets and one price.quote-multiple.
+    """
+
     def run(self, input: EmptyInput) -> CompoundV2PoolInfos:
-        pool_infos = []
         pools = self.context.run_model(slug='compound-v2.get-pools')
+        markets = get_markets(self, [Address(c_token) for c_token in pools['cTokens']])
 
-        model_slug = 'compound-v2.get-pool-info'
-        model_inputs = [Token(address=cTokenAddress) for cTokenAddress in pools['cTokens']]
+        tokens = list(dict.fromkeys(markets.token))
+        prices = self.context.run_model(slug='price.quote-multiple',
+                                        input={'inputs': [{'base': Token(address=token)}
+                                                          for token in tokens]},
+                                        return_type=Prices)
+        price_by_token = dict(zip(tokens, prices))
 
-        def _use_compose():
-            all_pool_infos_results = self.context.run_model(
-                slug='compose.map-inputs',
-                input={'modelSlug': model_slug,
-                       'modelInputs': model_inputs},
-                return_type=MapInputsOutput[dict, dict]
-            )
-
-            pool_infos = []
-            for pool_n, pool_result in enumerate(all_pool_infos_results):
-                if pool_result.output is not None:
-                    pool_infos.append(pool_result.output)
-                elif pool_result.error is not None:
-                    self.logger.error(pool_result.error)
-                    raise ModelRunError(f'Error with {model_slug}({model_inputs[pool_n]}). ' +
-                                        pool_result.error.message)
-                else:
-                    raise ModelRunError('compose.map-inputs: output/error cannot be both None')
-            return pool_infos
-
-        pool_infos = _use_compose()
-
-        ret = CompoundV2PoolInfos(infos=pool_infos)
-        return ret
+        pool_infos = [pool_info_from_market(self, market, price_by_token[market['token']])
+                      for market in markets.to_dict('records')]
+        return CompoundV2PoolInfos(infos=pool_infos)
 
 
 @ Model.describe(slug="compound-v2.all-pools-values",
-                 version="1.2",
+                 version="1.3",
                  display_name="Compound V2 - get all pools value",
                  description="Compound V2 - convert pool's info to value",
                  category='protocol',
@@ -186,27 +235,35 @@ class CompoundV2AllPoolsInfo(Model):
                  input=CompoundV2PoolInfos,
                  output=CompoundV2PoolValues)
 class CompoundV2AllPoolsValue(Model):
+    """
+    compound-v2.pool-value of all pools, computed over the table of the pool infos.
+    """
+
     def run(self, input: CompoundV2PoolInfos) -> CompoundV2PoolValues:
         self.logger.info(f'Data as of {self.context.block_number=}')
-        pool_infos = input
-
-        def _use_for():
-            pool_values = []
-            for pool_info in pool_infos:
-                pool_value = self.context.run_model(
-                    slug='compound-v2.pool-value',
-                    input=pool_info,
-                    return_type=CompoundV2PoolValue)
-                pool_values.append(pool_value)
-            return pool_values
-
-        pool_values = _use_for()
-        ret = CompoundV2PoolValues(values=pool_values)
-        return ret
+        if len(input.infos) == 0:
+            return CompoundV2PoolValues(values=[])
+
+        df = pd.DataFrame([{'cTokenSymbol': info.cTokenSymbol,
+                            'cTokenAddress': info.token.address,
+                            'tokenPrice': info.tokenPrice,
+                            'qty_cash': info.cash,
+                            'qty_borrow': info.totalBorrows,
+                            'qty_liability': info.totalLiability,
+                            'qty_reserve': info.totalReserves,
+                            'block_number': info.block_number,
+                            'block_datetime': info.block_datetime}
+                           for info in input])
+        df['qty_net'] = df.qty_cash + df.qty_borrow - df.qty_liability
+        for qty in ['cash', 'borrow', 'liability', 'reserve', 'net']:
+            df[qty] = df.tokenPrice * df[f'qty_{qty}']
+
+        return CompoundV2PoolValues(values=[CompoundV2PoolValue(**value)
+                                            for value in list(df.to_dict('records'))])
 
 
 @Model.describe(slug="compound-v2.get-pool-info",
-                version="1.3",
+                version="1.4",
                 display_name="Compound V2 - pool/market information",
                 description="Compound V2 - pool/market information",
                 category='protocol',
@@ -223,7 +280,8 @@ class CompoundV2GetPoolInfo(Model):
     3. totalReserves: Reserves of set-aside cash
     4. totalSupply: the number of tokens currently in circulation in this cToken market
 
-    5. exchangeRate: The exchange rate between a cToken and the underlying asset
+    5. exchangeRate: The exchange rate between a cToken and the underlying asset,
+       exchangeRateStored as of the last accrual like the totals above
        exchangeRate = (getCash() + totalBorrows() - totalReserves()) / totalSupply()
                     => cToken.scaled / pow(10, 2)
        Liabitliy = totalSupply * exchangeRate, or
@@ -239,11 +297,13 @@ class CompoundV2GetPoolInfo(Model):
 
     # TODO
     11. accuralBlockNumber
-    12. exchangeRateStored
-    13. initialExchangeRateMantissa
-    14. interestRateModel
+    12. initialExchangeRateMantissa
+    13. interestRateModel
         - WhitePaperInterestRateModel
         - getBorrowRate/multiplier/baseRate/blocksPerYear
+
+    The market is read with CompoundV2MarketSnapshot, which checks the cToken
+    (isCToken, admin, comptroller, underlying) once per process.
     """
     COMPOUND_GOVERNANCE = {
         1: '0xc0da02939e1441f497fd74f78ce7decb17b66529',
@@ -318,125 +378,21 @@ class CompoundV2GetPoolInfo(Model):
         }
     }
 
-    # APY calculation
-    ETH_MANTISSA = 1e18
-    BLOCKS_PER_DAY = 6570  # 13.15 seconds per block
-    DAYS_PER_YEAR = 365
-
     def test_fixture(self, chain_id):
         compoud_assets = sorted(self.COMPOUND_ASSETS[chain_id].keys())
         compoud_ctokens = sorted(['WETH' if t == 'cETH' else t[1:]
                                   for t, _ in self.COMPOUND_CTOKEN[chain_id].items()])
         assert compoud_assets == compoud_ctokens
 
+    @cache_result
     def run(self, input: Token) -> CompoundV2PoolInfo:
-        comptroller = get_comptroller(self)
-
-        cToken = Token(address=input.address)
-
-        # self.logger.info(f'{cToken._meta.is_transparent_proxy}')
-        # self.logger.info(f'{cToken.is_transparent_proxy}')
-
-        market_info = comptroller.functions.markets(cToken.address).call()
-        (isListed, collateralFactorMantissa, isComped) = market_info
-        collateralFactorMantissa /= pow(10, 18)
-
-        # From cToken to Token
-        if input.symbol == 'cETH':
-            token = Token(address=self.COMPOUND_ASSETS[self.context.chain_id]['WETH'])
-        elif (input.address == self.COMPOUND_CTOKEN[self.context.chain_id]['cSAI'] and
-              input.symbol == 'cDAI'):
-            # When input = cSAI, it has been renamed to cDAI in the contract.
-            # We will still call up SAI
-            token = Token(address=self.COMPOUND_ASSETS[self.context.chain_id]['SAI'])
-        else:
-            token = Token(address=cToken.functions.underlying().call())
-
-        self.logger.info(f'{cToken.address, cToken.symbol}')
-
-        # Check for cToken to be matched with a Token
-        assert cToken.functions.isCToken().call()
-        # TODO: disable this test as we did not have loading ABI by block_number
-        # if cToken.proxy_for is not None:
-        #    try:
-        #        assert cToken.functions.implementation().call() == cToken.proxy_for.address
-        #    except AssertionError:
-        #        self.logger.error(f'{cToken.functions.implementation().call()}, '
-        #                          f'{cToken.proxy_for.address=}')
-        assert cToken.functions.admin().call() == \
-            Address(self.COMPOUND_TIMELOCK[self.context.chain_id])
-        assert cToken.functions.comptroller().call() == Address(comptroller.address)
-        assert cToken.functions.symbol().call()
-        if cToken.name != 'Compound Ether':
-            assert cToken.functions.underlying().call() == token.address
-
-        # Get/calcualte info
-
-        irModel = Contract(address=cToken.functions.interestRateModel().call())
-        _ = irModel.functions.isInterestRateModel().call()
-        # self.logger.info(f'{irModel.address=}, {irModel.functions.isInterestRateModel().call()=}')
-
-        getCash = token.scaled(cToken.functions.getCash().call())
-        totalBorrows = token.scaled(cToken.functions.totalBorrows().call())
-        totalReserves = token.scaled(cToken.functions.totalReserves().call())
-        totalSupply = cToken.scaled(cToken.functions.totalSupply().call())
-
-        exchangeRate = token.scaled(cToken.functions.exchangeRateCurrent().call())
-        invExchangeRate = 1 / exchangeRate * pow(10, 10)
-        totalLiability = totalSupply / invExchangeRate
-
-        reserveFactor = cToken.functions.reserveFactorMantissa().call() / self.ETH_MANTISSA
-        borrowRate = cToken.functions.borrowRatePerBlock().call() / self.ETH_MANTISSA
-        supplyRate = cToken.functions.supplyRatePerBlock().call() / self.ETH_MANTISSA
-
-        if np.isclose(getCash + totalBorrows - totalReserves, 0):
-            utilizationRate = 0
-        else:
-            utilizationRate = totalBorrows / (getCash + totalBorrows - totalReserves)
-        supplyAPY = ((supplyRate * self.BLOCKS_PER_DAY + 1) ** self.DAYS_PER_YEAR - 1)
-        borrowAPY = ((borrowRate * self.BLOCKS_PER_DAY + 1) ** self.DAYS_PER_YEAR - 1)
-        # By definition, this is how supplyRate is derived.
-        # supplyRate ~= borrowRate * utilizationRate * (1 - reserveFactor)
+        market = get_markets(self, [input.address]).to_dict('records')[0]
+        self.logger.info(f'{market["cToken"], market["cTokenSymbol"]}')
 
         tokenprice = self.context.run_model(slug='price.quote',
-                                            input={'base': token},
+                                            input={'base': Token(address=market['token'])},
                                             return_type=Price)
-
-        if tokenprice.price is None or tokenprice.src is None:
-            raise ModelRunError(f'Can not get price for token {token.symbol=}/{token.address=}')
-
-        block_dt = self.context.block_number.timestamp_datetime.replace(tzinfo=None).isoformat()
-        pool_info = CompoundV2PoolInfo(
-            tokenSymbol=input.symbol,
-            cTokenSymbol=cToken.symbol,
-            tokenDecimal=token.decimals,
-            cTokenDecimal=cToken.decimals,
-            token=token,
-            tokenPrice=tokenprice.price,
-            tokenPriceSrc=tokenprice.src,
-            cToken=cToken,
-            cash=getCash,
-            totalReserves=totalReserves,
-            totalBorrows=totalBorrows,
-            totalSupply=totalSupply,
-            totalLiability=totalLiability,
-            exchangeRate=exchangeRate,
-            invExchangeRate=invExchangeRate,
-            borrowRate=borrowRate,
-            supplyRate=supplyRate,
-            supplyAPY=supplyAPY,
-            borrowAPY=borrowAPY,
-            utilizationRate=utilizationRate,
-            reserveFactor=reserveFactor,
-            isListed=isListed,
-            collateralFactor=collateralFactorMantissa,
-            isComped=isComped,
-            block_number=int(self.context.block_number),
-            block_datetime=block_dt,
-            ir_model=irModel,
-        )
-
-        return pool_info
+        return pool_info_from_market(self, market, tokenprice)
 
 
 @ Model.describe(slug="compound-v2.pool-value",
@@ -0,0 +1,171 @@
+from threading import RLock
+from typing import Dict, List
+
+import pandas as pd
+from credmark.cmf.model import ModelContext
+from credmark.cmf.model.errors import ModelDataError
+from credmark.cmf.types import Address, Contract
+from models.utils.ledger import ledger_event_records, ledger_head
+from models.utils.store import SQLiteStore
+
+COMPOUND_ACCOUNTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS collateral_changes (
+    chain_id INTEGER NOT NULL,
+    c_token TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    account TEXT NOT NULL,
+    c_token_amount REAL NOT NULL,
+    PRIMARY KEY (chain_id, block_number, log_index, n)
+);
+CREATE TABLE IF NOT EXISTS borrow_balances (
+    chain_id INTEGER NOT NULL,
+    c_token TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    account TEXT NOT NULL,
+    account_borrows REAL NOT NULL,
+    PRIMARY KEY (chain_id, c_token, block_number, log_index)
+);
+CREATE TABLE IF NOT EXISTS synced (
+    chain_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    synced_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, source)
+);
+"""
+
+
+class CompoundAccountHistory:
+    """
+    Collateral and borrow balances of the accounts in Compound V2 markets,
+    synced from the ledger into an on-disk store and extended as later blocks are requested.
+
+    - Collateral in cTokens is the sum of the Mint and Redeem events of an account,
+      less the cTokens seized from it in LiquidateBorrow events, which go to the liquidator.
+    - Borrow balance is the accountBorrows of the last Borrow or RepayBorrow event of
+      an account, i.e. without the interest accrued since.
+
+    Transfers of cTokens between accounts are not included.
+    Events are synced up to the ledger's head, which can be behind the requested block.
+    """
+
+    _histories: Dict[int, 'CompoundAccountHistory'] = {}
+    _histories_lock = RLock()
+
+    def __init__(self, chain_id: int):
+        self.chain_id = chain_id
+        self.store = SQLiteStore.open('compound_account_history')
+        self.store.execute_script(COMPOUND_ACCOUNTS_SCHEMA)
+        self._lock = RLock()
+
+    @classmethod
+    def open(cls, context) -> 'CompoundAccountHistory':
+        with cls._histories_lock:
+            history = cls._histories.get(context.chain_id)
+            if history is None:
+                history = cls(context.chain_id)
+                cls._histories[context.chain_id] = history
+            return history
+
+    def synced_block(self, source: Address) -> int:
+        row = self.store.query_one(
+            'SELECT synced_block FROM synced WHERE chain_id = ? AND source = ?',
+            (self.chain_id, str(source)))
+        return -1 if row is None else row[0]
+
+    def insert_collateral(self, rows: List[tuple]) -> None:
+        """
+        Store the collateral changes, as (block number, log index, n, cToken, account, amount).
+        """
+        self.store.execute_many([
+            ('INSERT OR REPLACE INTO collateral_changes VALUES (?, ?, ?, ?, ?, ?, ?)',
+             [(self.chain_id, c_token, block_number, log_index, n, str(Address(account)), amount)
+              for block_number, log_index, n, c_token, account, amount in rows])])
+
+    def sync(self, c_token: Address, to_block: int) -> int:
+        """
+        Sync the events of the market up to the block, capped at the ledger's head,
+        and return the synced block.
+        """
+        from_block = self.synced_block(c_token)
+        if from_block < to_block:
+            to_block = ledger_head(ModelContext.current_context(), to_block)
+        if from_block >= to_block:
+            return from_block
+
+        contract = Contract(address=c_token)
+        c_token = str(Address(c_token))
+
+        for records in ledger_event_records(contract, 'Mint', ['minter', 'minttokens'],
+                                            from_block, to_block):
+            self.insert_collateral([(r['block_number'], r['log_index'], 0, c_token,
+                                     r['minter'], float(r['minttokens']))
+                                    for r in records])
+        for records in ledger_event_records(contract, 'Redeem', ['redeemer', 'redeemtokens'],
+                                            from_block, to_block):
+            self.insert_collateral([(r['block_number'], r['log_index'], 0, c_token,
+                                     r['redeemer'], -float(r['redeemtokens']))
+                                    for r in records])
+        for records in ledger_event_records(contract, 'LiquidateBorrow',
+                                            ['liquidator', 'borrower', 'ctokencollateral',
+                                             'seizetokens'],
+                                            from_block, to_block):
+            rows = []
+            for r in records:
+                collateral_c_token = str(Address(r['ctokencollateral']))
+                rows.append((r['block_number'], r['log_index'], 0, collateral_c_token,
+                             r['borrower'], -float(r['seizetokens'])))
+                rows.append((r['block_number'], r['log_index'], 1, collateral_c_token,
+                             r['liquidator'], float(r['seizetokens'])))
+            self.insert_collateral(rows)
+
+        for event_name in ['Borrow', 'RepayBorrow']:
+            for records in ledger_event_records(contract, event_name,
+                                                ['borrower', 'accountborrows'],
+                                                from_block, to_block):
+                self.store.execute_many([
+                    ('INSERT OR REPLACE INTO borrow_balances VALUES (?, ?, ?, ?, ?, ?)',
+                     [(self.chain_id, c_token, r['block_number'], r['log_index'],
+                       str(Address(r['borrower'])), float(r['accountborrows']))
+                      for r in records])])
+
+        self.store.execute('INSERT OR REPLACE INTO synced VALUES (?, ?, ?)',
+                           (self.chain_id, c_token, to_block))
+        return to_block
+
+    def account_positions(self, c_tokens: List[Address], block_number: int) -> pd.DataFrame:
+        """
+        Raw amounts of collateral in cTokens and borrow balance in the underlying of each
+        account in each of the markets as of the block, one row per account and cToken.
+        """
+        c_tokens = [str(Address(c_token)) for c_token in c_tokens]
+        markets = ', '.join('?' * len(c_tokens))
+        with self._lock:
+            # Seized cTokens are in the events of the borrowed market, so all markets are synced
+            for c_token in c_tokens:
+                synced_block = self.sync(Address(c_token), block_number)
+                if synced_block < block_number:
+                    raise ModelDataError(f'Ledger is at block {synced_block}, before the '
+                                         f'accounts of {c_token} at block {block_number}')
+
+            collateral = self.store.query(
+                'SELECT account, c_token, SUM(c_token_amount) FROM collateral_changes '
+                f'WHERE chain_id = ? AND block_number <= ? AND c_token IN ({markets}) '
+                'GROUP BY account, c_token',
+                (self.chain_id, block_number, *c_tokens))
+            # account_borrows is from the row of the last event, with SQLite's bare column of MAX
+            borrows = self.store.query(
+                'SELECT account, c_token, account_borrows, '
+                'MAX(block_number * 100000 + log_index) FROM borrow_balances '
+                f'WHERE chain_id = ? AND block_number <= ? AND c_token IN ({markets}) '
+                'GROUP BY account, c_token',
+                (self.chain_id, block_number, *c_tokens))
+
+        df = pd.merge(
+            pd.DataFrame(collateral, columns=['account', 'cToken', 'collateral']),
+            pd.DataFrame([row[:3] for row in borrows], columns=['account', 'cToken', 'debt']),
+            on=['account', 'cToken'], how='outer').fillna(0.0)
+        df[['collateral', 'debt']] = df[['collateral', 'debt']].clip(lower=0)
+        return df[(df.collateral > 0) | (df.debt > 0)].reset_index(drop=True)
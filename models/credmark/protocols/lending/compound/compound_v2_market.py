@@ -0,0 +1,186 @@
+from threading import RLock
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from credmark.cmf.model.errors import ModelDataError, ModelRunError
+from credmark.cmf.types import Address, Contract
+from models.tmp_abi_lookup import (COMPOUND_CTOKEN_ABI,
+                                   COMPOUND_INTEREST_RATE_MODEL_ABI,
+                                   ERC_20_TOKEN_CONTRACT_ABI)
+from models.utils.cache import LRUCache
+from models.utils.multicall import multicall
+
+ETH_MANTISSA = 1e18
+
+# APY calculation
+BLOCKS_PER_DAY = 6570  # 13.15 seconds per block
+DAYS_PER_YEAR = 365
+
+CTOKEN_VIEWS = ['symbol', 'decimals', 'interestRateModel', 'getCash', 'totalBorrows',
+                'totalReserves', 'totalSupply', 'exchangeRateStored', 'reserveFactorMantissa',
+                'borrowRatePerBlock', 'supplyRatePerBlock']
+
+CTOKEN_CHECKS = ['isCToken', 'admin', 'comptroller']
+
+
+class CompoundV2MarketSnapshot:
+    """
+    Compound V2 markets at a block as a table with one row per cToken.
+
+    The table is read in two batches of calls for all markets: the comptroller's market
+    entries with the cTokens' underlying and state, then the decimals of the underlying tokens.
+    Amounts use exchangeRateStored and the stored totals, i.e. as of the last accrual.
+
+    The checks of a cToken (isCToken, its admin and comptroller) and of its interest rate model
+    run with the second batch the first time they are seen in the process.
+    """
+
+    _snapshots = LRUCache(maxsize=100)
+    _checked: Set[Tuple[int, Address]] = set()
+    _checked_lock = RLock()
+
+    def __init__(self, markets: pd.DataFrame):
+        self.markets = markets
+
+    @classmethod
+    def load(cls, context, comptroller: Contract, c_tokens: List[Address], admin: Address,
+             underlying_overrides: Dict[Address, Address]) -> 'CompoundV2MarketSnapshot':
+        """
+        Markets of the cTokens, in their order. The underlying of a cToken in
+        underlying_overrides, e.g. cETH, is taken from it instead of underlying().
+        """
+        c_tokens = [Address(c_token) for c_token in c_tokens]
+        key = (context.chain_id, int(context.block_number), tuple(c_tokens))
+        snapshot = cls._snapshots.get(key)
+        if snapshot is None:
+            snapshot = cls(cls.read_markets(context, comptroller, c_tokens, admin,
+                                            underlying_overrides))
+            cls._snapshots.put(key, snapshot)
+        return snapshot
+
+    @classmethod
+    def read_markets(cls, context, comptroller: Contract, c_tokens: List[Address],
+                     admin: Address, underlying_overrides: Dict[Address, Address]) \
+            -> pd.DataFrame:
+        n_markets = len(c_tokens)
+        n_views = len(CTOKEN_VIEWS)
+        contracts = [Contract(address=c_token, abi=COMPOUND_CTOKEN_ABI) for c_token in c_tokens]
+
+        results = multicall(context,
+                            [comptroller.functions.markets(c_token.checksum)
+                             for c_token in c_tokens] +
+                            [contract.functions.underlying() for contract in contracts] +
+                            [getattr(contract.functions, view)()
+                             for contract in contracts for view in CTOKEN_VIEWS])
+        markets = results[:n_markets]
+        underlyings = results[n_markets:2 * n_markets]
+        states = [results[2 * n_markets + n * n_views: 2 * n_markets + (n + 1) * n_views]
+                  for n in range(n_markets)]
+
+        for c_token, market, state in zip(c_tokens, markets, states):
+            if market is None or any(v is None for v in state):
+                raise ModelRunError(f'Unable to read the market of {c_token}')
+
+        tokens = []
+        for c_token, underlying in zip(c_tokens, underlyings):
+            token = underlying_overrides.get(c_token)
+            if token is None:
+                if underlying is None:
+                    raise ModelRunError(f'Unable to read the underlying of {c_token}')
+                token = Address(underlying)
+            tokens.append(token)
+
+        df = pd.DataFrame([dict(zip(CTOKEN_VIEWS, state)) for state in states])
+        df.insert(0, 'cToken', c_tokens)
+        df.insert(1, 'token', tokens)
+        df['interestRateModel'] = [Address(ir_model) for ir_model in df.interestRateModel]
+
+        token_decimals = cls.read_and_check(context, comptroller, admin, df, underlyings)
+
+        # markets(): isListed, collateralFactorMantissa, isComped
+        df['isListed'] = [bool(market[0]) for market in markets]
+        df['collateralFactor'] = [market[1] / ETH_MANTISSA for market in markets]
+        df['isComped'] = [bool(market[2]) for market in markets]
+        df['tokenDecimal'] = token_decimals
+
+        token_scale = np.power(10.0, np.array(token_decimals, dtype=float))
+        c_token_scale = np.power(10.0, df.decimals.to_numpy(dtype=float))
+        df['cash'] = df.getCash.to_numpy(dtype=float) / token_scale
+        df['totalBorrows'] = df.totalBorrows.to_numpy(dtype=float) / token_scale
+        df['totalReserves'] = df.totalReserves.to_numpy(dtype=float) / token_scale
+        df['totalSupply'] = df.totalSupply.to_numpy(dtype=float) / c_token_scale
+
+        df['exchangeRate'] = df.exchangeRateStored.to_numpy(dtype=float) / token_scale
+        df['invExchangeRate'] = 1 / df.exchangeRate * pow(10, 10)
+        df['totalLiability'] = df.totalSupply / df.invExchangeRate
+
+        df['reserveFactor'] = df.reserveFactorMantissa.to_numpy(dtype=float) / ETH_MANTISSA
+        df['borrowRate'] = df.borrowRatePerBlock.to_numpy(dtype=float) / ETH_MANTISSA
+        df['supplyRate'] = df.supplyRatePerBlock.to_numpy(dtype=float) / ETH_MANTISSA
+
+        deposits = (df.cash + df.totalBorrows - df.totalReserves).to_numpy()
+        has_deposits = ~np.isclose(deposits, 0)
+        df['utilizationRate'] = np.divide(df.totalBorrows.to_numpy(), deposits,
+                                          out=np.zeros(n_markets), where=has_deposits)
+        df['supplyAPY'] = (df.supplyRate * BLOCKS_PER_DAY + 1) ** DAYS_PER_YEAR - 1
+        df['borrowAPY'] = (df.borrowRate * BLOCKS_PER_DAY + 1) ** DAYS_PER_YEAR - 1
+
+        return df.rename(columns={'symbol': 'cTokenSymbol', 'decimals': 'cTokenDecimal'})
+
+    @classmethod
+    def read_and_check(cls, context, comptroller: Contract, admin: Address,
+                       markets: pd.DataFrame, underlyings: List) -> List[int]:
+        """
+        Decimals of the underlying tokens, read with the checks of the cTokens and
+        interest rate models that have not passed them yet in the process.
+        """
+        chain_id = context.chain_id
+        with cls._checked_lock:
+            c_tokens = [c_token for c_token in markets.cToken
+                        if (chain_id, c_token) not in cls._checked]
+            ir_models = list({ir_model for ir_model in markets.interestRateModel
+                              if (chain_id, ir_model) not in cls._checked})
+
+        n_markets = len(markets)
+        results = multicall(
+            context,
+            [Contract(address=token, abi=ERC_20_TOKEN_CONTRACT_ABI).functions.decimals()
+             for token in markets.token] +
+            [getattr(Contract(address=c_token, abi=COMPOUND_CTOKEN_ABI).functions, check)()
+             for c_token in c_tokens for check in CTOKEN_CHECKS] +
+            [Contract(address=ir_model, abi=COMPOUND_INTEREST_RATE_MODEL_ABI)
+             .functions.isInterestRateModel()
+             for ir_model in ir_models])
+        token_decimals = results[:n_markets]
+        checks = results[n_markets:n_markets + len(c_tokens) * len(CTOKEN_CHECKS)]
+        is_ir_models = results[n_markets + len(c_tokens) * len(CTOKEN_CHECKS):]
+
+        for token, decimals in zip(markets.token, token_decimals):
+            if decimals is None:
+                raise ModelRunError(f'Unable to read the decimals of {token}')
+
+        token_by_c_token = dict(zip(markets.cToken, markets.token))
+        underlying_by_c_token = dict(zip(markets.cToken, underlyings))
+        for n, c_token in enumerate(c_tokens):
+            is_c_token, c_token_admin, c_token_comptroller = \
+                checks[n * len(CTOKEN_CHECKS): (n + 1) * len(CTOKEN_CHECKS)]
+            if not is_c_token or c_token_admin is None or c_token_comptroller is None:
+                raise ModelDataError(f'{c_token} is not a cToken')
+            if Address(c_token_admin) != admin:
+                raise ModelDataError(f'Admin of {c_token} is {c_token_admin}, not {admin}')
+            if Address(c_token_comptroller) != comptroller.address:
+                raise ModelDataError(f'Comptroller of {c_token} is {c_token_comptroller}, '
+                                     f'not {comptroller.address}')
+            underlying = underlying_by_c_token[c_token]
+            if underlying is not None and Address(underlying) != token_by_c_token[c_token]:
+                raise ModelDataError(f'Underlying of {c_token} is {underlying}, '
+                                     f'not {token_by_c_token[c_token]}')
+
+        for ir_model, is_ir_model in zip(ir_models, is_ir_models):
+            if not is_ir_model:
+                raise ModelDataError(f'{ir_model} is not an interest rate model')
+
+        with cls._checked_lock:
+            cls._checked.update((chain_id, address) for address in c_tokens + ir_models)
+        return [int(decimals) for decimals in token_decimals]
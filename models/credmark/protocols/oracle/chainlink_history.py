@@ -0,0 +1,185 @@
+from threading import RLock
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from credmark.cmf.model import ModelContext
+from credmark.cmf.types import Address, Contract, ContractLedger
+from models.credmark.protocols.oracle.chainlink_routing import ChainlinkFeedRoutes
+from models.utils.ledger import EVT_LOG_INDEX, ledger_event_pages, ledger_head
+from models.utils.store import SQLiteStore
+
+ANSWER_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    chain_id INTEGER NOT NULL,
+    aggregator TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    round_id TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    PRIMARY KEY (chain_id, aggregator, block_number, round_id)
+);
+CREATE TABLE IF NOT EXISTS synced_range (
+    chain_id INTEGER NOT NULL,
+    aggregator TEXT NOT NULL,
+    first_block INTEGER NOT NULL,
+    synced_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, aggregator)
+);
+"""
+
+
+class ChainlinkAnswerHistory:
+    """
+    Answers of Chainlink aggregators from their AnswerUpdated events, synced from the ledger
+    into an on-disk store and kept in memory as sorted arrays of (block number, answer).
+
+    The answer of an aggregator as of a block is its last answer at or before the block,
+    which is what latestRoundData returns at the block.
+    The store keeps the answers from the first block requested, with the last answer
+    before it, so a recent window does not sync the aggregator's full history.
+    """
+
+    _histories: Dict[int, 'ChainlinkAnswerHistory'] = {}
+    _histories_lock = RLock()
+
+    def __init__(self, chain_id: int):
+        self.chain_id = chain_id
+        self.store = SQLiteStore.open('chainlink_answers')
+        self.store.execute_script(ANSWER_HISTORY_SCHEMA)
+        self._lock = RLock()
+        self._answers: Dict[Address, Tuple[int, int, np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def open(cls, chain_id: int) -> 'ChainlinkAnswerHistory':
+        with cls._histories_lock:
+            history = cls._histories.get(chain_id)
+            if history is None:
+                history = cls(chain_id)
+                cls._histories[chain_id] = history
+            return history
+
+    def synced_range(self, aggregator: Address) -> Optional[Tuple[int, int]]:
+        row = self.store.query_one(
+            'SELECT first_block, synced_block FROM synced_range '
+            'WHERE chain_id = ? AND aggregator = ?',
+            (self.chain_id, str(aggregator)))
+        return None if row is None else (row[0], row[1])
+
+    def sync(self, aggregator: Address, from_block: int, to_block: int) -> None:
+        """
+        Extend the synced range of the aggregator to cover from_block to to_block,
+        capped at the ledger's head.
+        """
+        head = ledger_head(ModelContext.current_context(), to_block)
+        from_block = min(from_block, head)
+        to_block = min(to_block, head)
+
+        contract = Contract(address=aggregator)
+        synced = self.synced_range(aggregator)
+        if synced is None:
+            first_block = from_block
+            synced_block = from_block
+            self.sync_last_answer(contract, from_block)
+        else:
+            first_block, synced_block = synced
+
+        if from_block < first_block:
+            self.sync_last_answer(contract, from_block)
+            self.sync_answers(contract, from_block, first_block)
+            first_block = from_block
+
+        if synced_block < to_block:
+            self.sync_answers(contract, synced_block, to_block)
+            synced_block = to_block
+
+        self.store.execute('INSERT OR REPLACE INTO synced_range VALUES (?, ?, ?, ?)',
+                           (self.chain_id, str(aggregator), first_block, synced_block))
+
+    def insert_answers(self, contract: Contract, events) -> None:
+        block_col = ContractLedger.Events.Columns.EVT_BLOCK_NUMBER
+        answer_col = ContractLedger.Events.InputCol('current')
+        round_col = ContractLedger.Events.InputCol('roundid')
+        self.store.execute_many([
+            ('INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)',
+             [(self.chain_id, str(contract.address), int(r[block_col]),
+               str(r[round_col]), str(r[answer_col]))
+              for r in events.to_dict('records')])])
+
+    def sync_last_answer(self, contract: Contract, block_number: int) -> None:
+        """
+        Store the last answer of the aggregator at or before the block.
+        """
+        block_col = ContractLedger.Events.Columns.EVT_BLOCK_NUMBER
+        events = (contract.ledger.events.AnswerUpdated(
+            columns=[block_col,
+                     ContractLedger.Events.InputCol('roundid'),
+                     ContractLedger.Events.InputCol('current')],
+            where=f'{block_col} <= {block_number}',
+            order_by=f'{block_col} desc, {EVT_LOG_INDEX} desc',
+            limit='1')
+            .to_dataframe())
+        self.insert_answers(contract, events)
+
+    def sync_answers(self, contract: Contract, from_block: int, to_block: int) -> None:
+        """
+        Store the answers of the aggregator in from_block < block <= to_block.
+        """
+        columns = [ContractLedger.Events.Columns.EVT_BLOCK_NUMBER,
+                   ContractLedger.Events.InputCol('roundid'),
+                   ContractLedger.Events.InputCol('current')]
+        for events in ledger_event_pages(contract, 'AnswerUpdated', columns,
+                                         from_block, to_block):
+            self.insert_answers(contract, events)
+
+    def answers(self, aggregator: Address,
+                from_block: int, to_block: int) -> Tuple[int, np.ndarray, np.ndarray]:
+        """
+        Return the synced block, the block numbers and the answers of the aggregator from
+        the last answer at or before from_block up to to_block, or the ledger's head if
+        it is behind.
+        """
+        with self._lock:
+            loaded = self._answers.get(aggregator)
+            if loaded is None or from_block < loaded[0] or loaded[1] < to_block:
+                self.sync(aggregator, from_block, to_block)
+                rows = self.store.query(
+                    'SELECT block_number, answer FROM answers '
+                    'WHERE chain_id = ? AND aggregator = ? '
+                    'ORDER BY block_number, length(round_id), round_id',
+                    (self.chain_id, str(aggregator)))
+                first_block, synced_block = self.synced_range(aggregator)
+                loaded = (first_block, synced_block,
+                          np.array([r[0] for r in rows], dtype=np.int64),
+                          np.array([float(r[1]) for r in rows], dtype=float))
+                self._answers[aggregator] = loaded
+            return loaded[1], loaded[2], loaded[3]
+
+    def answer_as_of(self, aggregator: Address, block_numbers: np.ndarray) -> np.ndarray:
+        """
+        Answers of the aggregator as of each of the blocks, NaN before its first answer
+        and after the ledger's head.
+        """
+        synced_block, blocks, answers = self.answers(
+            aggregator, int(block_numbers.min()), int(block_numbers.max()))
+        n = np.searchsorted(blocks, block_numbers, side='right') - 1
+        result = np.full(block_numbers.shape, np.nan)
+        found = (n >= 0) & (block_numbers <= synced_block)
+        result[found] = answers[n[found]]
+        return result
+
+    def pair_answer_as_of(self, routes: ChainlinkFeedRoutes,
+                          asset: Address, denomination: Address,
+                          block_numbers: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Answers of a registry pair as of each of the blocks, following its aggregator changes.
+        None if the pair has no aggregator at one of the blocks.
+        """
+        aggregators = [routes.aggregator(asset, denomination, int(b)) for b in block_numbers]
+        if any(agg is None for agg in aggregators):
+            return None
+
+        result = np.full(block_numbers.shape, np.nan)
+        aggregators_arr = np.array(aggregators, dtype=object)
+        for aggregator in set(aggregators):
+            sel = aggregators_arr == aggregator
+            result[sel] = self.answer_as_of(aggregator, block_numbers[sel])
+        return result
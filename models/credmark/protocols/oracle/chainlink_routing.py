@@ -0,0 +1,241 @@
+from bisect import bisect_right
+from collections import deque
+from threading import RLock
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from credmark.cmf.model import ModelContext
+from credmark.cmf.types import Address, Contract
+from models.utils.cache import LRUCache
+from models.utils.ledger import ledger_event_records, ledger_head
+from models.utils.store import SQLiteStore
+
+NULL_ADDRESS = Address('0x0000000000000000000000000000000000000000')
+
+FEED_ROUTES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feeds (
+    chain_id INTEGER NOT NULL,
+    registry TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    denomination TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    aggregator TEXT NOT NULL,
+    PRIMARY KEY (chain_id, registry, asset, denomination, block_number)
+);
+CREATE TABLE IF NOT EXISTS synced (
+    chain_id INTEGER NOT NULL,
+    registry TEXT NOT NULL,
+    synced_block INTEGER NOT NULL,
+    PRIMARY KEY (chain_id, registry)
+);
+"""
+
+
+class FeedHop(NamedTuple):
+    """
+    One feed on a route: price of base in quote is answer ** (-1 if inverse else 1).
+    A registry feed is keyed by (asset, denomination), an ENS feed by its domain.
+    """
+    base: Address
+    quote: Address
+    asset: Address
+    denomination: Address
+    inverse: bool
+    ens_domain: Optional[str] = None
+
+
+def add_feed(graph: Dict[Address, List[FeedHop]], asset: Address, denomination: Address,
+             ens_domain: Optional[str] = None) -> None:
+    graph.setdefault(asset, []).append(
+        FeedHop(asset, denomination, asset, denomination, False, ens_domain))
+    graph.setdefault(denomination, []).append(
+        FeedHop(denomination, asset, asset, denomination, True, ens_domain))
+
+
+class ChainlinkFeedRoutes:  # pylint:disable=too-many-instance-attributes
+    """
+    Graph of token pairs with a Chainlink feed, from the Feed Registry's FeedConfirmed events.
+
+    Each (asset, denomination) pair keeps the blocks where its aggregator was confirmed.
+    A pair is an edge at a block if its last confirmed aggregator up to the block is not null.
+    The graph is synced in an on-disk store and kept in memory for the process,
+    so finding a route for a pair needs no RPC.
+    The edges only change at a confirmation block, so the graph is built once for the blocks
+    between two confirmations and reused until the next sync.
+    Confirmations are synced up to the ledger's head, which can be behind the context block.
+    The ledger's head is read once for a context block, so a lagging ledger costs
+    one query per block and not one per route.
+    """
+
+    _routes: Dict[Tuple[int, Address], 'ChainlinkFeedRoutes'] = {}
+    _routes_lock = RLock()
+
+    def __init__(self, chain_id: int, registry: Contract):
+        self.chain_id = chain_id
+        self.registry = registry
+        self.store = SQLiteStore.open('chainlink_feed_routes')
+        self.store.execute_script(FEED_ROUTES_SCHEMA)
+        self._lock = RLock()
+        self._feeds: Dict[Tuple[Address, Address], Tuple[List[int], List[Address]]] = {}
+        self._confirmed_blocks: List[int] = []
+        self._graphs = LRUCache(maxsize=64)
+        self._loaded_block = -1
+        # Context blocks whose sync has read the ledger's head
+        self._checked_blocks = LRUCache(maxsize=1024)
+
+    @classmethod
+    def open(cls, context, registry: Contract) -> 'ChainlinkFeedRoutes':
+        """
+        Return the process-wide routes of the registry, synced up to the context block.
+        """
+        with cls._routes_lock:
+            routes = cls._routes.get((context.chain_id, registry.address))
+            if routes is None:
+                routes = cls(context.chain_id, registry)
+                cls._routes[(context.chain_id, registry.address)] = routes
+        routes.sync(int(context.block_number))
+        return routes
+
+    def synced_block(self) -> int:
+        row = self.store.query_one(
+            'SELECT synced_block FROM synced WHERE chain_id = ? AND registry = ?',
+            (self.chain_id, str(self.registry.address)))
+        return -1 if row is None else row[0]
+
+    @property
+    def loaded_block(self) -> int:
+        """
+        The block up to which the feeds in memory are complete.
+        """
+        return self._loaded_block
+
+    def sync(self, to_block: int) -> None:
+        with self._lock:
+            if self._loaded_block >= to_block or self._checked_blocks.get(to_block) is not None:
+                return
+
+            from_block = self.synced_block()
+            if from_block < to_block:
+                self.sync_ledger(from_block,
+                                 ledger_head(ModelContext.current_context(), to_block))
+            if self._loaded_block < self.synced_block():
+                self.load()
+            self._checked_blocks.put(to_block, True)
+
+    def sync_ledger(self, from_block: int, to_block: int) -> None:
+        if from_block >= to_block:
+            return
+
+        for records in ledger_event_records(self.registry, 'FeedConfirmed',
+                                            ['asset', 'denomination', 'latestaggregator'],
+                                            from_block, to_block):
+            self.store.execute_many([
+                ('INSERT OR REPLACE INTO feeds VALUES (?, ?, ?, ?, ?, ?)',
+                 [(self.chain_id, str(self.registry.address), str(Address(r['asset'])),
+                   str(Address(r['denomination'])), r['block_number'],
+                   str(Address(r['latestaggregator'])))
+                  for r in records])])
+        self.store.execute('INSERT OR REPLACE INTO synced VALUES (?, ?, ?)',
+                           (self.chain_id, str(self.registry.address), to_block))
+
+    def load(self) -> None:
+        rows = self.store.query(
+            'SELECT asset, denomination, block_number, aggregator FROM feeds '
+            'WHERE chain_id = ? AND registry = ? ORDER BY block_number',
+            (self.chain_id, str(self.registry.address)))
+
+        feeds = {}
+        for asset, denomination, block_number, aggregator in rows:
+            blocks, aggregators = feeds.setdefault((Address(asset), Address(denomination)),
+                                                   ([], []))
+            blocks.append(block_number)
+            aggregators.append(Address(aggregator))
+        self._feeds = feeds
+        self._confirmed_blocks = sorted({block_number for _, _, block_number, _ in rows})
+        self._graphs.clear()
+        self._loaded_block = self.synced_block()
+
+    def aggregator(self, asset: Address, denomination: Address,
+                   block_number: int) -> Optional[Address]:
+        """
+        The aggregator of the pair confirmed at the block, or None.
+        """
+        feed = self._feeds.get((asset, denomination))
+        if feed is None:
+            return None
+        blocks, aggregators = feed
+        n = bisect_right(blocks, block_number)
+        if n == 0 or aggregators[n - 1] == NULL_ADDRESS:
+            return None
+        return aggregators[n - 1]
+
+    def edges(self, block_number: int) -> List[Tuple[Address, Address]]:
+        return [(asset, denomination) for asset, denomination in self._feeds
+                if self.aggregator(asset, denomination, block_number) is not None]
+
+    def graph(self, block_number: int) -> Dict[Address, List[FeedHop]]:
+        """
+        Feeds of the registry at the block, by the token they price from.
+        """
+        # Blocks with the same number of confirmations up to them have the same edges
+        confirmations = bisect_right(self._confirmed_blocks, block_number)
+        graph = self._graphs.get(confirmations)
+        if graph is None:
+            graph = {}
+            for asset, denomination in self.edges(block_number):
+                add_feed(graph, asset, denomination)
+            self._graphs.put(confirmations, graph)
+        return graph
+
+    def route(self,
+              base: Address,
+              quote: Address,
+              block_number: int,
+              override_feeds: Sequence[Tuple[Address, Address, str, int]] = (),
+              preferred: Sequence[Address] = ()) -> Optional[List[FeedHop]]:
+        """
+        The shortest chain of feeds from base to quote at the block, or None.
+        A feed can be used in either direction.
+        Override feeds of (asset, denomination, ENS domain, first block) are added to
+        the registry's from their first block.
+        Ties are broken by the order of the preferred tokens in the route.
+        """
+        with self._lock:
+            graph = self.graph(block_number)
+
+        overrides: Dict[Address, List[FeedHop]] = {}
+        for asset, denomination, ens_domain, from_block in override_feeds:
+            if from_block <= block_number:
+                add_feed(overrides, asset, denomination, ens_domain)
+
+        def _hops(node):
+            return graph.get(node, []) + overrides.get(node, [])
+
+        if not _hops(base) or not _hops(quote):
+            return None
+
+        rank = {addr: n for n, addr in enumerate(preferred)}
+        previous: Dict[Address, Optional[FeedHop]] = {base: None}
+        queue = deque([base])
+        while queue:
+            node = queue.popleft()
+            if node == quote:
+                break
+            hops = sorted(_hops(node),
+                          key=lambda hop: (hop.quote != quote,
+                                           rank.get(hop.quote, len(rank)),
+                                           hop.ens_domain is not None))
+            for hop in hops:
+                if hop.quote not in previous:
+                    previous[hop.quote] = hop
+                    queue.append(hop.quote)
+
+        if quote not in previous:
+            return None
+
+        path = []
+        node = quote
+        while previous[node] is not None:
+            hop = previous[node]
+            path.append(hop)
+            node = hop.base
+        return path[::-1]
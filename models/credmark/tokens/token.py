@@ -1,11 +1,12 @@
 # pylint: disable=locally-disabled, unused-import
 from typing import List
 
-from credmark.cmf.model import Model
+from credmark.cmf.model import Model, ModelContext
 from credmark.cmf.model.errors import ModelInputError, ModelRunError, ModelDataError
 from credmark.cmf.types import (Accounts, Address, Contract, Contracts,
                                 Currency, Price, Token)
 from credmark.dto import DTO, IterableListGenericDTO
+from models.credmark.tokens.token_metadata import TOKEN_METADATA
 from models.dtos.price import Maybe
 from models.tmp_abi_lookup import ERC_20_ABI
 
@@ -67,6 +68,15 @@ def get_eip1967_proxy_err(context, logger, address, verbose):
 
 
 def fix_erc20_token(tok):
+    """
+    Load the token's ABI, or use the ERC-20 ABI if it is not available.
+    Tokens already loaded in the process are rebuilt from the token metadata cache.
+    """
+    context = ModelContext.current_context()
+    entry = TOKEN_METADATA.get_valid(context, tok.address)
+    if entry is not None and entry.get('abi') is not None:
+        return TOKEN_METADATA.build_token(tok.address, entry)
+
     try:
         _ = tok.abi
     except ModelDataError:
@@ -79,6 +89,7 @@ def fix_erc20_token(tok):
             tok.proxy_for._loaded = True  # pylint:disable=protected-access
             tok.proxy_for.set_abi(ERC_20_ABI)
 
+    TOKEN_METADATA.update_from_token(context, tok)
     return tok
 
 
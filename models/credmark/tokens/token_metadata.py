@@ -0,0 +1,192 @@
+import json
+import os
+import time
+from threading import RLock
+from typing import Optional
+
+from credmark.cmf.types import Address, Contract, Token
+from models.tmp_abi_lookup import ERC_20_ABI
+from models.utils.cache import LRUCache
+from models.utils.multicall import multicall
+
+EIP1967_IMPLEMENTATION_SLOT = '0x360894a13ba1a3210667c828492db98dca3e2076cc3735a920a3ca505d382bbc'
+
+TOKEN_METADATA_SNAPSHOT = os.path.join(os.path.dirname(__file__), 'token_metadata.json')
+
+METADATA_FIELDS = ['symbol', 'decimals', 'name']
+
+SNAPSHOT_FIELDS = ['abi', 'proxy_implementation', 'proxy_abi'] + METADATA_FIELDS
+
+
+class TokenMetadataCache:
+    """
+    Process-wide cache of (chain_id, address) -> symbol, decimals, name, ABI and proxy
+    implementation (address and ABI) of tokens, to build Token without RPC, ABI fetches
+    or proxy resolution.
+
+    Invalidation rules:
+    - a token that is not a proxy can not change, so its entry does not expire.
+    - an EIP-1967 proxy records the block range in which its implementation slot was read.
+      Outside the range, the slot is read again.
+      The entry is dropped if the implementation changed.
+    - other proxies, with the implementation from the ABI service, expire after PROXY_TTL seconds.
+    - invalidate() drops a token's entry, e.g. after an upgrade.
+
+    Entries are replaced, not changed in place, under the cache's lock.
+    The cache is warmed from the bundled snapshot of common tokens, which are not proxies.
+    A snapshot entry without ABI is built with the ERC-20 ABI.
+    """
+
+    PROXY_TTL = 3600
+
+    def __init__(self, maxsize: int = 20000):
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = RLock()
+
+    def get(self, chain_id: int, address: Address) -> Optional[dict]:
+        return self._cache.get((chain_id, Address(address)))
+
+    def put(self, chain_id: int, address: Address, entry: dict) -> None:
+        self._cache.put((chain_id, Address(address)), entry)
+
+    def invalidate(self, chain_id: int, address: Address) -> None:
+        self._cache.pop((chain_id, Address(address)))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def read_eip1967_implementation(self, context, address: Address) -> Optional[Address]:
+        slot_value = context.web3.eth.get_storage_at(
+            Address(address).checksum, EIP1967_IMPLEMENTATION_SLOT).hex()
+        if int(slot_value[-40:], 16) == 0:
+            return None
+        return Address('0x' + slot_value[-40:])
+
+    def get_valid(self, context, address: Address) -> Optional[dict]:
+        """
+        Return the entry for the address if it is still valid at the context block.
+        """
+        entry = self.get(context.chain_id, address)
+        if entry is None or entry.get('proxy_implementation') is None:
+            return entry
+
+        block_number = int(context.block_number)
+        validated_blocks = entry.get('validated_blocks')
+        if validated_blocks is not None:
+            if validated_blocks[0] <= block_number <= validated_blocks[1]:
+                return entry
+            implementation = self.read_eip1967_implementation(context, address)
+            with self._lock:
+                entry = self.get(context.chain_id, address)
+                if entry is None or implementation != Address(entry['proxy_implementation']):
+                    self.invalidate(context.chain_id, address)
+                    return None
+                first_block, last_block = entry['validated_blocks']
+                if first_block > last_block:
+                    first_block, last_block = block_number, block_number
+                entry = {**entry,
+                         'validated_blocks': (min(first_block, block_number),
+                                              max(last_block, block_number))}
+                self.put(context.chain_id, address, entry)
+            return entry
+
+        if time.time() - entry['loaded_at'] > self.PROXY_TTL:
+            self.invalidate(context.chain_id, address)
+            return None
+        return entry
+
+    @staticmethod
+    def read_metadata(context, tok: Token) -> dict:
+        """
+        Symbol, decimals and name of the token, in one multicall for those not loaded yet.
+        A value that can not be read, e.g. a bytes32 symbol, is None and left to Token.
+        """
+        # pylint:disable=protected-access
+        metadata = {field: getattr(tok._meta, field, None) for field in METADATA_FIELDS}
+        missing = [field for field, value in metadata.items() if value is None]
+        if len(missing) > 0:
+            erc20 = Contract(address=tok.address.checksum, abi=ERC_20_ABI)
+            metadata.update(zip(missing, multicall(
+                context, [getattr(erc20.functions, field)() for field in missing])))
+        return metadata
+
+    @staticmethod
+    def apply_metadata(tok: Token, entry: dict) -> Token:
+        # pylint:disable=protected-access
+        for field in METADATA_FIELDS:
+            if entry.get(field) is not None and hasattr(tok._meta, field):
+                setattr(tok._meta, field, entry[field])
+        return tok
+
+    def update_from_token(self, context, tok: Token) -> None:
+        """
+        Record the loaded ABI and proxy implementation of the token with its metadata,
+        and set the metadata on the token.
+        """
+        entry = {'abi': json.dumps(list(tok.abi)) if tok.abi is not None else None,
+                 'loaded_at': time.time(),
+                 'proxy_implementation': None,
+                 'proxy_abi': None,
+                 'validated_blocks': None}
+
+        if tok.proxy_for is not None:
+            entry['proxy_implementation'] = str(tok.proxy_for.address)
+            entry['proxy_abi'] = (json.dumps(list(tok.proxy_for.abi))
+                                  if tok.proxy_for.abi is not None else None)
+            implementation = self.read_eip1967_implementation(context, tok.address)
+            if implementation == tok.proxy_for.address:
+                block_number = int(context.block_number)
+                entry['validated_blocks'] = (block_number, block_number)
+
+        entry.update(self.read_metadata(context, tok))
+        self.apply_metadata(tok, entry)
+        with self._lock:
+            self.put(context.chain_id, tok.address, entry)
+
+    @classmethod
+    def build_token(cls, address: Address, entry: dict) -> Token:
+        """
+        Token with the ABI and metadata of the entry. A proxy is called at its address
+        with the ABI of its implementation, so the token is built without the proxy resolution.
+        """
+        abi = entry['abi']
+        if entry.get('proxy_implementation') is not None and entry.get('proxy_abi') is not None:
+            abi = entry['proxy_abi']
+        tok = Token(address=Address(address).checksum)
+        tok._loaded = True  # pylint:disable=protected-access
+        tok.set_abi(abi)
+        return cls.apply_metadata(tok, entry)
+
+    def load_snapshot(self, path: str = TOKEN_METADATA_SNAPSHOT) -> None:
+        """
+        Warm the cache with the entries in the snapshot: {chain_id: {address: entry}}.
+        Snapshot entries carry no block range or load time, so a proxy's entry is validated
+        against its implementation slot the first time it is used.
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        with self._lock:
+            for chain_id, tokens in snapshot.items():
+                for address, entry in tokens.items():
+                    if self.get(int(chain_id), address) is None:
+                        self.put(int(chain_id), address,
+                                 {**{field: entry.get(field) for field in SNAPSHOT_FIELDS},
+                                  'abi': entry.get('abi') or ERC_20_ABI,
+                                  'loaded_at': 0,
+                                  'validated_blocks': (-1, -2)})
+
+    def save_snapshot(self, path: str) -> None:
+        """
+        Write the ABI, proxy implementation and metadata of the cached tokens for load_snapshot.
+        """
+        snapshot = {}
+        for (chain_id, address), entry in self._cache.items():
+            if entry.get('abi') is not None:
+                snapshot.setdefault(str(chain_id), {})[str(address)] = {
+                    field: entry.get(field) for field in SNAPSHOT_FIELDS}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, indent=4, sort_keys=True)
+
+
+TOKEN_METADATA = TokenMetadataCache()
+TOKEN_METADATA.load_snapshot()
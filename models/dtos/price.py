@@ -97,6 +97,11 @@ class PriceHistoricalInput(PriceInput, MapBlockTimeSeriesInput):
     endTimestamp: int = DTOField(0, hidden=True)
 
 
+class PriceHistoricalTWAPInput(PriceHistoricalInput):
+    twapWindow: int = DTOField(
+        1800, gt=0, description='Seconds of the time-weighted average before each sample')
+
+
 class PriceHistoricalInputs(PriceInputs, MapBlockTimeSeriesInput):
     modelSlug: str = DTOField('price.quote', hidden=True)
     modelInput: dict = DTOField({}, hidden=True)
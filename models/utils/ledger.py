@@ -0,0 +1,65 @@
+from typing import Iterator, List
+
+import pandas as pd
+from credmark.cmf.types import Contract, ContractLedger
+from credmark.cmf.types.ledger import BlockTable
+
+# Position of a log in its block, to order the events of a block
+EVT_LOG_INDEX = 'evt_index'
+
+LEDGER_PAGE_SIZE = 5000
+
+
+def ledger_head(context, to_block: int) -> int:
+    """
+    The last block up to to_block that the ledger has indexed, or -1 if none.
+
+    The ledger can lag the node, so data synced from it is only complete up to this block.
+    """
+    blocks = context.ledger.get_blocks(
+        columns=[BlockTable.Columns.NUMBER],
+        where=f'{BlockTable.Columns.NUMBER} <= {to_block}',
+        order_by=f'{BlockTable.Columns.NUMBER} desc',
+        limit='1')
+    if len(blocks.data) == 0:
+        return -1
+    return int(blocks.data[0][BlockTable.Columns.NUMBER])
+
+
+def ledger_event_pages(contract: Contract, event_name: str, columns: List[str],
+                       from_block: int, to_block: int) -> Iterator[pd.DataFrame]:
+    """
+    The events of a contract in from_block < block <= to_block in pages of
+    LEDGER_PAGE_SIZE rows, ordered by block and log index.
+    """
+    block_col = ContractLedger.Events.Columns.EVT_BLOCK_NUMBER
+    offset = 0
+    while True:
+        df = (getattr(contract.ledger.events, event_name)(
+            columns=columns,
+            where=f'{block_col} > {from_block} AND {block_col} <= {to_block}',
+            order_by=f'{block_col}, {EVT_LOG_INDEX}',
+            limit=str(LEDGER_PAGE_SIZE),
+            offset=str(offset))
+            .to_dataframe())
+        yield df
+
+        if len(df) < LEDGER_PAGE_SIZE:
+            break
+        offset += LEDGER_PAGE_SIZE
+
+
+def ledger_event_records(contract: Contract, event_name: str, inputs: List[str],
+                         from_block: int, to_block: int) -> Iterator[List[dict]]:
+    """
+    Pages of ledger_event_pages as records of block_number, log_index and the inputs by name.
+    """
+    block_col = ContractLedger.Events.Columns.EVT_BLOCK_NUMBER
+    input_cols = [ContractLedger.Events.InputCol(name) for name in inputs]
+
+    for df in ledger_event_pages(contract, event_name, [block_col, EVT_LOG_INDEX] + input_cols,
+                                 from_block, to_block):
+        yield [{'block_number': int(r[block_col]),
+                'log_index': int(r[EVT_LOG_INDEX]),
+                **{name: r[col] for name, col in zip(inputs, input_cols)}}
+               for r in df.to_dict('records')]
@@ -0,0 +1,132 @@
+from typing import Any, Dict, List, Optional, Sequence
+
+from credmark.cmf.types import Address, Contract
+from eth_abi.exceptions import DecodingError
+from web3 import Web3
+from web3.contract import ContractFunction
+from web3.exceptions import BadFunctionCallOutput, ContractLogicError
+
+from models.tmp_abi_lookup import MULTICALL2_ABI
+
+# chain_id -> (Multicall2 address, deployment block)
+MULTICALL2_DEPLOYMENT = {
+    1: (Address('0x5BA1e12693Dc8F9c48aAD8770482f4739bEeD696'), 12336033),
+}
+
+MULTICALL_CHUNK_SIZE = 500
+
+CALL_ERRORS = (BadFunctionCallOutput, ContractLogicError, DecodingError, OverflowError, ValueError)
+
+
+def abi_type(output: dict) -> str:
+    """
+    Type of an ABI output for the codec, with the components of a tuple spelled out.
+    """
+    if output['type'].startswith('tuple'):
+        components = ','.join(abi_type(component) for component in output['components'])
+        return f'({components}){output["type"][len("tuple"):]}'
+    return output['type']
+
+
+def normalize_output(output: dict, value: Any) -> Any:
+    """
+    Checksum the addresses in a decoded output, as ContractFunction.call() does.
+    """
+    if output['type'].endswith(']'):
+        element = {**output, 'type': output['type'][:output['type'].rindex('[')]}
+        return [normalize_output(element, v) for v in value]
+    if output['type'] == 'tuple':
+        return tuple(normalize_output(component, v)
+                     for component, v in zip(output['components'], value))
+    if output['type'] == 'address':
+        return Web3.toChecksumAddress(value)
+    return value
+
+
+def encode_call_data(context, function: ContractFunction,
+                     contracts: Dict[str, Any]) -> str:
+    """
+    Call data of a bound function, encoded by the web3 contract of its address and ABI.
+    """
+    contract = contracts.get(function.address)
+    if contract is None:
+        contract = context.web3.eth.contract(address=function.address,
+                                             abi=function.contract_abi)
+        contracts[function.address] = contract
+    return contract.encodeABI(fn_name=function.fn_name,
+                              args=function.args, kwargs=function.kwargs)
+
+
+def decode_call_result(context, function: ContractFunction, data: bytes) -> Any:
+    """
+    Decode the return data of a function the same way as ContractFunction.call(),
+    i.e. a function with a single output returns the value instead of a list.
+    """
+    outputs = function.abi.get('outputs', [])
+    decoded = context.web3.codec.decode_abi([abi_type(output) for output in outputs], data)
+    normalized = [normalize_output(output, value) for output, value in zip(outputs, decoded)]
+    if len(normalized) == 1:
+        return normalized[0]
+    return normalized
+
+
+def call_sequential(functions: Sequence[ContractFunction]) -> List[Optional[Any]]:
+    results = []
+    for function in functions:
+        try:
+            results.append(function.call())
+        except CALL_ERRORS:
+            results.append(None)
+    return results
+
+
+def multicall_available(context) -> bool:
+    deployment = MULTICALL2_DEPLOYMENT.get(context.chain_id)
+    return deployment is not None and context.block_number >= deployment[1]
+
+
+def multicall(context,
+              functions: Sequence[ContractFunction],
+              chunk_size: int = MULTICALL_CHUNK_SIZE) -> List[Optional[Any]]:
+    """
+    Run the bound contract functions, e.g. contract.functions.getPair(a, b),
+    in as few eth_call as possible with Multicall2.tryAggregate at the context block.
+
+    Results are returned in the order of the functions. A call that reverted
+    or returned data that can not be decoded (e.g. no code at the address) gives None.
+
+    When Multicall2 is not deployed for the chain/block, or the aggregate call itself fails
+    (e.g. on a local node without the contract), the functions are called one by one.
+    """
+    if len(functions) == 0:
+        return []
+
+    if not multicall_available(context):
+        return call_sequential(functions)
+
+    multicall_contract = Contract(address=MULTICALL2_DEPLOYMENT[context.chain_id][0],
+                                  abi=MULTICALL2_ABI)
+
+    results = []
+    contracts = {}
+    for start in range(0, len(functions), chunk_size):
+        chunk = functions[start:start + chunk_size]
+        calls = [(Address(function.address).checksum,
+                  encode_call_data(context, function, contracts))
+                 for function in chunk]
+        try:
+            aggregated = multicall_contract.functions.tryAggregate(False, calls).call()
+        except CALL_ERRORS:
+            results.extend(call_sequential(chunk))
+            continue
+
+        for function, (success, data) in zip(chunk, aggregated):
+            if not success or len(data) == 0:
+                results.append(None)
+                continue
+            try:
+                results.append(decode_call_result(context, function, data))
+            except CALL_ERRORS:
+                results.append(None)
+
+    return results
@@ -0,0 +1,163 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence, Type
+
+import numpy as np
+from credmark.cmf.model.errors import (ModelRunError,
+                                       create_instance_from_error_dict)
+from credmark.cmf.types.compose import MapInputsOutput
+
+# Upper bound of model runs (and so RPCs) in flight from one fan-out.
+# Fan-outs run in threads only if CREDMARK_MODEL_MAX_WORKERS is set above 1,
+# for a model context, model cache and web3 provider that can be used from threads.
+# Otherwise the model runs of a fan-out go in one compose.map-inputs run.
+MAX_WORKERS_ENV = 'CREDMARK_MODEL_MAX_WORKERS'
+DEFAULT_MAX_WORKERS = 1
+
+_worker_state = threading.local()
+
+
+class ModelRunResult(NamedTuple):
+    """
+    Result of running a model on one of the inputs: either output or error is set.
+    """
+    input: Any
+    output: Optional[Any]
+    error: Optional[Exception]
+
+    def get(self):
+        """
+        Return the output, or raise the error.
+        """
+        if isinstance(self.error, Exception):
+            raise self.error
+        return self.output
+
+
+def get_max_workers() -> int:
+    return max(1, int(os.environ.get(MAX_WORKERS_ENV, DEFAULT_MAX_WORKERS)))
+
+
+def use_threads(n_items: int, max_workers: Optional[int] = None) -> bool:
+    """
+    Whether a fan-out of the items runs concurrently in map_parallel's thread pool.
+    """
+    if max_workers is None:
+        max_workers = get_max_workers()
+    return (max_workers > 1 and n_items > 1 and
+            not getattr(_worker_state, 'in_worker', False))
+
+
+def map_parallel(func: Callable[[Any], Any],
+                 items: Sequence[Any],
+                 max_workers: Optional[int] = None) -> List[ModelRunResult]:
+    """
+    Call func for each of the items in a bounded thread pool.
+
+    The results are in the order of the items. An exception raised by a call
+    is kept in the result's error, so that the caller decides to skip or re-raise it.
+
+    A fan-out started from a worker of another fan-out runs its items one by one,
+    so nested models do not multiply the threads in flight. The numpy error settings
+    of the caller, e.g. np.seterr(all='raise') of the model modules, apply in the workers.
+    """
+    if max_workers is None:
+        max_workers = get_max_workers()
+    np_errors = np.geterr()
+
+    def _call(item):
+        try:
+            return ModelRunResult(input=item, output=func(item), error=None)
+        except Exception as err:
+            return ModelRunResult(input=item, output=None, error=err)
+
+    def _call_in_worker(item):
+        _worker_state.in_worker = True
+        try:
+            with np.errstate(**np_errors):
+                return _call(item)
+        finally:
+            _worker_state.in_worker = False
+
+    if not use_threads(len(items), max_workers):
+        return [_call(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(_call_in_worker, items))
+
+
+def compose_results(model_inputs: Sequence[Any], results) -> List[ModelRunResult]:
+    """
+    Results of a compose.map-inputs run as ModelRunResult, with the errors as exceptions.
+    """
+    model_run_results = []
+    for model_input, result in zip(model_inputs, results):
+        if result.error is not None:
+            error = create_instance_from_error_dict(result.error.dict())
+        elif result.output is None:
+            error = ModelRunError('compose.map-inputs: output/error cannot be both None')
+        else:
+            error = None
+        model_run_results.append(ModelRunResult(input=model_input,
+                                                output=result.output if error is None else None,
+                                                error=error))
+    return model_run_results
+
+
+def run_model_parallel(context,
+                       slug: str,
+                       model_inputs: Sequence[Any],
+                       return_type: Optional[Type] = None,
+                       max_workers: Optional[int] = None) -> List[ModelRunResult]:
+    """
+    Run the model for each of the inputs, at the context's block, in map_parallel's
+    thread pool if it runs concurrently, otherwise in one compose.map-inputs run.
+    """
+    if use_threads(len(model_inputs), max_workers):
+        return map_parallel(lambda model_input: context.run_model(slug,
+                                                                  model_input,
+                                                                  return_type=return_type),
+                            model_inputs,
+                            max_workers)
+    if len(model_inputs) == 0:
+        return []
+
+    results = context.run_model(
+        slug='compose.map-inputs',
+        input={'modelSlug': slug, 'modelInputs': list(model_inputs)},
+        return_type=MapInputsOutput[dict, return_type or dict])
+    return compose_results(model_inputs, results)
+
+
+def run_models_parallel(context,
+                        slugs: Sequence[str],
+                        model_input: Any,
+                        return_type: Optional[Type] = None,
+                        max_workers: Optional[int] = None) -> List[ModelRunResult]:
+    """
+    Run each of the models for the input, as run_model_parallel does for the inputs
+    of one model. The input of each result is the model's slug.
+    """
+    if use_threads(len(slugs), max_workers):
+        return map_parallel(lambda slug: context.run_model(slug,
+                                                           model_input,
+                                                           return_type=return_type),
+                            slugs,
+                            max_workers)
+    if len(slugs) == 0:
+        return []
+
+    results = context.run_model(
+        slug='compose.map-inputs',
+        input={'modelSlug': 'compose.map-inputs',
+               'modelInputs': [{'modelSlug': slug, 'modelInputs': [model_input]}
+                               for slug in slugs]},
+        return_type=MapInputsOutput[dict, MapInputsOutput[dict, return_type or dict]])
+    model_run_results = []
+    for slug_result in compose_results(slugs, results):
+        if slug_result.error is None:
+            slug_result = (compose_results([model_input], slug_result.output)[0]
+                           ._replace(input=slug_result.input))
+        model_run_results.append(slug_result)
+    return model_run_results
@@ -0,0 +1,186 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from threading import RLock
+from typing import Any, Optional
+
+from models.utils.store import SQLiteStore
+
+# Outputs of models at blocks this deep below the chain head are final and cached on disk.
+# Set CREDMARK_MODEL_RESULT_CACHE=0 to disable the cache.
+RESULT_CACHE_ENV = 'CREDMARK_MODEL_RESULT_CACHE'
+FINALITY_DEPTH_ENV = 'CREDMARK_MODEL_FINALITY_DEPTH'
+RESULT_CACHE_SIZE_ENV = 'CREDMARK_MODEL_RESULT_CACHE_SIZE'
+DEFAULT_FINALITY_DEPTH = 64
+DEFAULT_RESULT_CACHE_SIZE = 200000
+
+RESULT_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT NOT NULL PRIMARY KEY,
+    slug TEXT NOT NULL,
+    version TEXT NOT NULL,
+    chain_id INTEGER NOT NULL,
+    block_number INTEGER NOT NULL,
+    output TEXT NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_slug ON results (slug, version);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+"""
+
+
+def normalize_input(value: Any) -> Any:
+    """
+    Input as plain JSON values, without ABIs and unset fields, which do not change the output.
+    """
+    if hasattr(value, 'dict'):
+        value = value.dict()
+    if isinstance(value, dict):
+        return {str(k): normalize_input(v) for k, v in value.items()
+                if k != 'abi' and v is not None}
+    if isinstance(value, (list, tuple)):
+        return [normalize_input(v) for v in value]
+    if isinstance(value, (bool, int, float)) or value is None:
+        return value
+    return str(value)
+
+
+class ModelResultStore:
+    """
+    On-disk outputs of model runs, keyed by the hash of slug, version, chain, block and input.
+
+    - Only runs at blocks at least the finality depth below the chain head are stored.
+    - The least recently used results are evicted above the size limit.
+    - Results of other versions of a slug are dropped when a version is first stored,
+      so a version bump in Model.describe invalidates them.
+    """
+
+    HEAD_TTL = 60
+    EVICT_EVERY = 1000
+
+    _store: Optional['ModelResultStore'] = None
+    _open_failed = False
+    _store_lock = RLock()
+
+    def __init__(self):
+        self.store = SQLiteStore.open('model_results')
+        self.store.execute_script(RESULT_STORE_SCHEMA)
+        self.finality_depth = int(os.environ.get(FINALITY_DEPTH_ENV, DEFAULT_FINALITY_DEPTH))
+        self.max_size = int(os.environ.get(RESULT_CACHE_SIZE_ENV, DEFAULT_RESULT_CACHE_SIZE))
+        self._lock = RLock()
+        self._heads = {}
+        self._versions_checked = set()
+        self._puts = 0
+
+    @classmethod
+    def open(cls) -> Optional['ModelResultStore']:
+        """
+        The store of the process, opened on first use, or None if the cache is disabled
+        or the store can not be opened, e.g. on a read-only file system.
+        """
+        if os.environ.get(RESULT_CACHE_ENV, '1') == '0':
+            return None
+        with cls._store_lock:
+            if cls._store is None and not cls._open_failed:
+                try:
+                    cls._store = cls()
+                except (OSError, sqlite3.Error):
+                    cls._open_failed = True
+            return cls._store
+
+    @staticmethod
+    def result_key(slug: str, version: str, chain_id: int, block_number: int, model_input) -> str:
+        canonical = json.dumps([slug, version, chain_id, block_number,
+                                normalize_input(model_input)],
+                               sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def head_block(self, context) -> int:
+        with self._lock:
+            head, read_at = self._heads.get(context.chain_id, (None, 0))
+            if head is None or time.time() - read_at > self.HEAD_TTL:
+                head = int(context.web3.eth.block_number)
+                self._heads[context.chain_id] = (head, time.time())
+            return head
+
+    def is_final(self, context) -> bool:
+        return int(context.block_number) <= self.head_block(context) - self.finality_depth
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self.store.query_one('SELECT output FROM results WHERE key = ?', (key,))
+        if row is None:
+            return None
+        self.store.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, slug: str, version: str, chain_id: int, block_number: int,
+            output: dict) -> None:
+        statements = []
+        with self._lock:
+            if (slug, version) not in self._versions_checked:
+                self._versions_checked.add((slug, version))
+                statements.append(('DELETE FROM results WHERE slug = ? AND version != ?',
+                                   [(slug, version)]))
+            self._puts += 1
+            evict = self._puts % self.EVICT_EVERY == 0
+
+        statements.append(('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           [(key, slug, version, chain_id, block_number,
+                             json.dumps(output, default=str), time.time())]))
+        self.store.execute_many(statements)
+        if evict:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Drop the least recently used results down to 90% of the size limit.
+        """
+        row = self.store.query_one('SELECT COUNT(*) FROM results')
+        excess = (0 if row is None else row[0]) - self.max_size
+        if excess > 0:
+            self.store.execute(
+                'DELETE FROM results WHERE key IN '
+                '(SELECT key FROM results ORDER BY last_used LIMIT ?)',
+                (excess + self.max_size // 10,))
+
+    def clear(self) -> None:
+        self.store.execute('DELETE FROM results')
+
+
+def cache_result(run):
+    """
+    Decorator of Model.run to reuse the output of a previous run at a final block.
+    The output is rebuilt with the return annotation of run.
+    The model runs uncached when the store is not available.
+    """
+    output_type = run.__annotations__.get('return')
+
+    @functools.wraps(run)
+    def wrapper(self, input):
+        context = self.context
+        result_store = ModelResultStore.open()
+        if result_store is None or not result_store.is_final(context):
+            return run(self, input)
+
+        block_number = int(context.block_number)
+        key = result_store.result_key(self.slug, self.version, context.chain_id,
+                                      block_number, input)
+        try:
+            cached = result_store.get(key)
+        except (OSError, sqlite3.Error):
+            return run(self, input)
+        if cached is not None:
+            return cached if output_type is None else output_type(**cached)
+
+        output = run(self, input)
+        try:
+            result_store.put(key, self.slug, self.version, context.chain_id, block_number,
+                             output.dict() if hasattr(output, 'dict') else output)
+        except (OSError, sqlite3.Error):
+            pass
+        return output
+
+    return wrapper
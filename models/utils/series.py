@@ -0,0 +1,119 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from credmark.cmf.model.errors import create_instance_from_error_dict
+from credmark.cmf.types.compose import MapBlockTimeSeriesOutput
+from credmark.cmf.types.ledger import BlockTable
+from models.dtos.price import Prices
+
+
+class PriceSeriesColumns:
+    """
+    Columnar view of a MapBlockTimeSeriesOutput[Prices] for n assets and m samples:
+    block_numbers, block_timestamps and sample_timestamps of shape (m,),
+    prices and src of shape (n, m), with the samples in descending order of block number.
+    """
+
+    def __init__(self,
+                 block_numbers: np.ndarray,
+                 block_timestamps: np.ndarray,
+                 sample_timestamps: np.ndarray,
+                 prices: np.ndarray,
+                 src: np.ndarray):
+        self.block_numbers = block_numbers
+        self.block_timestamps = block_timestamps
+        self.sample_timestamps = sample_timestamps
+        self.prices = prices
+        self.src = src
+
+    @classmethod
+    def from_series(cls,
+                    series: MapBlockTimeSeriesOutput[Prices],
+                    n_assets: Optional[int] = None,
+                    descending: bool = True) -> 'PriceSeriesColumns':
+        """
+        Fill the columns in a single pass over the samples. A sample with error raises it.
+        """
+        results = list(series)
+        n_samples = len(results)
+        if n_assets is None:
+            n_assets = max((len(r.output.prices) for r in results if r.output is not None),
+                           default=0)
+
+        block_numbers = np.empty(n_samples, dtype=np.int64)
+        block_timestamps = np.empty(n_samples, dtype=np.int64)
+        sample_timestamps = np.empty(n_samples, dtype=np.int64)
+        prices = np.full((n_assets, n_samples), np.nan)
+        src = np.full((n_assets, n_samples), None, dtype=object)
+
+        for sample_n, result in enumerate(results):
+            if result.error is not None:
+                raise create_instance_from_error_dict(result.error.dict())
+            block_numbers[sample_n] = result.blockNumber
+            block_timestamps[sample_n] = result.blockTimestamp
+            sample_timestamps[sample_n] = result.sampleTimestamp
+            if result.output is not None:
+                for asset_n, price in enumerate(result.output.prices):
+                    prices[asset_n, sample_n] = price.price
+                    src[asset_n, sample_n] = price.src
+
+        order = np.argsort(block_numbers, kind='stable')
+        if descending:
+            order = order[::-1]
+
+        return cls(block_numbers[order],
+                   block_timestamps[order],
+                   sample_timestamps[order],
+                   prices[:, order],
+                   src[:, order])
+
+    def block_times(self) -> pd.DatetimeIndex:
+        return pd.to_datetime(self.block_timestamps, unit='s')
+
+    def to_arrow(self) -> pa.Table:
+        """
+        One row per sample, with columns price_{n} and src_{n} for the n-th asset.
+        """
+        columns = {'blockNumber': self.block_numbers,
+                   'blockTimestamp': self.block_timestamps,
+                   'sampleTimestamp': self.sample_timestamps}
+        for asset_n in range(self.prices.shape[0]):
+            columns[f'price_{asset_n}'] = self.prices[asset_n]
+            columns[f'src_{asset_n}'] = pa.array(self.src[asset_n].tolist(), type=pa.string())
+        return pa.table(columns)
+
+
+def sample_blocks(context, interval: int, count: int, exclusive: bool = False) \
+        -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Sample timestamps of compose.map-block-time-series ending at the context block,
+    in ascending order, with the number and timestamp of the last block at or before each.
+    The blocks come from one ledger query. None if an interval has no block.
+    """
+    end_timestamp = int(context.block_number.timestamp)
+    first_n = 1 if exclusive else 0
+    sample_timestamps = np.array([end_timestamp - n * interval
+                                  for n in range(first_n, first_n + count)][::-1])
+
+    last_timestamp = int(sample_timestamps[-1])
+    interval_n = f'FLOOR(({last_timestamp} - {BlockTable.Columns.TIMESTAMP}) / {interval})'
+    blocks = context.ledger.get_blocks(
+        aggregates=[
+            context.ledger.Aggregate(f'MAX({BlockTable.Columns.NUMBER})', 'number'),
+            context.ledger.Aggregate(f'MAX({BlockTable.Columns.TIMESTAMP})', 'timestamp'),
+            context.ledger.Aggregate(interval_n, 'interval_n')],
+        where=(f'{BlockTable.Columns.TIMESTAMP} > {int(sample_timestamps[0]) - interval} AND '
+               f'{BlockTable.Columns.TIMESTAMP} <= {last_timestamp}'),
+        group_by=interval_n)
+
+    block_by_interval = {int(r['interval_n']): (int(r['number']), int(r['timestamp']))
+                         for r in blocks.data}
+    sample_n = (last_timestamp - sample_timestamps) // interval
+    if any(int(n) not in block_by_interval for n in sample_n):
+        return None
+
+    block_numbers = np.array([block_by_interval[int(n)][0] for n in sample_n], dtype=np.int64)
+    block_timestamps = np.array([block_by_interval[int(n)][1] for n in sample_n], dtype=np.int64)
+    return sample_timestamps, block_numbers, block_timestamps
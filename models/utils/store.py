@@ -0,0 +1,72 @@
+import os
+import sqlite3
+from threading import RLock
+from typing import Any, Dict, Iterable, List, Sequence
+
+# Local on-disk stores for data that is immutable once final on chain, e.g. pool creations.
+# Set CREDMARK_MODEL_CACHE_DIR to relocate them.
+CACHE_DIR_ENV = 'CREDMARK_MODEL_CACHE_DIR'
+DEFAULT_CACHE_DIR = os.path.join('tmp', 'cache')
+
+
+def get_cache_dir() -> str:
+    cache_dir = os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+class SQLiteStore:
+    """
+    A SQLite database in the cache directory shared by all models in the process.
+    Statements are serialized with a lock so a store can be used from worker threads.
+    """
+
+    _stores: Dict[str, 'SQLiteStore'] = {}
+    _stores_lock = RLock()
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+
+    @classmethod
+    def open(cls, name: str) -> 'SQLiteStore':
+        with cls._stores_lock:
+            store = cls._stores.get(name)
+            if store is None:
+                store = cls(os.path.join(get_cache_dir(), f'{name}.sqlite3'))
+                cls._stores[name] = store
+            return store
+
+    def execute_script(self, script: str) -> None:
+        with self._lock:
+            self._conn.executescript(script)
+            self._conn.commit()
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> None:
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def execute_many(self, statements: Iterable[tuple]) -> None:
+        """
+        Run (sql, rows) pairs of executemany in a single transaction.
+        """
+        with self._lock:
+            try:
+                for sql, rows in statements:
+                    self._conn.executemany(sql, rows)
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+
+    def query(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql: str, params: Sequence[Any] = ()):
+        rows = self.query(sql, params)
+        return rows[0] if len(rows) > 0 else None
@@ -1,6 +1,7 @@
 # pylint:disable=unused-import,line-too-long
 
 import argparse
+import json
 import logging
 import os
 import sys
@@ -39,11 +40,14 @@ if __name__ == '__main__':
                         help=('Test type: \n'
                               '- prod(local model + gw)\n'
                               '- test(local gw)\n'
-                              '- gw (official gateway only'))
+                              '- gw (official gateway only)\n'
+                              '- node (local model + gw, with a local node for chain 1)'))
     parser.add_argument('start_n', type=int, default=0,
                         help=('case number to start'))
     parser.add_argument('-b', '--block_number', type=int, default=14249443,
                         help=('Block number to run'))
+    parser.add_argument('-n', '--node_url', type=str, default='http://localhost:8545',
+                        help=('URL of the local node for test type node'))
     parser.add_argument('-s', '--serial', action='store_true', default=False,
                         help=('Run tests in serial'))
 
@@ -57,6 +61,9 @@ if __name__ == '__main__':
     elif args['type'] == 'prod':
         CMKTest.post_flag = []
         CMKTest.pre_flag = []
+    elif args['type'] == 'node':
+        CMKTest.post_flag = ['--provider_url_map', json.dumps({'1': args['node_url']})]
+        CMKTest.pre_flag = []
     elif args['type'] == 'gw':
         CMKTest.post_flag = ['-l', '-']
         CMKTest.pre_flag = ['--model_path', 'x']
@@ -21,7 +21,10 @@ class TestAAVE(CMKTest):
         # 0xE41d2489571d322189246DaFA5ebDe1F4699F498: ZRX
         self.run_model('aave-v2.token-liability', {"address": "0xE41d2489571d322189246DaFA5ebDe1F4699F498"})
         self.run_model('aave-v2.token-liability', {"symbol": "USDC"})
-        self.run_model('aave-v2.overall-liabilities-portfolio', {})  # aave-v2.token-liability
+        self.run_model('aave-v2.overall-liabilities-portfolio', {})
         # 0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48: USDC
 
         self.run_model('aave-v2.lending-pool-assets', {}, block_number=12770589)
+        self.run_model('aave-v2.overall-liabilities-portfolio', {}, block_number=12770589)
+
+        self.run_model('aave-v2.token-asset-historical', {"symbol": "USDC", "interval": 86400, "count": 7, "exclusive": False})
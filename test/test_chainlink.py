@@ -65,6 +65,11 @@ class TestChainlink(CMKTest):
                        {"base": {"address": "0xEeeeeEeeeEeEeeEeEeEeeEEEeeeeEeeeeeeeEEeE"}}, block_number=self.block_number)
         self.run_model('price.oracle-chainlink',
                        {"base": {"address": "0xbBbBBBBbbBBBbbbBbbBbbbbBBbBbbbbBbBbbBBbB"}}, block_number=self.block_number)
+        # AAVE/BTC is routed with AAVE/USD and BTC/USD
+        self.run_model('price.oracle-chainlink', {"base": {"symbol": "AAVE"}, "quote": {"symbol": "BTC"}}, block_number=self.block_number)
+        # CMK has no feed
+        self.run_model('price.oracle-chainlink',
+                       {"base": {"address": "0x68cfb82eacb9f198d508b514d898a403c449533e"}}, exit_code=1, block_number=self.block_number)
 
     def test_price_by_feed(self):
         self.title('Chainlink - Feed')
@@ -11,6 +11,9 @@ class TestCompound(CMKTest):
         self.run_model('compound-v2.get-pool-info', {"address": "0x70e36f6bf80a52b3b46b3af8e106cc0ed743e8e4"})
         # ${token_price_deps}, compound-v2.get-comptroller
         self.run_model('compound-v2.get-pool-info', {"address": "0x95b4ef2869ebd94beb4eee400a99824bf5dc325b"})
+        # run twice at a final block: the second run is served from the result cache
+        self.run_model('compound-v2.get-pool-info', {"address": "0x70e36f6bf80a52b3b46b3af8e106cc0ed743e8e4"}, block_number=15000000)
+        self.run_model('compound-v2.get-pool-info', {"address": "0x70e36f6bf80a52b3b46b3af8e106cc0ed743e8e4"}, block_number=15000000)
 
         self.run_model('compound-v2.get-comptroller', {})
         self.run_model('compound-v2.get-pools', {})  # compound-v2.get-pool-info
@@ -23,3 +26,4 @@ class TestCompound(CMKTest):
 
     def test_2(self):
         self.run_model('compound-v2.all-pools-info', {}, block_number=12770589)
+        self.run_model('compound-v2.all-pools-info', {}, block_number=15000000)
@@ -8,6 +8,7 @@ class TestCurve(CMKTest):
         self.title('Curve - Pool Info')
 
         self.run_model('curve-fi.all-pools', {})  # curve-fi.get-registry,curve-fi.get-provider
+        self.run_model('curve-fi.all-pools', {}, block_number=13000000)
 
         self.run_model('curve-fi.all-pools-info', {})  # __all__
 
@@ -58,6 +59,10 @@ class TestCurve(CMKTest):
         self.run_model('curve-fi.pool-info', {"address": "0xbEbc44782C7dB0a1A60Cb6fe97d0b483032FF1C7"})
         # ${curve_pool_info_tvl}
         self.run_model('curve-fi.pool-tvl', {"address": "0xbEbc44782C7dB0a1A60Cb6fe97d0b483032FF1C7"})
+        self.run_model('curve-fi.pool-depeg-curve',
+                       {"pool": {"address": "0xbEbc44782C7dB0a1A60Cb6fe97d0b483032FF1C7"},
+                        "token": {"address": "0x6B175474E89094C44Da98b954EedeAC495271d0F"},
+                        "amounts": [1000, 1000000, 100000000]})
 
         # Curve.fi USD-BTC-ETH
         self.run_model('curve-fi.pool-info', {"address": "0xD51a44d3FaE010294C616388b506AcdA1bfAAE46"})
@@ -90,6 +95,7 @@ class TestCurve(CMKTest):
         self.run_model('curve-fi.all-gauge-claim-addresses', {"address": "0x824F13f1a2F29cFEEa81154b46C0fc820677A637"})
         # 0x72E158d38dbd50A483501c24f792bDAAA3e7D55C is Curve.fi FRAX3CRV-f Gauge Deposit (FRAX3CRV-...)
         self.run_model('curve-fi.all-gauge-claim-addresses', {"address": "0x72E158d38dbd50A483501c24f792bDAAA3e7D55C"})
+        self.run_model('curve-fi.get-gauge-stake-and-claimable-rewards', {"address": "0x72E158d38dbd50A483501c24f792bDAAA3e7D55C"})
         self.run_model('contrib.curve-get-pegging-ratio', {"address": "0xfd5db7463a3ab53fd211b4af195c5bccc1a03890"})
         self.run_model('contrib.curve-get-pegging-ratio-historical',
                        {"pool": {"address": "0xfd5db7463a3ab53fd211b4af195c5bccc1a03890"}, "date_range": ["2022-01-10", "2022-01-15"]})
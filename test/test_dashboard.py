@@ -11,6 +11,8 @@ class TestDashboard(CMKTest):
                        "count": 2, "address": "0xd632f22692FaC7611d2AA1C0D552930D43CAEd3B"}, block_number=14048685)
         self.run_model('dex.pool-volume-historical', {"pool_info_model": "curve-fi.pool-tvl", "interval": 7200,
                        "count": 2, "address": "0xd632f22692FaC7611d2AA1C0D552930D43CAEd3B"}, block_number=15048685)
+        self.run_model('dex.pool-volume-historical', {"pool_info_model": "uniswap-v2.pool-tvl", "interval": 7200,
+                       "count": 30, "address": "0xB4e16d0168e52d35CaCD2c6185b44281Ec28C9Dc"}, block_number=15048685)
 
     def test_tvl_volume_uni(self):
         # Uniswap V2: 0xCEfF51756c56CeFFCA006cD410B03FFC46dd3a58
@@ -16,6 +16,16 @@ class TestFinance(CMKTest):
                         "portfolio": {"positions":
                                       [{"amount": 10, "asset": {"address": "0xbBbBBBBbbBBBbbbBbbBbbbbBBbBbbbbBbBbbBBbB"}}]}})  # __all__
 
+    def test_rolling(self):
+        # The second run only prices the samples after the first run's window
+        for block_number in [15000000, 15006500]:
+            self.run_model('finance.var-portfolio-rolling',
+                           {"window": "30 days", "interval": 1, "confidence": 0.01,
+                            "portfolio": {"positions":
+                                          [{"amount": 10, "asset": {"symbol": "WETH"}},
+                                           {"amount": 100, "asset": {"symbol": "AAVE"}}]}},
+                           block_number=block_number)
+
     def test2(self):
         self.run_model('finance.var-portfolio-historical',
                        {"window": "100 days", "interval": 1, "confidence": 0.01,
@@ -112,3 +122,7 @@ class TestFinance(CMKTest):
                            "errors": []}, "risk_free_rate": 0.02})
 
         # self.run_model('finance.sharpe-ratio-token', {"token": {"address": "0x7Fc66500c84A76Ad7e9c93437bFc5Ac33E2DDaE9"}, "window": "360 days", "risk_free_rate": 0.02})
+
+    def test_liquidation_stress(self):
+        self.run_model('finance.liquidation-stress-aave', {"shocks": [-0.5, -0.3, -0.1, 0.0]}, block_number=12770589)
+        self.run_model('finance.liquidation-stress-compound', {"shocks": [-0.3], "shockedAssets": [{"symbol": "WETH"}]}, block_number=12770589)
@@ -13,6 +13,10 @@ class TestPrice(CMKTest):
         self.run_model('price.quote', {"base": "ETH", "quote": "JPY"})
         self.run_model('price.quote', {"base": "AAVE", "quote": "ETH"})
         self.run_model('price.quote', {"base": "0x853d955acef822db058eb8505911ed77f175b99e"})
+        # Repeated and flipped pairs are served from the in-process price cache
+        self.run_model('price.quote-multiple', {"inputs": [{"base": "AAVE", "quote": "ETH"},
+                                                           {"base": "ETH", "quote": "AAVE"},
+                                                           {"base": "AAVE", "quote": "ETH"}]})
 
     def test_general(self):
         self.title('Price - General')
@@ -35,6 +39,9 @@ class TestPrice(CMKTest):
 
         self.run_model('price.quote-historical', {"base": {"symbol": "AAVE"},
                        "interval": 86400, "count": 1, "exclusive": True})
+        # ETH/USD for a year from the Chainlink answer history
+        self.run_model('price.quote-historical', {"base": {"symbol": "WETH"},
+                       "interval": 86400, "count": 365, "exclusive": False}, block_number=15000108)
         self.run_model('price.quote-multiple', {"inputs": [{"base": {"symbol": "EUR"}}, {"base": {"symbol": "JPY"}}]})
         self.run_model('price.quote-historical-multiple',
                        {"inputs": [{"base": {"symbol": "AAVE"}}], "interval": 86400, "count": 1, "exclusive": True})
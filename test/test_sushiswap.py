@@ -13,10 +13,12 @@ class TestSushiSwap(CMKTest):
         self.run_model('sushiswap.get-weighted-price', {"symbol": "DAI"})
         self.run_model('sushiswap.get-weighted-price', {"symbol": "WETH"})
         self.run_model('sushiswap.get-weighted-price', {"symbol": "MKR"})
+        self.run_model('sushiswap.get-weighted-price-historical', {"base": {"symbol": "AAVE"}, "interval": 86400, "count": 30, "exclusive": False})
         self.run_model('sushiswap.all-pools', {})
         self.run_model('sushiswap.get-pool', {"token0": {"symbol": "DAI"}, "token1": {"symbol": "WETH"}})
         # CMK_ADDRESS, sushiswap.get-v2-factory
         self.run_model('sushiswap.get-pools', {"address": "0x68CFb82Eacb9f198d508B514d898a403c449533E"})
+        self.run_model('sushiswap.get-pools-tokens', {"tokens": [{"symbol": "AAVE"}, {"symbol": "MKR"}]})
         self.run_model('uniswap-v2.get-pool-info', {"address": "0x397FF1542f962076d0BFE58eA045FfA2d347ACa0"})
 
         self.run_model('sushiswap.get-pool-info-token-price',
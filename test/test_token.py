@@ -8,10 +8,10 @@ class TestToken(CMKTest):
         self.title("Account Examples")
         self.run_model('account.portfolio', {"address": "0xCE017A1dcE5A15668C4299263019c017154ACE17"})
 
-        # Working but taking long time.
+        # Accounts with many tokens, from one ledger query and one batch of balanceOf
         # Test account 1: 0xe78388b4ce79068e89bf8aa7f218ef6b9ab0e9d0
         # Test account 2: 0xbdfa4f4492dd7b7cf211209c4791af8d52bf5c50
-        # self.run_model('account.portfolio', {"address": "0xbdfa4f4492dd7b7cf211209c4791af8d52bf5c50"})
+        self.run_model('account.portfolio', {"address": "0xbdfa4f4492dd7b7cf211209c4791af8d52bf5c50"})
 
     def test_tokens(self):
         self.title("Token Examples")
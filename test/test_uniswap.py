@@ -19,20 +19,42 @@ class TestUniswap(CMKTest):
         self.run_model('uniswap-v2.get-weighted-price', {"symbol": "DAI"})
         self.run_model('uniswap-v2.get-weighted-price', {"symbol": "WETH"})
         self.run_model('uniswap-v2.get-weighted-price', {"symbol": "MKR"})
+        self.run_model('uniswap-v2.get-weighted-price-historical', {"base": {"symbol": "AAVE"}, "interval": 86400, "count": 30, "exclusive": False})
         # 0xD533a949740bb3306d119CC777fa900bA034cd52: Curve DAO Token (CRV)
         self.run_model('uniswap-v2.get-pools', {"address": "0xD533a949740bb3306d119CC777fa900bA034cd52"})
+        # Before Multicall2 deployment, the lookups fall back to sequential calls
+        self.run_model('uniswap-v2.get-pools', {"address": "0xD533a949740bb3306d119CC777fa900bA034cd52"}, block_number=12000000)
+        self.run_model('uniswap-v2.get-pools-tokens', {"tokens": [{"symbol": "AAVE"}, {"symbol": "MKR"}, {"symbol": "WETH"}]})
 
         self.title('Uniswap V3')
         # uniswap-v3.get-pool-info, uniswap-v3.get-pool-info-token-price
         self.run_model('uniswap-v3.get-weighted-price', {"symbol": "USDC"})
         self.run_model('uniswap-v3.get-weighted-price', {"symbol": "AAVE"})  # uniswap-v3.get-pool-info
         self.run_model('uniswap-v3.get-weighted-price', {"symbol": "DAI"})  # uniswap-v3.get-pool-info
+        self.run_model('uniswap-v3.get-weighted-price-historical', {"base": {"symbol": "AAVE"}, "interval": 3600, "count": 24, "exclusive": False, "twapWindow": 600})
+        # WBTC (8 decimals) is weighted over its pools with WETH (18 decimals) and USDC (6 decimals)
+        self.run_model('uniswap-v3.get-weighted-price-historical', {"base": {"symbol": "WBTC"}, "interval": 3600, "count": 24, "exclusive": False, "twapWindow": 600}, block_number=15000108)
+        # USDC/WETH 0.05% and 0.3%
+        self.run_model('uniswap-v3.get-pools-depth', {"pools": [{"address": "0x88e6a0c2ddd26feeb64f039a2c41296fcb3f5640"}, {"address": "0x8ad599c3a0ff1de082011efddc58f1908eb6e6d8"}], "token": {"symbol": "WETH"}, "amounts": [1, 100, 10000], "ranges": [0.01, 0.05]}, block_number=15000108)
         self.run_model('uniswap-v3.get-weighted-price', {"symbol": "WETH"})  # uniswap-v3.get-pool-info
         self.run_model('uniswap-v3.get-weighted-price', {"symbol": "MKR"})  # uniswap-v3.get-pool-info
         self.run_model('uniswap-v3.get-weighted-price', {"symbol": "CMK"})  # uniswap-v3.get-pool-info
         self.run_model('uniswap-v3.get-pools', {"symbol": "MKR"})
+        # Earlier block is served from the pool index synced at the later block
+        self.run_model('uniswap-v3.get-pools', {"symbol": "MKR"}, block_number=13000000)
+        self.run_model('uniswap-v3.get-pools-tokens', {"tokens": [{"symbol": "AAVE"}, {"symbol": "MKR"}, {"symbol": "CMK"}]})
         # WETH/CMK pool: 0x59e1f901b5c33ff6fae15b61684ebf17cca7b9b3
         self.run_model('uniswap-v3.get-pool-info', {"address": "0x59e1f901b5c33ff6fae15b61684ebf17cca7b9b3"})
 
         self.run_model('uniswap-v2.get-pool-info-token-price', {"address":"0x853d955acef822db058eb8505911ed77f175b99e"}, block_number=15048685)
         self.run_model('uniswap-v2.get-pool-info-token-price', {"address":"0x853d955acef822db058eb8505911ed77f175b99e"}, block_number=14048685)
+
+    def test_pool_discovery(self):
+        self.title('Uniswap pool discovery')
+
+        # Run with `python test/run.py node 0` against a local node, e.g. a fork of mainnet.
+        # Before Multicall2 deployment (12336033), the lookups are sequential calls.
+        for block_number in [12000000, None]:
+            self.run_model('uniswap-v2.get-pools-tokens', {"tokens": [{"symbol": "AAVE"}, {"symbol": "MKR"}, {"symbol": "USDC"}]}, block_number=block_number)
+            self.run_model('sushiswap.get-pools-tokens', {"tokens": [{"symbol": "AAVE"}, {"symbol": "MKR"}, {"symbol": "USDC"}]}, block_number=block_number)
+            self.run_model('uniswap-v3.get-pools-tokens', {"tokens": [{"symbol": "AAVE"}, {"symbol": "MKR"}, {"symbol": "USDC"}]}, block_number=block_number)